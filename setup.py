@@ -24,12 +24,13 @@ correlation_module = Extension('sga.toolbox._c_impl',
         sources=['sga/toolbox/src/c_impl.i', 'sga/toolbox/src/correlation.c', 'sga/toolbox/src/table_norm.c', 'sga/toolbox/src/safe.c'],
         include_dirs = [numpy_include],
         swig_opts=['-threads', '-modern', '-outdir', 'sga/toolbox/'],
-        libraries = ['gsl', 'gslcblas','m'],
-        extra_compile_args = ["-O3"],
+        libraries = ['gsl', 'gslcblas','m', 'pthread'],
+        extra_compile_args = ["-O3", "-pthread"],
     )
 
 console_scripts = [
     'sga-similarity=sga.similarity:main',
+    'sga-similarity-query=sga.query:main',
     'sga-safe=sga.safe:main'
 ]
 
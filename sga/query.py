@@ -0,0 +1,194 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+import logging
+import sys
+
+import h5py
+
+import numpy as np
+import pandas as p
+
+from .toolbox.storage import FORMAT_HDF5, CondensedMatrix, EdgeList, LazyMatrix, guess_format
+
+
+logger = logging.getLogger(__name__)
+
+class SimilarityStore(object):
+    '''
+    Random access to a similarity matrix saved by sga-similarity.
+
+    Full (hdf5 or npy), condensed and top-k edge list outputs are opened
+    without reading their values. Only the rows needed by a query are read
+    from disk, labels are mapped to rows through an in-memory index.
+
+    Args:
+        matrix: Opened LazyMatrix, CondensedMatrix or EdgeList.
+    '''
+
+    DATASETS = (
+        ('matrix', LazyMatrix),
+        ('condensed', CondensedMatrix),
+        ('edges', EdgeList),
+    )
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self._offsets = None
+        self._order = None
+
+    @classmethod
+    def open(cls, path, dataset=None):
+        """Open a saved similarity matrix.
+
+        Args:
+            path: hdf5 or npy file written by sga-similarity.
+            dataset: hdf5 dataset name. Detected from the file if not given.
+
+        Returns:
+            SimilarityStore.
+        """
+        if path.endswith('.txt'):
+            raise ValueError('Text results can not be queried, save them with --output-format hdf5 or npy')
+
+        if guess_format(path) == FORMAT_HDF5:
+            with h5py.File(path, 'r') as h5:
+                names = set(h5)
+            for name, kind in cls.DATASETS:
+                if dataset in (None, name) and name in names:
+                    return cls(kind.open(path, name))
+            if dataset in names:
+                return cls(LazyMatrix.open(path, dataset))
+            raise ValueError('No similarity matrix found in "%s"' % (path,))
+
+        values = np.load(path, mmap_mode='r')
+        if values.dtype == EdgeList.DTYPE:
+            return cls(EdgeList.open(path))
+        elif values.ndim == 1:
+            return cls(CondensedMatrix.open(path))
+        return cls(LazyMatrix.open(path))
+
+    @property
+    def labels(self):
+        if isinstance(self.matrix, LazyMatrix):
+            return self.matrix.index
+        return self.matrix.labels
+
+    def __contains__(self, label):
+        try:
+            self.matrix.position(label)
+        except KeyError:
+            return False
+        return True
+
+    def _edges(self, label):
+        edges = self.matrix.edges
+        if self._offsets is None:
+            sources = np.asarray(edges['source'])
+            if np.any(sources[1:] < sources[:-1]):
+                self._order = np.argsort(sources, kind='mergesort')
+                sources = sources[self._order]
+            self._offsets = np.searchsorted(sources, np.arange(len(self.labels) + 1))
+
+        i = self.matrix.position(label)
+        start, stop = self._offsets[i], self._offsets[i + 1]
+        if self._order is None:
+            return np.asarray(edges[start:stop])
+        return np.asarray(edges[np.sort(self._order[start:stop])])
+
+    def row(self, label):
+        """Similarities of a label to all others as a Series.
+
+        Edge lists only hold the top partners, other labels are missing.
+        """
+        if isinstance(self.matrix, EdgeList):
+            edges = self._edges(label)
+            return p.Series(edges['r'].astype(np.float64), index=[self.labels[t] for t in edges['target']], name=label)
+        return self.matrix.row(label)
+
+    def pair(self, a, b):
+        """Similarity of two labels, NaN if it is not stored."""
+        if isinstance(self.matrix, CondensedMatrix):
+            return float(self.matrix.pair(a, b))
+        elif isinstance(self.matrix, LazyMatrix):
+            return float(self.matrix[self.matrix.position(a), self.matrix.position(b)])
+        return float(self.row(a).get(b, np.nan))
+
+    def top(self, label, k=10):
+        """The k most similar partners of a label, sorted by decreasing similarity."""
+        row = self.row(label)
+        row = row[row.index != label].dropna()
+        return row.sort_values(ascending=False, kind='mergesort').iloc[:k]
+
+    def close(self):
+        self.matrix.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Query a saved similarity matrix.')
+    parser.add_argument('matrix_file', help='Similarity matrix saved by sga-similarity in hdf5 or npy format')
+    parser.add_argument('labels', nargs='+', help='Alleles (or strains) to look up')
+    parser.add_argument('-k', '--top-k', dest='top_k', type=int, default=10,
+                        help='Number of most similar partners reported for every label')
+    parser.add_argument('-p', '--pair', dest='pair', action='store_true',
+                        help='Report similarities between all given labels instead of their top partners')
+    parser.add_argument('-r', '--row', dest='row', action='store_true',
+                        help='Report full similarity rows of the given labels')
+    parser.add_argument('-d', '--dataset', dest='dataset',
+                        help='hdf5 dataset with the matrix. Detected if not given')
+    parser.add_argument('-l', '--log', dest='loglevel', default='WARNING',
+                       help='Log level to use')
+
+    args = parser.parse_args()
+
+    numeric_level = getattr(logging, args.loglevel.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.loglevel)
+    logging.basicConfig(level=numeric_level, format='%(asctime)s\t%(levelname)s:\t%(message)s')
+
+    with SimilarityStore.open(args.matrix_file, args.dataset) as store:
+        missing = [l for l in args.labels if l not in store]
+        if missing:
+            parser.error('Unknown labels: %s' % (', '.join(missing),))
+
+        if args.pair:
+            for i, a in enumerate(args.labels):
+                for b in args.labels[i + 1:]:
+                    sys.stdout.write('%s\t%s\t%r\n' % (a, b, store.pair(a, b)))
+        elif args.row:
+            p.concat([store.row(l) for l in args.labels], axis=1).to_csv(sys.stdout, sep='\t')
+        else:
+            for label in args.labels:
+                for partner, r in store.top(label, args.top_k).items():
+                    sys.stdout.write('%s\t%s\t%r\n' % (label, partner, float(r)))
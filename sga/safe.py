@@ -30,9 +30,73 @@ import six
 
 import numpy as np
 import pandas as p
+import scipy.sparse as sparse
 import scipy.spatial as space
 import scipy.stats as stats
 
+# Node pairs up to which the distance threshold is computed from all pair
+# distances at once, larger networks stream them in blocks
+EXACT_PAIRS_LIMIT = 2 ** 24
+
+def _lerp(a, b, t):
+    # same rounding as numpy's linear percentile
+    diff = b - a
+    return b - diff * (1 - t) if t >= .5 else a + diff * t
+
+def _pair_distances(coords, block_size):
+    """Distances of all node pairs (upper triangle, pdist order), a block of rows at a time."""
+    n = len(coords)
+    for i0 in range(0, n - 1, block_size):
+        block = space.distance.cdist(coords[i0:i0 + block_size], coords[i0 + 1:])
+        # node i0 + r pairs with columns c >= r
+        keep = np.arange(block.shape[1]) >= np.arange(block.shape[0])[:, None]
+        yield block[keep]
+
+def distance_percentile(coords, q, block_size=256, bins=2 ** 16):
+    """Percentile of all pair-wise euclidean node distances.
+
+    Equal to np.percentile(pdist(coords), q) up to floating-point rounding
+    of the distances, without holding all distances in memory for large
+    networks. Distances are streamed twice: the first
+    pass counts them in a histogram to find the bins of the percentile, the
+    second one selects it from the distances in those bins.
+
+    Args:
+        coords: Node coordinates, one row per node.
+        q: Percentile, 0 - 100.
+        block_size: Number of nodes whose distances are computed at a time.
+        bins: Histogram size.
+
+    Returns:
+        Distance threshold.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n_pairs = len(coords) * (len(coords) - 1) // 2
+    if n_pairs <= EXACT_PAIRS_LIMIT:
+        return np.percentile(space.distance.pdist(coords, 'euclidean'), q)
+
+    # ranks of the two distances interpolated by np.percentile
+    q = q / 100.
+    k = n_pairs * q + (1 - q) - 1
+    lo = int(np.floor(k))
+    ranks = (lo, min(lo + 1, n_pairs - 1))
+
+    scale = (bins - 1) / max(np.sqrt(np.sum(np.ptp(coords, axis=0) ** 2)), np.finfo(np.float64).tiny)
+    counts = np.zeros(bins, dtype=np.int64)
+    for d in _pair_distances(coords, block_size):
+        counts += np.bincount(np.minimum((d * scale).astype(np.int64), bins - 1), minlength=bins)
+
+    starts = np.cumsum(counts) - counts
+    first, last = np.searchsorted(starts, ranks, side='right') - 1
+    selected = []
+    for d in _pair_distances(coords, block_size):
+        b = np.minimum((d * scale).astype(np.int64), bins - 1)
+        selected.append(d[(b >= first) & (b <= last)])
+    selected = np.concatenate(selected)
+    positions = [r - starts[first] for r in ranks]
+    selected.partition(positions)
+    return _lerp(selected[positions[0]], selected[positions[1]], k - lo)
+
 
 class Safe(object):
     enrichmentDF = None
@@ -56,70 +120,105 @@ class Safe(object):
         else:
             self.attributes = attributes
         
-        if not neighbors:
-            self.generate_neighbors(distance_threshold)
-        elif isinstance(neighbors, six.string_types):
+        # Sparse (CSR) node x node neighborhood matrix, rows and columns are
+        # network rows. Neighbors of node i are
+        # neighbors.indices[neighbors.indptr[i]:neighbors.indptr[i + 1]]
+        self.neighbors = None
+        if isinstance(neighbors, six.string_types) and neighbors:
             self.read_neighbors(neighbors)
+        elif isinstance(neighbors, p.DataFrame):
+            # list of neighbor names per node
+            self._set_neighbor_lists(neighbors.iloc[:, 0])
         else:
-            self.network = self.network.join(neighbors)
+            self.generate_neighbors(distance_threshold)
     
     def generate_neighbors(self, distance_threshold=.5):
-        d = np.percentile(space.distance.pdist(self.network, 'euclidean'), distance_threshold)
+        coords = self.network.values.astype(np.float64)
+        n = len(coords)
+        d = distance_percentile(coords, float(distance_threshold))
         
-        dist_mat = p.DataFrame(space.distance_matrix(self.network, self.network)) # pair-wise distances
-        dist_mat = dist_mat[dist_mat <= d]
-        dist_mat = dist_mat.apply(lambda x: [self.network.index[y] for y in x.dropna().index])
-        dist_mat.index = self.network.index
-        self.network.loc[:,'neighborhood'] = dist_mat
+        # all pairs within d, allowing for rounding differences between the distance routines
+        pairs = space.cKDTree(coords).query_pairs(d * (1 + 1e-12), output_type='ndarray')
+        nodes = np.arange(n)
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1], nodes])
+        columns = np.concatenate([pairs[:, 1], pairs[:, 0], nodes])
+        self._set_neighbors(rows, columns)
+
+    def _set_neighbors(self, rows, columns):
+        n = len(self.network.index)
+        neighbors = sparse.coo_matrix((np.ones(len(rows), dtype=bool), (rows, columns)), shape=(n, n)).tocsr()
+        neighbors.sort_indices()
+        self.neighbors = neighbors
+
+    def _set_neighbor_lists(self, neighbor_lists):
+        neighbor_lists = neighbor_lists.reindex(self.network.index)
+        rows, labels = [], []
+        for row, neighbor_list in enumerate(neighbor_lists):
+            if isinstance(neighbor_list, list):
+                rows += [row] * len(neighbor_list)
+                labels += neighbor_list
+        columns = self.network.index.get_indexer(labels)
+        if len(columns) and columns.min() < 0:
+            missing = sorted(set(np.asarray(labels, dtype=object)[columns < 0]))
+            raise ValueError('Neighbors missing from the network: %s' % (', '.join(map(str, missing[:5])),))
+        self._set_neighbors(np.asarray(rows, dtype=np.int64), columns)
+
+    def neighborhood(self, node):
+        """Names of the neighbors of a node."""
+        row = self.network.index.get_loc(node)
+        return list(self.network.index[self.neighbors.indices[self.neighbors.indptr[row]:self.neighbors.indptr[row + 1]]])
 
     def read_neighbors(self, neighbors_path):
         neighbors = p.read_csv(neighbors_path, header=0, names=['node1', 'neighborhood'])
-        self.network = self.network.join(neighbors.groupby('node1')['neighborhood'].apply(list))
+        self._set_neighbor_lists(neighbors.groupby('node1')['neighborhood'].apply(list))
 #     
     def save_neighbors(self, neighbors_path):
-        l = []
-        for node, neighbor_list in self.network.iloc[:,-1:].itertuples():
-            l += zip([node] * len(neighbor_list), neighbor_list)
-        p.DataFrame(l, columns=['node1', 'neighborhood']).to_csv(neighbors_path, header=True, index=False)
+        index = self.network.index
+        rows = np.repeat(np.arange(len(index)), np.diff(self.neighbors.indptr))
+        p.DataFrame({'node1': index[rows], 'neighborhood': index[self.neighbors.indices]}).to_csv(
+            neighbors_path, header=True, index=False)
     
     def prepare_attributes(self):
         self.attributes = self.attributes.reindex(self.network.index.unique(), fill_value=0)
-        self.binary_attributes = not np.setdiff1d(np.unique(self.attributes), [0,1])
+        self.binary_attributes = not np.setdiff1d(np.unique(self.attributes), [0,1]).size
 
     def normalizeP(self, p, Fj):
 #         if p == 0.0: # Some return 0.0 for some reason? Solved as below
 #             p = sys.float_info.min
         # Convert p-values into normalized neighborhood enrichment scores
         # Min p-value that Matlab can calculate: Pmin = 10**(-16) => -log10(Pmin) = 16.0
-        p = min(-np.log10(p), 16.0) / 16.0
+        with np.errstate(divide='ignore'):
+            p = np.minimum(-np.log10(p), 16.0) / 16.0
 #        if p < (-np.log10(0.05/len(Fj)) / 16.0): # Significantly enriched attributes
 #            p = 0.0
 
         return p
 
-    def hyperwrap(self, U, Sij, N, Fj):
-        def hypergeom(A):
-            return self.normalizeP(1 - stats.hypergeom.cdf(Sij[A]-1, N, Fj[A], U), Fj)
-        return hypergeom
-    
     def calculate(self, force_python_impl=False):
         from .toolbox import USE_C_OPT
         
         # TODO: compare cdf outputs of c and python implementation
         
+        attribute_rows = self.attributes.index.get_indexer(self.network.index)
+        if attribute_rows.min() < 0:
+            raise Exception("Network nodes are missing from attributes, run prepare_attributes first")
+
+        # Neighborhood size and attribute counts of every node, nodes sharing
+        # a name are counted once
+        U = np.diff(self.neighbors.indptr)
+        members = sparse.csr_matrix((np.ones(len(self.neighbors.indices)), attribute_rows[self.neighbors.indices],
+                                     self.neighbors.indptr), shape=(len(U), len(self.attributes.index)))
+        members.sum_duplicates()
+        members.data[:] = 1
+        Sij = members.dot(self.attributes.values)
+
         if USE_C_OPT and not force_python_impl:
             from .toolbox import c_impl
             
-            index_map = dict(zip(self.attributes.index, range(len(self.attributes.index))))
             enrichment = np.zeros((len(self.network.index), len(self.attributes.columns)))
             
-            def sum_attrib(x):
-                idxs = [index_map[y] for y in set(x[2])]
-                r = self.attributes.values[idxs,:].sum(axis=0)
-                return np.append(r, [len(x[2])])
-            
-            cdata = np.apply_along_axis(sum_attrib, 1, self.network)
-            cdata = p.DataFrame(cdata, columns=list(self.attributes.columns) + ['len'], index=self.network.index)
+            cdata = p.DataFrame(np.column_stack([Sij, U]), columns=list(self.attributes.columns) + ['len'],
+                                index=self.network.index)
             cdata = cdata.astype(np.uint32)
             
             Fj = self.attributes.sum().astype(np.uint32)
@@ -128,21 +227,14 @@ class Safe(object):
             
             self.enrichmentDF = p.DataFrame(enrichment, index=self.network.index, columns=self.attributes.columns)
         else:
-            self.enrichmentDF = p.DataFrame(index=self.network.index, columns=self.attributes.columns, dtype=np.float64)
-            
             # Number of nodes in the network
             N = len(self.network.index)
             # Number of nodes in the network given any attribute
-            Fj = self.attributes.sum().to_dict()
-            
-            for row in range(len(self.network.index)):
-                neighborhood = self.network.iloc[row, 2]
-            
-                U = len(neighborhood)
-                Sij = self.attributes.loc[set(neighborhood)].sum().to_dict()
+            Fj = self.attributes.sum().values
             
-                enrichments = map(self.hyperwrap(U, Sij, N, Fj), self.attributes.columns)
-                self.enrichmentDF.iloc[row,:] = list(enrichments)
+            enrichment = self.normalizeP(1 - stats.hypergeom.cdf(Sij - 1, N, Fj[None, :], U[:, None]), Fj)
+            self.enrichmentDF = p.DataFrame(enrichment, index=self.network.index, columns=self.attributes.columns,
+                                            dtype=np.float64)
             
         return self.enrichmentDF
     
@@ -26,8 +26,11 @@ Created on Mar 21, 2017
 @author: Matej Usaj
 '''
 from itertools import chain
+import glob
 import logging
 import os
+import re
+import threading
 
 import h5py
 
@@ -35,8 +38,16 @@ import numpy as np
 import pandas as p
 
 from .toolbox import correlation
-from .toolbox.utils import hdf5_read_str_list, read_strain_map
-from .toolbox.table_norm import table_normalize
+from .toolbox.cache import LayerCache, cache_key
+from .toolbox.checkpoint import Checkpoint, file_fingerprint
+from .toolbox.labels import LabelCatalog
+from .toolbox.merge import merge_layers, merge_layers_condensed, merge_layers_top_k
+from .toolbox.planner import CorrelationPlanner
+from .toolbox.scheduler import TaskGraph
+from .toolbox.storage import FORMAT_HDF5, FORMAT_MEMMAP, CondensedMatrix, EdgeList, create_matrix, decode_labels, \
+    labels_path, write_matrix, write_tsv
+from .toolbox.utils import hdf5_read_selection, hdf5_read_str_list, load_score_matrix, read_strain_map
+from .toolbox.table_norm import QuantileMapper
 
 
 logger = logging.getLogger(__name__)
@@ -47,9 +58,29 @@ class Similarity(object):
     
     INPUT_FORMAT_BJV = 'bjv'
     INPUT_FORMAT_TXT = 'txt'
+    
+    OUTPUT_FORMAT_TSV = 'tsv'
+    OUTPUT_FORMAT_HDF5 = 'hdf5'
+    OUTPUT_FORMAT_NPY = 'npy'
+    OUTPUT_FORMAT_PARQUET = 'parquet'
+    
+    SHARD_FILE = 'shard-%d-of-%d.h5'
+    
+    MAPPER_TASK = 'normalization model'
+    
+    OUTPUT_EXTENSIONS = {
+        OUTPUT_FORMAT_TSV: '.txt',
+        OUTPUT_FORMAT_HDF5: '.h5',
+        OUTPUT_FORMAT_NPY: '.npy',
+        OUTPUT_FORMAT_PARQUET: '.parquet',
+    }
 
     def __init__(self, input_path1, output_path, input_path2=None, input_format=INPUT_FORMAT_TXT,
-                 strain_map=None):
+                 strain_map=None, n_jobs=1, backend=None, stats_dir=None,
+                 condensed=False, dtype=np.float64, top_k=None,
+                 norm_model=None, norm_eps=None, cache_dir=None, cache_size=None,
+                 output_format=OUTPUT_FORMAT_TSV, scores_dtype=None, shard_dir=None,
+                 checkpoint_dir=None, resume=False):
         '''
         Constructor
         '''
@@ -58,6 +89,24 @@ class Similarity(object):
             raise Exception('Unknown input format "%s"' % (input_format,))
         
         self.output = output_path
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.stats_dir = stats_dir
+        self.condensed = condensed
+        self.dtype = dtype
+        self.top_k = top_k
+        self.output_format = output_format
+        self.scores_dtype = scores_dtype
+        self.shard_dir = shard_dir
+        self.norm_model = norm_model
+        self.norm_eps = norm_eps
+        self.cache = LayerCache(cache_dir, cache_size) if cache_dir else None
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.checkpoint = None
+        self._data_keys = {}
+        self._mapper = None
+        self._normalized_layers = {}
         load_func = getattr(self, load_func)
         
         if not os.path.exists(input_path1) or not os.path.isfile(input_path1):
@@ -66,160 +115,636 @@ class Similarity(object):
         if input_path2 and (not os.path.exists(input_path2) or not os.path.isfile(input_path2)):
             raise Exception('Input file does not exist "%s"' % (input_path2,))
         
+        if output_format not in self.OUTPUT_EXTENSIONS:
+            raise Exception('Unknown output format "%s"' % (output_format,))
+        
+        if output_format == self.OUTPUT_FORMAT_PARQUET and not (condensed or top_k) and not _has_parquet_engine():
+            raise Exception('Parquet output needs pyarrow or fastparquet installed')
+        
         if input_format == self.INPUT_FORMAT_BJV and not strain_map:
             raise Exception("Ben's format requires strain-allele mapping file")
         
+        self._input_files = [f for f in (input_path1, input_path2) if f]
         if isinstance(strain_map, str):
+            self._input_files.append(strain_map)
             logger.info("Reading strain map")
             strain_map = read_strain_map(strain_map)
             logger.debug("Found %d strain mappings", len(strain_map))
         
         self.strain_map = strain_map
+        self.catalog = LabelCatalog(strain_map)
+        self.planner = CorrelationPlanner(self._compute_layer)
         
-        logger.info("Loading data")
+        # datasets are only read when a layer needs them
+        self._loaders = {}
+        self._data = {}
+        self._load_lock = threading.Lock()
+        self._key_lock = threading.Lock()
+        self._label_cache = {}
+        self._assembled = []
         load_func(input_path1, input_path2)
-        logger.info("Data loaded. TS matrix size is %s, FG matrix size is %s", self.ts_data.shape, self.fg_data.shape)
     
-    def _bjv_read_scores(self, dataset, root_ele):
-        logger.debug("BJV-%s:Reading ORF list", root_ele)
-#         orfs = np.array(list(map(lambda x: x.split('_')[1], hdf5_read_str_list(dataset, dataset.get('%s/Cannon/Orf' % (root_ele,))[0]))))
-        orfs = np.array(hdf5_read_str_list(dataset, dataset.get('%s/Cannon/Orf' % (root_ele,))[0]))
-        
-        logger.debug("BJV-%s:Generating query/array indices", root_ele)
-        query_idx = np.extract(np.array(dataset.get('%s/Cannon/isQuery' % (root_ele,))[0], dtype=bool), np.arange(*orfs.shape))
-        array_idx = np.extract(np.array(dataset.get('%s/Cannon/isArray' % (root_ele,)), dtype=bool).T, np.arange(*orfs.shape))
+    @property
+    def ts_data(self):
+        return self._dataset('ts')
+    
+    @property
+    def fg_data(self):
+        return self._dataset('fg')
+    
+    def _bjv_read_scores(self, path, root_ele):
+        with h5py.File(path, 'r') as dataset:
+            logger.debug("BJV-%s:Reading ORF list", root_ele)
+#             orfs = np.array(list(map(lambda x: x.split('_')[1], hdf5_read_str_list(dataset, dataset.get('%s/Cannon/Orf' % (root_ele,))[0]))))
+            orfs = hdf5_read_str_list(dataset, dataset['%s/Cannon/Orf' % (root_ele,)], self._label_cache)
+            
+            logger.debug("BJV-%s:Generating query/array indices", root_ele)
+            query_idx = np.extract(np.array(dataset.get('%s/Cannon/isQuery' % (root_ele,))[0], dtype=bool), np.arange(*orfs.shape))
+            array_idx = np.extract(np.array(dataset.get('%s/Cannon/isArray' % (root_ele,)), dtype=bool).T, np.arange(*orfs.shape))
+            
+            logger.debug("BJV-%s:Reading %d x %d scores", root_ele, len(array_idx), len(query_idx))
+            scores = hdf5_read_selection(dataset['%s/eps' % (root_ele,)], array_idx, query_idx, self.scores_dtype)
         
         logger.debug("BJV-%s:Creating DataFrame", root_ele)
-        return p.DataFrame(
-            dataset.get('%s/eps' % (root_ele,))[array_idx, :][:, query_idx],
-            index=orfs[array_idx],
-            columns=orfs[query_idx])
+        return p.DataFrame(scores, index=orfs[array_idx], columns=orfs[query_idx])
     
     def _load_bjv(self, inp, _):
-        logger.debug("Reading BJV formatted file %s", inp)
-        dataset = h5py.File(inp, 'r')
-        
-        logger.debug("BJV:Reading TS data")
-        self.ts_data = self._bjv_read_scores(dataset, 'ts_merge')
-        logger.debug("BJV:Reading FG data")
-        self.fg_data = self._bjv_read_scores(dataset, 'fg_merge')
+        logger.debug("Using BJV formatted file %s", inp)
+        self._loaders['ts'] = lambda: self._bjv_read_scores(inp, 'ts_merge')
+        self._loaders['fg'] = lambda: self._bjv_read_scores(inp, 'fg_merge')
+    
+    def _txt_read_scores(self, path, name):
+        if not path:
+            raise Exception('%s scores file was not given' % (name.upper(),))
+        logger.debug("TXT-%s:Reading scores from %s", name, path)
+        return load_score_matrix(path, self.scores_dtype or np.float64)
     
     def _load_txt(self, ints, infg):
-        raise NotImplementedError('Loading text file is not implemented yet')
+        logger.debug("Using text files %s and %s", ints, infg)
+        self._loaders['ts'] = lambda: self._txt_read_scores(ints, 'ts')
+        self._loaders['fg'] = lambda: self._txt_read_scores(infg, 'fg')
+    
+    def _correlation(self, data, axis, layer):
+        stats = None
+        if self.stats_dir:
+            if not os.path.isdir(self.stats_dir):
+                os.makedirs(self.stats_dir)
+            stats = os.path.join(self.stats_dir, '%s.h5' % (layer,))
+        return correlation.correlation(data, axis=axis, n_jobs=self.n_jobs, backend=self.backend, stats=stats)
     
-    def _similarity(self, data):
-        logger.info("Input matrix size is %s.", data.shape)
+    def _dataset(self, name):
+        with self._load_lock:
+            if name not in self._data:
+                logger.info("Loading %s data", name.upper())
+                self._data[name] = self._loaders[name]()
+                self.catalog.add(self._data[name].index)
+                self.catalog.add(self._data[name].columns)
+                logger.info("Data loaded. %s matrix size is %s", name.upper(), self._data[name].shape)
+        return self._data[name]
+    
+    def _layer_data(self, dataset, axis, profiles, features):
+        data = self._dataset(dataset)
+        if axis == 'rows':
+            return data.loc[profiles, features]
+        return data.loc[features, profiles]
+    
+    def _compute_layer(self, name, dataset, axis, profiles, features):
+        if self.shard_dir:
+            compute = lambda: self._assemble_layer(name, profiles)
+        else:
+            data = self._layer_data(dataset, axis, profiles, features)
+            compute = lambda: self._correlation_layer(name, data, axis)
+        return self._cached(
+            name, 
+            lambda: ('layer', self._data_key(dataset), axis, profiles, features), 
+            compute)
+    
+    def _correlation_layer(self, name, data, axis):
+        logger.info("Computing %s similarity on %s matrix.", name, data.shape)
+        return self._correlation(data, axis, name)
+    
+    @staticmethod
+    def shard_range(size, shard, n_shards):
+        """Rows [start, stop) of a planned computation covered by a 0 based shard."""
+        return size * shard // n_shards, size * (shard + 1) // n_shards
+    
+    def compute_shard(self, shard, n_shards, exe=True, nxn=True, all=True, folder=None):
+        """Compute one shard of every correlation planned for the requested outputs.
+        
+        Profiles of each planned computation are split into n_shards even
+        row ranges and the shard correlates its range with all profiles.
+        Shards only depend on the inputs and the options, so they can run
+        anywhere in any order. Results are saved in folder (output folder
+        by default) as shard-<i>-of-<N>.h5 with 1 based i, and assembled by
+        a Similarity with shard_dir pointing to that folder.
         
-        logger.debug("Computing row similarity on %d rows.", data.shape[0])
-        corr_rows = correlation.correlation(data, axis='rows')
+        Args:
+            shard: 0 based shard number.
+            n_shards: Number of shards.
+            exe, nxn, all: Outputs to plan the correlations for.
+            folder: Where to save the shard.
         
-        logger.debug("Computing column similarity on %d columns.", data.shape[1])
-        corr_cols = correlation.correlation(data, axis='columns')
+        Returns:
+            Path of the shard file.
+        """
+        if not 0 <= shard < n_shards:
+            raise ValueError('Shard %d is out of range for %d shards' % (shard + 1, n_shards))
+        if self.cache is not None or self.stats_dir or self.checkpoint_dir:
+            logger.warning("Layer cache, correlation statistics and checkpoints are not used for shards.")
         
+        self.plan(exe, nxn, all)
+        path = os.path.join(folder or self.output, self.SHARD_FILE % (shard + 1, n_shards))
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        
+        for name, _, _, _, _ in self.planner.computations():
+            dataset, axis, profiles, features = self.planner.inputs(name)
+            start, stop = self.shard_range(len(profiles), shard, n_shards)
+            data = self._layer_data(dataset, axis, profiles, features)
+            block_data = data.iloc[start:stop, :] if axis == 'rows' else data.iloc[:, start:stop]
+            logger.info("Computing rows %d-%d of %s similarity on %s matrix.", start, stop, name, data.shape)
+            block = correlation.cross_correlation(block_data, data, axis=axis, n_jobs=self.n_jobs, backend=self.backend)
+            
+            values = np.array(block.values)
+            # same as correlation(), profiles do not correlate with themselves
+            values[np.arange(stop - start), np.arange(start, stop)] = 0
+            with create_matrix(tmp_path, values.shape, (block.index, block.columns), values.dtype, FORMAT_HDF5, name) as out:
+                out[:] = values
+                out.values.attrs['start'] = start
+                out.values.attrs['stop'] = stop
+        
+        os.rename(tmp_path, path)
+        return path
+    
+    def _shard_paths(self):
+        pattern = re.compile(r'^shard-(\d+)-of-(\d+)\.h5$')
+        shards = {}
+        for path in glob.glob(os.path.join(self.shard_dir, 'shard-*-of-*.h5')):
+            match = pattern.match(os.path.basename(path))
+            if match:
+                shards.setdefault(int(match.group(2)), {})[int(match.group(1))] = path
+        
+        if len(shards) != 1:
+            raise Exception('Expected shards of a single run in "%s", found runs with %s shards' % (
+                self.shard_dir, ', '.join(map(str, sorted(shards))) or 'no'))
+        n_shards, paths = shards.popitem()
+        missing = [str(i) for i in range(1, n_shards + 1) if i not in paths]
+        if missing:
+            raise Exception('Shards %s of %d are missing in "%s"' % (', '.join(missing), n_shards, self.shard_dir))
+        return [paths[i] for i in range(1, n_shards + 1)]
+    
+    def _assemble_layer(self, name, profiles):
+        path = os.path.join(self.shard_dir, '%s.npy' % (name,))
+        logger.info("Assembling %s similarity from shards in %s.", name, path)
+        self._assembled.append(path)
+        with create_matrix(path, (len(profiles), len(profiles)), profiles, fmt=FORMAT_MEMMAP) as out:
+            covered = 0
+            for shard in self._shard_paths():
+                with h5py.File(shard, 'r') as h5:
+                    if name not in h5 or decode_labels(h5['%s_columns' % (name,)][:]) != list(profiles):
+                        raise Exception('Shard %s was computed with different inputs or options' % (shard,))
+                    block = h5[name]
+                    start, stop = int(block.attrs['start']), int(block.attrs['stop'])
+                    out[start:stop] = block[:]
+                    covered += stop - start
+            if covered != len(profiles):
+                raise Exception('Shards in "%s" do not cover all %d rows of %s' % (self.shard_dir, len(profiles), name))
+            values = out.values
+        return p.DataFrame(values, index=profiles, columns=profiles, copy=False)
+    
+    def _data_key(self, dataset):
+        # concurrent layers of the same dataset wait for a single hash
+        with self._key_lock:
+            if dataset not in self._data_keys:
+                logger.debug("Hashing %s dataset.", dataset)
+                self._data_keys[dataset] = cache_key(self._dataset(dataset))
+            return self._data_keys[dataset]
+    
+    def _layer_key(self, name):
+        dataset, axis, profiles, features = self.planner.layer(name)
+        return cache_key('layer', self._data_key(dataset), axis, profiles, features)
+    
+    def _cached(self, name, key, compute):
+        """Result of compute(), reused from the layer cache if one is set.
+        
+        Args:
+            name: Result name used in log messages.
+            key: Callable returning the inputs the result depends on, only
+                called when the cache is enabled.
+            compute: Callable computing the result DataFrame.
+        """
+        if self.cache is None:
+            return compute()
+        return self.cache.cached(cache_key(*key()), compute, name)
+    
+    def _essential_labels(self):
+        ts_data = self.ts_data
+        return (
+            self.catalog.select(ts_data.index, include=('tsa',)), 
+            self.catalog.select(ts_data.columns, include=('tsq',)))
+    
+    def _nonessential_labels(self):
+        fg_data = self.fg_data
+        return (
+            self.catalog.select(fg_data.index, include=('dma',)), 
+            self.catalog.select(fg_data.columns, include=('sn',)))
+    
+    def _all_queries(self, data):
+        return self.catalog.select(data.columns, exclude=('y', 'damp'))
+    
+    def _plan_essential(self):
+        arrays, queries = self._essential_labels()
+        self.planner.add('exe_aa', 'ts', 'rows', arrays, queries)
+        self.planner.add('exe_qq', 'ts', 'columns', queries, arrays)
+    
+    def _plan_nonessential(self):
+        arrays, queries = self._nonessential_labels()
+        self.planner.add('nxn_aa', 'fg', 'rows', arrays, queries)
+        self.planner.add('nxn_qq', 'fg', 'columns', queries, arrays)
+    
+    def _plan_all(self):
+        ts_queries = self._all_queries(self.ts_data)
+        fg_queries = self._all_queries(self.fg_data)
+        
+        self.planner.add('fg_qq', 'fg', 'columns', fg_queries, self.fg_data.index)
+        self.planner.add('ts_qq', 'ts', 'columns', ts_queries, self.ts_data.index)
+        self.planner.add('fg_aa', 'fg', 'rows', self.fg_data.index, fg_queries)
+        self.planner.add('ts_aa', 'ts', 'rows', self.ts_data.index, ts_queries)
+        
+        if not (self.norm_model and os.path.exists(self.norm_model)):
+            ts_query_set, ts_array_set = set(ts_queries), set(self.ts_data.index)
+            common_queries = [c for c in fg_queries if c in ts_query_set]
+            common_arrays = [c for c in self.fg_data.index if c in ts_array_set]
+            # cc1 / data1 and cc2 / data2 of the normalization
+            self.planner.add('tmp_fg_aa', 'fg', 'rows', common_arrays, common_queries)
+            self.planner.add('tmp_ts_aa', 'ts', 'rows', common_arrays, common_queries)
+    
+    def plan(self, exe=True, nxn=True, all=True):
+        """Register layers of the requested outputs before computing any.
+
+        Layers over the same dataset, axis and features are then computed
+        only once. ExE and NxN layers correlate over the essential and
+        nonessential subsets of the arrays and queries while ALL layers use
+        all of them, so the ALL run does not share layers with ExE or NxN.
+        """
+        if exe:
+            self._plan_essential()
+        if nxn:
+            self._plan_nonessential()
+        if all:
+            self._plan_all()
+        
+        for name, dataset, axis, size, layers in self.planner.computations():
+            logger.info("Planned %s %s correlation of %d profiles for %s.", dataset, axis, size, ', '.join(layers))
+    
+    def _streamed(self):
+        """Top k and condensed outputs are built a band of rows at a time."""
+        # shards and correlation statistics only give whole layers
+        return bool(self.top_k or self.condensed) and not self.shard_dir and not self.stats_dir
+    
+    def _layer(self, name, transform=None):
+        """Correlation layer, rows are computed on demand in streamed runs."""
+        if not self._streamed():
+            return self.planner.get(name)
+        dataset, axis, profiles, features = self.planner.layer(name)
+        return correlation.CorrelationRows(
+            self._layer_data(dataset, axis, profiles, features), axis, self.n_jobs, self.backend, transform)
+    
+    def _streamed_layer(self, name):
+        """Top partners or upper triangle of a single ALL layer, computed band by band."""
+        dataset, axis, profiles, features = self.planner.layer(name)
+        logger.info("Computing %s similarity band by band.", name)
+        return correlation.correlation(self._layer_data(dataset, axis, profiles, features), axis=axis, 
+                                       n_jobs=self.n_jobs, backend=self.backend, condensed=self.condensed, 
+                                       dtype=self.dtype, top_k=self.top_k)
+    
+    def _merge(self, layers, labels=None):
+        if self.top_k:
+            return merge_layers_top_k(layers, self.top_k, labels)
+        if self.condensed and self._streamed():
+            return merge_layers_condensed(layers, labels, self.dtype)
+        return merge_layers(layers, labels)
+    
+    def _similarity(self, corr_rows, corr_cols):
+        layers = [
+            (layer.values, layer.index) if isinstance(layer, p.DataFrame) else (layer, layer.labels) 
+            for layer in (corr_cols, corr_rows)]
         if self.strain_map:
             logger.debug("Replacing strain ids with allele names.")
-            corr_rows.columns = [self.strain_map[c.split('_')[1]] for c in corr_rows.columns]
-            corr_rows.index = [self.strain_map[c.split('_')[1]] for c in corr_rows.index]
-            corr_cols.columns = [self.strain_map[c.split('_')[1]] for c in corr_cols.columns]
-            corr_cols.index = [self.strain_map[c.split('_')[1]] for c in corr_cols.index]
-        
-        unified_axis = sorted(set(list(corr_cols.index) + list(corr_rows.index)))
-        logger.debug("Unified axis (%d) ready.", len(unified_axis))
-        merged = np.array([
-            corr_cols.reindex(unified_axis,unified_axis).values, 
-            corr_rows.reindex(unified_axis,unified_axis).values])
+            # only labels are replaced, planned layers are shared and must not be relabeled in place
+            layers = [(values, self.catalog.alleles(labels)) for values, labels in layers]
         
         logger.debug("Combining QQ/AA correlations.")
-        return p.DataFrame(np.nanmean(merged, axis=0), index=unified_axis, columns=unified_axis)
+        return self._merge(layers)
+    
+    def _merged(self, name, key, compute):
+        if self.top_k or self._streamed():
+            # top partners or the upper triangle are picked while merging, the square matrix is never built
+            return compute()
+        return self._cached(name, key, compute)
     
     def essential_similarity(self):
         logger.info("Computing similarity of essental strains profiles.")
-        data = self.ts_data.loc[
-            [c for c in self.ts_data.index if '_tsa' in c], 
-            [c for c in self.ts_data.columns if '_tsq' in c]]
-        self.ts_sim = self._similarity(data)
+        self._plan_essential()
+        self.ts_sim = self._merged(
+            'ExE', 
+            lambda: ('merged', self._layer_key('exe_aa'), self._layer_key('exe_qq'), self.strain_map), 
+            lambda: self._similarity(self._layer('exe_aa'), self._layer('exe_qq')))
         return self.ts_sim
     
     def nonessential_similarity(self):
         logger.info("Computing similarity of nonessental strains profiles.")
-        data = self.fg_data.loc[
-            [c for c in self.fg_data.index if '_dma' in c], 
-            [c for c in self.fg_data.columns if '_sn' in c]]
-        self.fg_sim = self._similarity(data)
+        self._plan_nonessential()
+        self.fg_sim = self._merged(
+            'NxN', 
+            lambda: ('merged', self._layer_key('nxn_aa'), self._layer_key('nxn_qq'), self.strain_map), 
+            lambda: self._similarity(self._layer('nxn_aa'), self._layer('nxn_qq')))
         return self.fg_sim
     
+    def _quantile_mapper(self):
+        if self._mapper is None:
+            self._mapper = self._load_quantile_mapper()
+        return self._mapper
+    
+    def _mapper_key(self):
+        """Inputs of the normalization model, known without fitting it."""
+        if self.norm_model and os.path.exists(self.norm_model):
+            return ('model', file_fingerprint(self.norm_model))
+        return ('fit', self._layer_key('tmp_fg_aa'), self._layer_key('tmp_ts_aa'), self.norm_eps)
+    
+    def _load_quantile_mapper(self):
+        if self.norm_model and os.path.exists(self.norm_model):
+            logger.info("Loading TS -> FG normalization model from %s.", self.norm_model)
+            return QuantileMapper.load(self.norm_model)
+        
+        checkpoint_path = self.checkpoint and self.checkpoint.result_path(self.MAPPER_TASK)
+        if checkpoint_path and self.MAPPER_TASK in self.checkpoint and os.path.exists(checkpoint_path):
+            logger.info("Loading TS -> FG normalization model from checkpoint %s.", checkpoint_path)
+            return QuantileMapper.load(checkpoint_path)
+        
+        fit = lambda: QuantileMapper.fit(self.planner.get('tmp_fg_aa'), self.planner.get('tmp_ts_aa'), self.norm_eps)
+        if self.cache is None:
+            mapper = fit()
+        else:
+            mapper = self.cache.cached_file(
+                cache_key('normalization model', *self._mapper_key()), fit, 
+                QuantileMapper.load, lambda mapper, path: mapper.save(path), 'normalization model')
+        if self.norm_model:
+            logger.info("Saving TS -> FG normalization model in %s.", self.norm_model)
+            mapper.save(self.norm_model)
+        if checkpoint_path:
+            # saved before the task is marked done
+            mapper.save(checkpoint_path + '.tmp')
+            os.rename(checkpoint_path + '.tmp', checkpoint_path)
+        return mapper
+    
+    def _normalized(self, name):
+        if name not in self._normalized_layers:
+            self._normalized_layers[name] = self._normalize(name)
+        return self._normalized_layers[name]
+    
+    def _normalize(self, name):
+        if self._streamed():
+            transform = lambda block: self._quantile_mapper().transform_values(block, self.n_jobs)
+            rows = self._layer(name, transform)
+            logger.info("Computing normalized %s similarity band by band.", name)
+            return self._merge([(rows, rows.labels)], rows.labels)
+        
+        def normalize():
+            logger.debug("Normalizing %s layer.", name)
+            return self._quantile_mapper().transform(self.planner.get(name), self.n_jobs)
+        
+        def key():
+            return ('normalized', self._layer_key(name)) + self._mapper_key()
+        
+        return self._cached(name + '_norm', key, normalize)
+    
     def similarity(self):
-        tsdata = self.ts_data.loc[
-            :, 
-            [c for c in self.ts_data.columns if ('_y' not in c and '_damp' not in c)]]
-        fgdata = self.fg_data.loc[
-            :, 
-            [c for c in self.fg_data.columns if ('_y' not in c and '_damp' not in c)]]
-        
-#         if self.strain_map:
-#             logger.debug("Replacing strain ids with allele names.")
-#             tsdata.columns = [self.strain_map[c] for c in tsdata.columns]
-#             tsdata.index = [self.strain_map[c] for c in tsdata.index]
-#             fgdata.columns = [self.strain_map[c] for c in fgdata.columns]
-#             fgdata.index = [self.strain_map[c] for c in fgdata.index]
-#             
-#             tsdata = tsdata.iloc[~tsdata.index.duplicated(), ~tsdata.columns.duplicated()]
-#             fgdata = fgdata.iloc[~fgdata.index.duplicated(), ~fgdata.columns.duplicated()]
-#         
-#         unified_axis = sorted(set(chain(tsdata.index, tsdata.columns, fgdata.index, fgdata.columns)))
+        logger.info("Computing similarity of all strains profiles.")
+        self._plan_all()
+        
+        fg_layer = self._streamed_layer if self._streamed() else self.planner.get
         
         # Layer 1: FG QQ
-        print('fg_qq')
-        fg_qq = correlation.correlation(fgdata, axis='columns')
-
+        fg_qq = fg_layer('fg_qq')
+        
         # Layer 2: TS QQ (normalized based on TS AA)
-        print('ts_qq')
-        ts_qq = correlation.correlation(tsdata, axis='columns')
+        ts_qq_norm = self._normalized('ts_qq')
         
-        common_queries = set(fgdata.columns).intersection(tsdata.columns)
-        common_arrays = set(fgdata.index).intersection(tsdata.index)
+        # Layer 3: FG AA
+        fg_aa = fg_layer('fg_aa')
         
-        # cc1 / data1
-        print('fg_aa')
-        tmp_fg_aa = correlation.correlation(fgdata.reindex(common_arrays, common_queries), axis='rows')
-        # cc2 / data2
-        print('ts_aa')
-        tmp_ts_aa = correlation.correlation(tsdata.reindex(common_arrays, common_queries), axis='rows')
+        # Layer 4: TS AA (normalized)
+        ts_aa_norm = self._normalized('ts_aa')
         
-        print('normalize')
-        ts_qq_norm = table_normalize(tmp_fg_aa, tmp_ts_aa, ts_qq)
+        self.all_sim = {'fg_qq': fg_qq, 'ts_qq': ts_qq_norm, 'fg_aa': fg_aa, 'ts_aa': ts_aa_norm}
+        return self.all_sim
+    
+    def run(self, exe=True, nxn=True, all=True, n_workers=1, save=True):
+        """Compute and save the requested outputs.
+
+        Planned correlations, the normalization and the merged outputs are
+        scheduled as a task graph, so up to n_workers independent steps run
+        at the same time. They all share the loaded TS and FG matrices.
+
+        Args:
+            exe: Compute the ExE similarity.
+            nxn: Compute the NxN similarity.
+            all: Compute the ALL layers.
+            n_workers: Number of steps run concurrently. Each correlation
+                still uses n_jobs threads.
+            save: Save the outputs in the output folder.
+        """
+        self.plan(exe, nxn, all)
+        tasks = []
         
-        # Layer 3: FG AA
-        print('fg_aa')
-        fg_aa = correlation.correlation(fgdata, axis='rows')
+        def add(name, func, deps=()):
+            tasks.append((name, func, tuple(deps)))
         
-        # Layer 4: TS AA (normalized)
-        print('ts_aa')
-        ts_aa = correlation.correlation(tsdata, axis='rows')
-        print('normalize')
-        ts_aa_norm = table_normalize(tmp_fg_aa, tmp_ts_aa, ts_aa)
+        def layer(name):
+            task = 'correlation %s' % (self.planner.computation(name),)
+            if task not in (t[0] for t in tasks):
+                add(task, lambda: self.planner.get(name))
+            return task
+        
+        def layers(*names):
+            # streamed runs compute these row by row while merging
+            return [] if self._streamed() else [layer(name) for name in names]
+        
+        if exe:
+            add('ExE', self.essential_similarity, layers('exe_aa', 'exe_qq'))
+            if save:
+                add('save ExE', self.save_essential_similarity, ['ExE'])
         
+        if nxn:
+            add('NxN', self.nonessential_similarity, layers('nxn_aa', 'nxn_qq'))
+            if save:
+                add('save NxN', self.save_nonessential_similarity, ['NxN'])
         
+        if all:
+            # normalization model waits for both AA temp layers
+            add(self.MAPPER_TASK, self._quantile_mapper, 
+                [layer(n) for n in ('tmp_fg_aa', 'tmp_ts_aa') if n in self.planner])
+            for name in ('ts_qq', 'ts_aa'):
+                add('normalize %s' % (name,), lambda name=name: self._normalized(name), 
+                    layers(name) + [self.MAPPER_TASK])
+            add('ALL', self.similarity, layers('fg_qq', 'fg_aa') + ['normalize ts_qq', 'normalize ts_aa'])
+            if save:
+                add('save ALL', self.save_similarity, ['ALL'])
         
-#         return ts_qq_norm
+        skip = self._skipped_tasks(tasks) if self.checkpoint_dir else set()
+        graph = TaskGraph()
+        for name, func, deps in tasks:
+            if name in skip:
+                func = lambda: None
+            elif self.checkpoint is not None:
+                func = self.checkpoint.wrap(name, func)
+            graph.add(name, func, deps)
+        
+        logger.info("Running %d tasks on %d workers, %d done in an earlier run.", 
+                    len(graph) - len(skip), max(n_workers, 1), len(skip))
+        results = graph.run(n_workers)
+        self._remove_assembled()
+        return results
+    
+    def _remove_assembled(self):
+        """Remove layers assembled from shards, results already hold what they need."""
+        for path in self._assembled:
+            logger.debug("Removing assembled layer %s.", path)
+            for name in (path, labels_path(path), labels_path(path) + '.columns'):
+                if os.path.exists(name):
+                    os.remove(name)
+        self._assembled = []
+    
+    def _fingerprint(self):
+        """Inputs and options the checkpointed results depend on."""
+        return {
+            'inputs': [file_fingerprint(f) for f in self._input_files],
+            'options': {
+                'output': os.path.abspath(self.output),
+                'backend': self.backend,
+                'condensed': self.condensed,
+                'dtype': np.dtype(self.dtype).str,
+                'scores_dtype': self.scores_dtype and np.dtype(self.scores_dtype).str,
+                'top_k': self.top_k,
+                'output_format': self.output_format,
+                'norm_model': self.norm_model and os.path.abspath(self.norm_model),
+                'norm_eps': self.norm_eps,
+            },
+        }
+    
+    def _skipped_tasks(self, tasks):
+        """Open the checkpoint and find the tasks a resumed run can skip.
+        
+        A finished task is only skipped if all tasks that use its result are
+        skipped too, the others rerun and read finished layers back from the
+        checkpoint cache.
+        """
+        self.checkpoint = Checkpoint(self.checkpoint_dir, self._fingerprint(), self.resume)
+        if self.cache is None:
+            self.cache = self.checkpoint.layers
+        
+        skip = set()
+        for name, _, _ in reversed(tasks):
+            users = [t for t, _, deps in tasks if name in deps]
+            if name in self.checkpoint and all(t in skip for t in users):
+                skip.add(name)
+        return skip
+    
+    def _output_path(self, name, folder=None):
+        if self.condensed or self.top_k:
+            ext = self.OUTPUT_EXTENSIONS[self.OUTPUT_FORMAT_HDF5]
+        else:
+            ext = self.OUTPUT_EXTENSIONS[self.output_format]
+        return os.path.join(folder or self.output, name + ext)
     
     def _save(self, df, path):
-        df.to_csv(path, sep='\t', index=True, header=True)
+        if isinstance(df, (EdgeList, CondensedMatrix)):
+            df.save(path)
+        elif self.top_k:
+            EdgeList.from_frame(df, self.top_k).save(path)
+        elif self.condensed:
+            CondensedMatrix.from_frame(df, self.dtype).save(path)
+        elif self.output_format == self.OUTPUT_FORMAT_HDF5:
+            write_matrix(df, path, FORMAT_HDF5, compression='gzip')
+        elif self.output_format == self.OUTPUT_FORMAT_NPY:
+            write_matrix(df, path, FORMAT_MEMMAP)
+        elif self.output_format == self.OUTPUT_FORMAT_PARQUET:
+            # parquet needs string column names
+            df = p.DataFrame(df.values, index=df.index, columns=[str(c) for c in df.columns])
+            df.to_parquet(path)
+        else:
+            write_tsv(df, path)
 
     def save_essential_similarity(self, path=None):
-        path = path or os.path.join(self.output, 'cc_ExE.txt')
+        path = path or self._output_path('cc_ExE')
         logger.info("Saving ExE dataset in %s.", path)
         self._save(self.ts_sim, path)
     
     def save_nonessential_similarity(self, path=None):
-        path = path or os.path.join(self.output, 'cc_NxE.txt')
+        path = path or self._output_path('cc_NxE')
         logger.info("Saving ExE dataset in %s.", path)
         self._save(self.fg_sim, path)
+    
+    def save_similarity(self, folder=None):
+        for name, layer in sorted(self.all_sim.items()):
+            path = self._output_path('cc_ALL_%s' % (name,), folder)
+            logger.info("Saving ALL %s layer in %s.", name, path)
+            self._save(layer, path)
+
+def _has_parquet_engine():
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+            return True
+        except ImportError:
+            pass
+    return False
+
+def _shard(value):
+    import argparse
+    
+    match = re.match(r'^(\d+)/(\d+)$', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError('Shard should be i/N with 1 <= i <= N, got "%s"' % (value,))
+    return int(match.group(1)) - 1, int(match.group(2))
+
+def _jobs(value):
+    import argparse
+    
+    try:
+        n_jobs = int(value)
+    except ValueError:
+        n_jobs = 0
+    if n_jobs == 0:
+        raise argparse.ArgumentTypeError('Expected a positive number of threads or -1 for all CPUs, got "%s"' % (value,))
+    return n_jobs
+
+def _positive_int(value):
+    import argparse
+    
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError('Expected a positive integer, got "%s"' % (value,))
+    return number
 
 def main():
     import argparse
+    import sys
+    
+    # "sga-similarity merge ..." assembles shards computed with --shard
+    merge = sys.argv[1:2] == ['merge']
+    argv = sys.argv[2:] if merge else sys.argv[1:]
     
-    parser = argparse.ArgumentParser(description='Compute similarity matrix.')
+    parser = argparse.ArgumentParser(
+        prog='sga-similarity merge' if merge else None,
+        description='Assemble similarity matrix shards.' if merge else 'Compute similarity matrix.',
+        epilog='Use "sga-similarity merge" with the same arguments as the --shard runs to assemble their shards, '
+        'normalize and save the outputs.')
     parser.add_argument('scores_file', help='First file with SGA scores. See formats for details')
     parser.add_argument('scores_file_2', nargs='?', help='Optional second file with SGA scores. See formats for details')
     parser.add_argument('output_folder', help='Where to save the results')
@@ -240,9 +765,71 @@ If format is '%s' then first file is the .mat workspace snapshot and the second
     parser.add_argument('-n', '--skip-nonessential', dest='nxn', action='store_false',
                         help='Do not generate NxN correlations')
     parser.add_argument('-a', '--skip-all', dest='all', action='store_false',
-                        help='Do not generate ALL correlations')
+                        help='Do not generate ALL correlations. This is the default, kept for compatibility')
+    parser.add_argument('--all', dest='all', action='store_true',
+                        help='Also generate ALL correlations (TS and FG array and query layers, TS normalized to FG)')
+    parser.add_argument('-j', '--jobs', dest='n_jobs', type=_jobs, default=1,
+                        help='Number of threads used to compute correlations. Use -1 for all available CPUs, -2 for all but one '
+                        'and so on')
+    parser.add_argument('-p', '--parallel-layers', dest='workers', type=_positive_int, default=1,
+                        help='Number of independent layers (ExE, NxN, FG and TS correlations) computed at the same time. '
+                        'Each of them uses --jobs threads')
+    parser.add_argument('--shard', dest='shard', type=_shard,
+                        help='Only compute shard i of N (i/N, 1 based) of every correlation and save it in the output '
+                        'folder. Shards are independent, assemble them with "sga-similarity merge"')
+    parser.add_argument('--shard-dir', dest='shard_dir',
+                        help='Folder with shards to merge. Defaults to the output folder')
+    parser.add_argument('-b', '--backend', dest='backend', choices=sorted(correlation.BACKENDS),
+                        help='Correlation backend. Defaults to the compiled C kernel if available, blas otherwise')
+    parser.add_argument('-s', '--stats-dir', dest='stats_dir',
+                        help='Folder with cached correlation statistics. Only profiles and scores added since the last '
+                        'run are computed, the cache is created on first use')
+    parser.add_argument('-o', '--output-format', dest='output_format', default=Similarity.OUTPUT_FORMAT_TSV,
+                        choices=sorted(Similarity.OUTPUT_EXTENSIONS),
+                        help='Format of saved similarity matrices. hdf5 is chunked and gzip compressed with labels in '
+                        'matrix_index/matrix_columns datasets, npy files get labels in a .labels sidecar file. '
+                        'Parquet needs pyarrow or fastparquet')
+    parser.add_argument('--float32-scores', dest='scores_dtype', action='store_const', const=np.float32,
+                        help='Keep loaded SGA scores in single precision, halves the memory used by the input matrices')
+    parser.add_argument('-c', '--condensed', dest='condensed', action='store_true',
+                        help='Save only the upper triangle of similarity matrices (scipy squareform layout) in hdf5 files')
+    parser.add_argument('--float32', dest='dtype', action='store_const', const=np.float32, default=np.float64,
+                        help='Store condensed similarities in single precision')
+    parser.add_argument('-k', '--top-k', dest='top_k', type=_positive_int,
+                        help='Save only the K most similar partners of every strain as a (source, target, r) '
+                        'edge list in hdf5 instead of the full matrix. Similarities are computed a band of rows at '
+                        'a time and the full matrices are never held in memory')
+    parser.add_argument('--norm-model', dest='norm_model',
+                        help='TS -> FG quantile normalization model file. Loaded if it exists, otherwise it is fitted '
+                        'from the array-array correlations of common strains and saved here')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='Folder caching correlation layers and merged similarities by the hash of their inputs. '
+                        'Reruns on the same data reuse them instead of recomputing')
+    parser.add_argument('--cache-size', dest='cache_size', type=float,
+                        help='Cache size limit in GB, least recently used layers are removed first')
+    parser.add_argument('--checkpoint-dir', dest='checkpoint_dir',
+                        help='Record finished steps and their results in this folder, so an interrupted run can be '
+                        'resumed with --resume')
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Skip steps finished by an interrupted run with the same inputs and options. Checkpoints '
+                        'go to .checkpoint in the output folder if --checkpoint-dir is not given')
+    parser.add_argument('--norm-error', dest='norm_eps', type=float,
+                        help='Fit an approximate normalization model from quantile sketches with this rank error '
+                        '(ie. 0.001) instead of sorting all correlations')
+    
+    parser.set_defaults(all=False)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if merge and args.shard:
+        parser.error('--shard can not be used with merge')
+    if args.shard:
+        # shards are written straight to the output folder, there is nothing to cache or resume
+        ignored = [flag for flag, value in (('--cache-dir', args.cache_dir), ('--stats-dir', args.stats_dir),
+                                            ('--checkpoint-dir', args.checkpoint_dir), ('--resume', args.resume)) if value]
+        if ignored:
+            parser.error('%s can not be used with --shard' % (', '.join(ignored),))
+    if merge and args.stats_dir:
+        parser.error('--stats-dir can not be used with merge, correlations come from the shards')
     
     numeric_level = getattr(logging, args.loglevel.upper(), None)
     if not isinstance(numeric_level, int):
@@ -252,15 +839,27 @@ If format is '%s' then first file is the .mat workspace snapshot and the second
     similarity = Similarity(
             args.scores_file,
             args.output_folder,
-            args.scores_file_2,
-            args.input_format,
-            args.strain_map)
-    
-    if args.exe:
-        similarity.essential_similarity()
-        similarity.save_essential_similarity()
-    
-    if args.nxn:
-        similarity.nonessential_similarity()
-        similarity.save_nonessential_similarity()
-    
\ No newline at end of file
+            input_path2=args.scores_file_2,
+            input_format=args.input_format,
+            strain_map=args.strain_map,
+            n_jobs=args.n_jobs,
+            backend=args.backend,
+            stats_dir=args.stats_dir,
+            condensed=args.condensed,
+            dtype=args.dtype,
+            top_k=args.top_k,
+            norm_model=args.norm_model,
+            norm_eps=args.norm_eps,
+            cache_dir=args.cache_dir,
+            cache_size=int(args.cache_size * 2 ** 30) if args.cache_size else None,
+            output_format=args.output_format,
+            scores_dtype=args.scores_dtype,
+            shard_dir=(args.shard_dir or args.output_folder) if merge else None,
+            checkpoint_dir=args.checkpoint_dir or (os.path.join(args.output_folder, '.checkpoint') if args.resume else None),
+            resume=args.resume)
+    
+    if args.shard:
+        similarity.compute_shard(args.shard[0], args.shard[1], args.exe, args.nxn, args.all)
+        return
+    
+    similarity.run(args.exe, args.nxn, args.all, args.workers)
@@ -100,12 +100,16 @@ def _swig_setattr_nondynamic_method(set):
 
 
 
-def correlation(npyArray2D, resultArray2D):
-    return _c_impl.correlation(npyArray2D, resultArray2D)
+def correlation(data, result, n_jobs):
+    return _c_impl.correlation(data, result, n_jobs)
 correlation = _c_impl.correlation
 
-def table_norm(data3_nn, data2_nn, result):
-    return _c_impl.table_norm(data3_nn, data2_nn, result)
+def cross_correlation(a, b, result, n_jobs):
+    return _c_impl.cross_correlation(a, b, result, n_jobs)
+cross_correlation = _c_impl.cross_correlation
+
+def table_norm(data3_nn, data2_nn, result, n_jobs):
+    return _c_impl.table_norm(data3_nn, data2_nn, result, n_jobs)
 table_norm = _c_impl.table_norm
 
 def safe(data, enrichment, Fj):
@@ -0,0 +1,234 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as p
+
+from .storage import FORMAT_HDF5, LazyMatrix, create_matrix
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached results change for the same inputs
+CACHE_VERSION = 1
+
+EXTENSION = '.h5'
+
+def _hash_labels(h, labels):
+    for l in labels:
+        h.update(str(l).encode('utf-8'))
+        h.update(b'\0')
+    h.update(b'\1')
+
+def _hash_part(h, part):
+    if isinstance(part, p.DataFrame):
+        h.update(b'frame')
+        _hash_labels(h, part.index)
+        _hash_labels(h, part.columns)
+        part = part.values
+    if isinstance(part, np.ndarray):
+        values = np.ascontiguousarray(part)
+        h.update(('array%s%s' % (values.dtype.str, values.shape)).encode('utf-8'))
+        h.update(values.view(np.uint8).reshape(-1) if values.size else b'')
+    elif isinstance(part, dict):
+        h.update(b'dict')
+        for k in sorted(part):
+            _hash_part(h, k)
+            _hash_part(h, part[k])
+    elif isinstance(part, (list, tuple, p.Index)):
+        h.update(b'list')
+        _hash_labels(h, part)
+    else:
+        h.update(('%s:%r' % (type(part).__name__, part)).encode('utf-8'))
+    h.update(b'\2')
+
+def cache_key(*parts):
+    """Content hash of the inputs of a cached result.
+
+    Args:
+        parts: DataFrames, arrays, label lists, dicts and scalars the result
+            depends on. Data is hashed with its labels, so the same values
+            under different labels give different keys.
+
+    Returns:
+        Hex digest usable as a cache key.
+    """
+    h = hashlib.sha1(('sga-cache-%d' % (CACHE_VERSION,)).encode('utf-8'))
+    for part in parts:
+        _hash_part(h, part)
+    return h.hexdigest()
+
+class LayerCache(object):
+    '''
+    On-disk cache of labeled result matrices keyed by the hash of their inputs.
+
+    Every entry is an hdf5 file named after its key. Entries are written
+    atomically, so a crashed run never leaves a partial entry behind, and
+    their modification time is refreshed on every hit. When the cache grows
+    over max_size bytes the least recently used entries are removed.
+
+    Args:
+        path: Cache folder, created if needed.
+        max_size: Size limit in bytes. None for unlimited.
+    '''
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.evict()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + EXTENSION)
+
+    def __contains__(self, key):
+        return os.path.exists(self.entry_path(key))
+
+    def get(self, key):
+        """Cached DataFrame or None if there is no entry for the key."""
+        path = self.entry_path(key)
+        try:
+            matrix = LazyMatrix.open(path)
+        except (IOError, OSError, KeyError):
+            return None
+
+        with matrix:
+            df = matrix.to_frame()
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return df
+
+    def put(self, key, df):
+        """Store a DataFrame under the key and evict old entries if needed."""
+        path = self.entry_path(key)
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        with create_matrix(tmp_path, df.shape, (df.index, df.columns), df.values.dtype, FORMAT_HDF5) as out:
+            out[:] = df.values
+        os.rename(tmp_path, path)
+        self.evict(keep=key)
+
+    def cached(self, key, compute, name=None):
+        """Cached result of compute() for the key, computing and storing it on a miss."""
+        df = self.get(key)
+        if df is not None:
+            logger.info("Using cached %s (%s).", name or 'result', key)
+            return df
+        df = compute()
+        logger.debug("Caching %s as %s.", name or 'result', key)
+        self.put(key, df)
+        return df
+
+    def cached_file(self, key, compute, load, save, name=None):
+        """Like cached() for results that are not DataFrames.
+
+        Args:
+            key: Cache key.
+            compute: Callable computing the result.
+            load: Callable reading a result from a path.
+            save: Callable writing a result to a path, ie. result.save.
+            name: Result name used in log messages.
+        """
+        path = self.entry_path(key)
+        if os.path.exists(path):
+            try:
+                result = load(path)
+            except (IOError, OSError, KeyError):
+                pass
+            else:
+                logger.info("Using cached %s (%s).", name or 'result', key)
+                try:
+                    os.utime(path, None)
+                except OSError:
+                    pass
+                return result
+
+        result = compute()
+        logger.debug("Caching %s as %s.", name or 'result', key)
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        save(result, tmp_path)
+        os.rename(tmp_path, path)
+        self.evict(keep=key)
+        return result
+
+    def entries(self):
+        """Cache entries as (path, size, mtime) tuples, least recently used first."""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(EXTENSION):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits max_size.
+
+        Args:
+            keep: Key of an entry that is never evicted, ie. the one just
+                stored.
+        """
+        if self.max_size is None:
+            return
+
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        keep = keep and self.entry_path(keep)
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            logger.debug("Evicting cache entry %s.", path)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
@@ -0,0 +1,132 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+
+from .cache import LayerCache
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+RESULT_EXTENSION = '.result'
+
+def file_fingerprint(path):
+    """Absolute path, size and modification time of a file."""
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime]
+
+def _normalize(value):
+    # compare fingerprints the way they are read back from the manifest
+    return json.loads(json.dumps(value, sort_keys=True))
+
+class Checkpoint(object):
+    '''
+    Progress of a long run, kept in a folder so a killed run can resume.
+
+    A manifest lists the finished tasks next to a fingerprint of the run
+    inputs and options, finished intermediate results are kept in a layer
+    cache in the same folder, other results next to the manifest
+    (result_path()). The manifest is rewritten atomically after
+    every task, so it never lists a task whose results are not on disk.
+
+    Args:
+        path: Checkpoint folder, created if needed.
+        fingerprint: JSON serializable description of the inputs and options
+            the results depend on, ie. file_fingerprint() of input files.
+        resume: Keep the tasks finished by an earlier run. Fails if the
+            fingerprint changed since. Otherwise the checkpoint starts empty.
+    '''
+
+    def __init__(self, path, fingerprint, resume=False):
+        self.path = path
+        self.fingerprint = _normalize(fingerprint)
+        self.layers = LayerCache(os.path.join(path, 'layers'))
+        self._lock = threading.Lock()
+
+        manifest = self._read() if resume else None
+        if manifest is not None:
+            if manifest.get('fingerprint') != self.fingerprint:
+                raise ValueError('Inputs or options changed since the checkpoint in "%s" was written, '
+                                 'run without resume to start over' % (path,))
+            self.done = manifest.get('done', {})
+            logger.info("Resuming from %s, %d tasks are done.", path, len(self.done))
+        else:
+            if resume:
+                logger.info("No checkpoint found in %s, starting a new run.", path)
+            self.layers.clear()
+            for name in os.listdir(path):
+                if name.endswith(RESULT_EXTENSION):
+                    os.remove(os.path.join(path, name))
+            self.done = {}
+            self._write()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.path, MANIFEST)
+
+    def _read(self):
+        try:
+            with open(self.manifest_path) as inp:
+                return json.load(inp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as out:
+            json.dump({'fingerprint': self.fingerprint, 'done': self.done}, out, indent=1, sort_keys=True)
+            out.flush()
+            os.fsync(out.fileno())
+        os.rename(tmp_path, self.manifest_path)
+
+    def result_path(self, task):
+        """Where a task keeps a result that is not a layer, ie. a fitted model."""
+        return os.path.join(self.path, task.replace(' ', '_') + RESULT_EXTENSION)
+
+    def __contains__(self, task):
+        return task in self.done
+
+    def complete(self, task):
+        """Record a finished task."""
+        with self._lock:
+            self.done[task] = time.time()
+            self._write()
+
+    def wrap(self, task, func):
+        """Callable running func() and recording the task once it returns."""
+        def run():
+            result = func()
+            self.complete(task)
+            return result
+        return run
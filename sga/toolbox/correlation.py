@@ -26,7 +26,12 @@ Created on Mar 31, 2017
 @author: Matej Usaj
 '''
 
+import hashlib
 import logging
+import multiprocessing
+import os
+
+import h5py
 
 import numpy as np
 import pandas as p
@@ -36,27 +41,697 @@ from . import USE_C_OPT
 
 logger = logging.getLogger(__name__)
 
-def correlation(data, axis='rows'):
+def _resolve_jobs(n_jobs):
+    """Translate the n_jobs argument into an actual number of threads.
+
+    Negative values count back from the number of available CPUs, so -1
+    means all of them, -2 all but one and so on. 0 is rejected, the C
+    kernels would read it as all CPUs.
+    """
+    if n_jobs is None:
+        return 1
+    n_jobs = int(n_jobs)
+    if n_jobs == 0:
+        raise ValueError('n_jobs == 0 has no meaning, use 1 for a single thread or -1 for all CPUs')
+    if n_jobs < 0:
+        n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+def _tiles(size, tile_size):
+    return [(start, min(start + tile_size, size)) for start in range(0, size, tile_size)]
+
+def _pearson_stats(x, y=None):
+    """Sufficient statistics of pairwise-complete Pearson correlations.
+
+    For every pair of profiles the number of common values, their sums, sums
+    of squares and cross products are computed as products of the zero
+    filled data and its 0/1 validity mask, so all the heavy lifting is done
+    by BLAS.
+
+    Args:
+        x: 2D array, one profile per row.
+        y: optional second 2D array with the same number of columns. If
+            omitted, x is paired with itself.
+
+    Returns:
+        Tuple of (n, sum_x, sum_y, sum_x2, sum_y2, sum_xy) arrays of shape
+        (len(x), len(y)), sums run over values present in both profiles.
+    """
+    square = y is None
+    
+    mask_x = ~np.isnan(x)
+    zx = np.where(mask_x, x, 0.)
+    mask_x = mask_x.astype(zx.dtype)
+    if square:
+        mask_y, zy = mask_x, zx
+    else:
+        mask_y = ~np.isnan(y)
+        zy = np.where(mask_y, y, 0.)
+        mask_y = mask_y.astype(zy.dtype)
+    
+    n = np.dot(mask_x, mask_y.T)
+    sum_x = np.dot(zx, mask_y.T)
+    sum_y = sum_x.T if square else np.dot(mask_x, zy.T)
+    sum_x2 = np.dot(zx * zx, mask_y.T)
+    sum_y2 = sum_x2.T if square else np.dot(mask_x, (zy * zy).T)
+    sum_xy = np.dot(zx, zy.T)
+    
+    return n, sum_x, sum_y, sum_x2, sum_y2, sum_xy
+
+def _pearson_from_stats(n, sum_x, sum_y, sum_x2, sum_y2, sum_xy):
+    """Pearson correlation from _pearson_stats output.
+
+    NaN rules follow the C kernel: less than 3 common values or a
+    denominator below 1e-5 give NaN. Intermediate terms are computed in
+    place, so besides the result only one temporary of the same shape is
+    allocated.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # same operation order as the C kernel
+        tmp = np.multiply(sum_x, sum_x)
+        den = np.multiply(n, sum_x2)
+        den -= tmp
+        np.sqrt(den, out=den)
+        np.multiply(sum_y, sum_y, out=tmp)
+        result = np.multiply(n, sum_y2)
+        result -= tmp
+        np.sqrt(result, out=result)
+        den *= result
+        
+        np.multiply(n, sum_xy, out=result)
+        np.multiply(sum_x, sum_y, out=tmp)
+        result -= tmp
+        result /= den
+        result[(n < 3) | ~(den >= .00001)] = np.nan
+    
+    return result
+
+def _masked_pearson(x, y=None, tile_size=256):
+    """Pairwise-complete Pearson correlation through matrix products.
+
+    The result is computed a band of tile_size rows of x at a time, so the
+    sufficient statistics only take a few (tile_size, len(y)) temporaries
+    instead of six full matrices. With y omitted only the upper triangle is
+    computed and mirrored.
+
+    Args:
+        x: 2D array, one profile per row.
+        y: optional second 2D array with the same number of columns. If
+            omitted, x is correlated with itself.
+        tile_size: Number of rows of x per band.
+
+    Returns:
+        Array of shape (len(x), len(y)).
+    """
+    square = y is None
+    if square:
+        y = x
+    result = np.empty((x.shape[0], y.shape[0]))
+    for i0, i1 in _tiles(x.shape[0], tile_size):
+        j0 = i0 if square else 0
+        block = _pearson_from_stats(*_pearson_stats(x[i0:i1], y[j0:]))
+        if square:
+            # exactly symmetric, as with the full matrix products
+            diagonal = block[:, :i1 - i0]
+            lower = np.tril_indices(i1 - i0, -1)
+            diagonal[lower] = diagonal.T[lower]
+            result[i1:, i0:i1] = block[:, i1 - i0:].T
+        result[i0:i1, j0:] = block
+    return result
+
+def _c_input(values):
+    """Values the C kernels can read in place, only other types are converted."""
+    values = np.asarray(values)
+    if values.dtype not in (np.float32, np.float64) or not values.dtype.isnative:
+        values = values.astype(np.float64)
+    return values
+
+def _output(out, shape):
+    if out is None:
+        return np.empty(shape)
+    if out.shape != shape:
+        raise ValueError('Output expected %s but got %s' % (shape, out.shape))
+    return out
+
+def _correlation_c(values, n_jobs, out=None):
+    from . import c_impl
+    values = _c_input(values)
+    out = _output(out, (values.shape[0], values.shape[0]))
+    c_impl.correlation(values, out, n_jobs)
+    return out
+
+def _correlation_blas(values, n_jobs, out=None):
+    result = _masked_pearson(np.asarray(values, dtype=np.float64))
+    np.fill_diagonal(result, 0)
+    if out is not None:
+        out[...] = result
+        return out
+    return result
+
+def _correlation_pandas(values, n_jobs, out=None):
+    if n_jobs > 1:
+        logger.debug('Pandas correlation runs in a single thread, ignoring n_jobs=%d.', n_jobs)
+    result = p.DataFrame(values.T).corr(min_periods=3).values - np.identity(values.shape[0])
+    if out is not None:
+        out[...] = result
+        return out
+    return result
+
+def _cross_correlation_c(a, b, n_jobs, out=None):
+    from . import c_impl
+    a, b = _c_input(a), _c_input(b)
+    out = _output(out, (a.shape[0], b.shape[0]))
+    c_impl.cross_correlation(a, b, out, n_jobs)
+    return out
+
+def _cross_correlation_blas(a, b, n_jobs, out=None):
+    result = _masked_pearson(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    if out is not None:
+        out[...] = result
+        return out
+    return result
+
+def _cross_correlation_pandas(a, b, n_jobs, out=None):
+    result = p.DataFrame(np.vstack([a, b]).T).corr(min_periods=3).values[:a.shape[0], a.shape[0]:]
+    if out is not None:
+        out[...] = result
+        return out
+    return result
+
+BACKEND_C = 'c'
+BACKEND_BLAS = 'blas'
+BACKEND_PANDAS = 'pandas'
+
+# Besides the result, the blas backend holds zero-filled copies and masks of
+# the profiles and a few temporaries of 256 rows by all profiles, the C
+# kernel writes straight into the result.
+BACKENDS = {
+    BACKEND_C: _correlation_c,
+    BACKEND_BLAS: _correlation_blas,
+    BACKEND_PANDAS: _correlation_pandas,
+}
+
+CROSS_BACKENDS = {
+    BACKEND_C: _cross_correlation_c,
+    BACKEND_BLAS: _cross_correlation_blas,
+    BACKEND_PANDAS: _cross_correlation_pandas,
+}
+
+def _resolve_backend(backend):
+    if backend is None:
+        return BACKEND_C if USE_C_OPT else BACKEND_BLAS
+    if backend not in BACKENDS:
+        raise ValueError('Unknown correlation backend "%s", use one of: %s' % (backend, ', '.join(sorted(BACKENDS))))
+    if backend == BACKEND_C and not USE_C_OPT:
+        raise ValueError('Correlation backend "c" requires the compiled extension.')
+    return backend
+
+def _profiles(data, axis):
+    """Labels and values of a DataFrame with profiles along the given axis."""
     if axis not in ('rows', 'columns'):
         raise ValueError('Correlation axis must be either "rows" or "columns".')
+    if axis == 'rows':
+        return data.index, data.values
+    return data.columns, data.values.T
+
+def _features(data, axis):
+    """Labels of the axis profiles are measured on."""
+    return data.columns if axis == 'rows' else data.index
+
+def _aligned(data, axis, labels, features):
+    """Profile values for the given labels and features, NaN where missing."""
+    if axis == 'rows':
+        return np.asarray(data.reindex(index=labels, columns=features).values, dtype=np.float64)
+    return np.asarray(data.reindex(index=features, columns=labels).values.T, dtype=np.float64)
+
+def _profile_digests(values):
+    """Hash of the values of every profile (row)."""
+    values = np.array(values, dtype=np.float64)
+    values[np.isnan(values)] = np.nan # a single NaN bit pattern
+    return np.array([hashlib.sha1(row.tobytes()).hexdigest() for row in values], dtype='S40')
+
+def _upper_bands(values, tile_size, n_jobs, backend):
+    """Correlations of the upper triangle computed band by band.
+
+    Yields:
+        Tuples of (start, stop, block) where block holds correlations of
+        profiles start:stop with profiles start: onwards.
+    """
+    square, cross = BACKENDS[backend], CROSS_BACKENDS[backend]
+    size = values.shape[0]
+    for i0, i1 in _tiles(size, tile_size):
+        block = np.empty((i1 - i0, size - i0))
+        square(values[i0:i1], n_jobs, out=block[:, :i1 - i0])
+        if i1 < size:
+            cross(values[i0:i1], values[i1:], n_jobs, out=block[:, i1 - i0:])
+        yield i0, i1, block
+
+class _TopK(object):
+    '''
+    Bounded buffer with the k highest correlations of every profile.
+
+    Works like a min-heap per profile but is updated for whole blocks of
+    candidates at once with argpartition, memory use is O(profiles * k).
+    '''
+
+    def __init__(self, size, k):
+        self.k = min(k, max(size - 1, 0))
+        self.values = np.full((size, self.k), -np.inf)
+        self.indices = np.zeros((size, self.k), dtype=np.int64)
+    
+    def push(self, rows, columns, block):
+        """Offer block[r, c] as partner columns[c] of profile rows[r]."""
+        if not self.k:
+            return
+        block = np.where(np.isnan(block), -np.inf, block)
+        values = np.concatenate([self.values[rows], block], axis=1)
+        indices = np.concatenate([
+            self.indices[rows],
+            np.broadcast_to(columns, block.shape)], axis=1)
+        best = np.argpartition(-values, self.k - 1, axis=1)[:, :self.k]
+        self.values[rows] = np.take_along_axis(values, best, axis=1)
+        self.indices[rows] = np.take_along_axis(indices, best, axis=1)
+    
+    def push_band(self, start, stop, block):
+        """Offer a band from _upper_bands to both profiles of every pair."""
+        size = self.values.shape[0]
+        # no self pairs
+        block = block.copy()
+        np.fill_diagonal(block[:, :stop - start], -np.inf)
+        self.push(slice(start, stop), np.arange(start, size), block)
+        if stop < size:
+            self.push(slice(stop, size), np.arange(start, stop), block[:, stop - start:].T)
+
+def correlation(data, axis='rows', n_jobs=1, backend=None, stats=None, condensed=False,
+                dtype=np.float64, tile_size=1024, out=None, top_k=None):
+    """Pairwise Pearson correlation of rows or columns of a table.
+
+    Missing values are excluded pairwise, pairs with fewer than 3 common
+    values are NaN and the diagonal is set to 0.
+
+    Args:
+        data: pandas DataFrame with the profiles.
+        axis: correlate 'rows' or 'columns'.
+        n_jobs: number of threads used by the C kernel, -1 uses all CPUs.
+            The BLAS backend is threaded by the BLAS library itself.
+        backend: one of BACKENDS. Defaults to 'c' if the extension is
+            compiled and 'blas' otherwise.
+        stats: Optional path of a CorrelationStats file. If it exists, the
+            cached statistics are updated with new profiles and features of
+            data instead of recomputing everything, otherwise they are
+            computed from scratch. The file is (re)written in both cases and
+            backend is ignored.
+        condensed: Return only the upper triangle as a CondensedMatrix. It
+            is filled in bands of tile_size profiles so the square matrix is
+            never allocated, except with stats, which are kept as square
+            matrices anyway.
+        dtype: Value type of the result, ie. np.float32.
+        tile_size: Number of profiles per band for condensed results.
+        out: Optional preallocated square float32/float64 array for the
+            values, ie. a memmap or a view into a bigger matrix. The C
+            kernel writes into it directly with any memory layout.
+        top_k: Keep only the top_k highest correlations of every profile.
+            Bands of tile_size profiles are computed and reduced one at a
+            time, so memory use is O(profiles * top_k).
+
+    Returns:
+        A square DataFrame labeled with the correlated axis, a
+        CondensedMatrix if condensed is set or an EdgeList if top_k is set.
+    """
+    from .storage import CondensedMatrix, EdgeList
+    
+    if stats is not None:
+        result = _stats_correlation(data, axis, stats)
+        if top_k:
+            return EdgeList.from_frame(result, top_k)
+        if condensed:
+            return CondensedMatrix.from_frame(result, dtype)
+        return result if (result.dtypes == dtype).all() else result.astype(dtype)
+    
+    n_jobs = _resolve_jobs(n_jobs)
+    backend = _resolve_backend(backend)
     
-    if USE_C_OPT:
-        from . import c_impl
-        if axis == 'rows':
-            result = p.DataFrame(
-                np.zeros((data.shape[0], data.shape[0])), 
-                index=data.index, 
-                columns=data.index)
-            c_impl.correlation(data, result.values)
-        else:
-            result = p.DataFrame(
-                np.zeros((data.shape[1], data.shape[1])), 
-                index=data.columns, 
-                columns=data.columns)
-            c_impl.correlation(data.T, result.values)
+    labels, values = _profiles(data, axis)
+    
+    if top_k:
+        logger.debug('Correlating %d profiles keeping top %d partners with %s backend.', len(labels), top_k, backend)
+        best = _TopK(len(labels), int(top_k))
+        for start, stop, block in _upper_bands(values, max(int(tile_size), 1), n_jobs, backend):
+            best.push_band(start, stop, block)
+        return EdgeList.from_top_k(best.indices, best.values, labels)
+    
+    if condensed:
+        logger.debug('Correlating %d profiles in condensed form with %s backend.', len(labels), backend)
+        result = CondensedMatrix.empty(labels, dtype)
+        for start, stop, block in _upper_bands(values, max(int(tile_size), 1), n_jobs, backend):
+            result.set_row_band(start, stop, block)
         return result
+    
+    logger.debug('Correlating %d profiles with %s backend.', len(labels), backend)
+    if out is None:
+        out = np.empty((len(labels), len(labels)), dtype=dtype)
+    result = BACKENDS[backend](values, n_jobs, out=out)
+    return p.DataFrame(result, index=labels, columns=labels, copy=False)
+
+def cross_correlation(a, b, axis='rows', n_jobs=1, backend=None):
+    """Pearson correlation of every profile in a with every profile in b.
+
+    Only the |a| x |b| block is computed. Profiles are aligned on the labels
+    of the other axis (columns for axis='rows' and vice versa), labels
+    missing from one of the tables are ignored. Unlike correlation(), a
+    profile present in both sets correlates with itself as 1.
+
+    Args:
+        a: pandas DataFrame with the first set of profiles.
+        b: pandas DataFrame with the second set of profiles.
+        axis: correlate 'rows' or 'columns'.
+        n_jobs: number of threads used by the C kernel, -1 uses all CPUs.
+        backend: one of CROSS_BACKENDS, see correlation().
+
+    Returns:
+        DataFrame indexed by profiles of a with profiles of b as columns.
+    """
+    n_jobs = _resolve_jobs(n_jobs)
+    backend = _resolve_backend(backend)
+    
+    if axis == 'rows':
+        if not a.columns.equals(b.columns):
+            common = a.columns.intersection(b.columns, sort=False)
+            a, b = a.loc[:, common], b.loc[:, common]
+    elif axis == 'columns' and not a.index.equals(b.index):
+        common = a.index.intersection(b.index, sort=False)
+        a, b = a.loc[common, :], b.loc[common, :]
+    
+    labels_a, values_a = _profiles(a, axis)
+    labels_b, values_b = _profiles(b, axis)
+    
+    logger.debug('Correlating %d x %d profiles with %s backend.', len(labels_a), len(labels_b), backend)
+    result = CROSS_BACKENDS[backend](values_a, values_b, n_jobs)
+    return p.DataFrame(result, index=labels_a, columns=labels_b, copy=False)
+
+class CorrelationRows(object):
+    '''
+    Square correlation matrix whose rows are computed when they are read.
+
+    Indexing with a slice or an array of row positions returns those rows
+    of correlation(data, axis) (diagonal included), computed with the
+    cross_correlation() kernels against all profiles. It stands in for a
+    square layer in merge.merge_layers_top_k(), so the layer is never held
+    in memory, at the cost of computing both triangles.
+
+    Args:
+        data: pandas DataFrame with the profiles.
+        axis: correlate 'rows' or 'columns'.
+        n_jobs: number of threads used by the C kernel, -1 uses all CPUs.
+        backend: one of CROSS_BACKENDS, see correlation().
+        transform: Optional callable applied to every block of rows, ie.
+            QuantileMapper.transform_values.
+    '''
+
+    def __init__(self, data, axis='rows', n_jobs=1, backend=None, transform=None):
+        self.n_jobs = _resolve_jobs(n_jobs)
+        self.backend = _resolve_backend(backend)
+        self.transform = transform
+        self.labels, self.profiles = _profiles(data, axis)
+        self.shape = (len(self.labels), len(self.labels))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        rows = np.arange(self.shape[0])[rows]
+        logger.debug('Correlating %d of %d profiles with %s backend.', len(rows), self.shape[0], self.backend)
+        block = CROSS_BACKENDS[self.backend](self.profiles[rows], self.profiles, self.n_jobs)
+        # same as correlation(), profiles do not correlate with themselves
+        block[np.arange(len(rows)), rows] = 0
+        if self.transform is not None:
+            block = self.transform(block)
+        return block
+
+def _read_tile_progress(path, digest):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as inp:
+        if inp.readline().strip() != digest:
+            return done
+        for line in inp:
+            try:
+                i0, j0 = map(int, line.split())
+            except ValueError:
+                # torn line of a killed run
+                continue
+            done.add((i0, j0))
+    return done
+
+def _tile_digest(labels, values, axis, tile_size, dtype):
+    from .cache import cache_key
+    return cache_key('tiled_correlation', axis, labels, values, tile_size, np.dtype(dtype).str)
+
+def tiled_correlation(data, path, axis='rows', tile_size=1024, dtype=np.float64, fmt=None,
+                      dataset='matrix', compression=None, n_jobs=1, backend=None, resume=False):
+    """Out-of-core correlation streamed into an hdf5 dataset or a memmap.
+
+    The result is computed in (I, J) blocks of tile_size profiles for the
+    upper triangle only, every block is written together with its mirror
+    image and released, so memory use is bounded by a few tiles instead of
+    the full matrix. Values are the same as with correlation().
+
+    Diagonal blocks are computed by the correlation() kernels and the rest
+    by the cross_correlation() ones.
+
+    Args:
+        data: pandas DataFrame with the profiles.
+        path: Output file, .h5/.hdf5 for hdf5 and anything else (ie. .npy)
+            for a numpy memmap.
+        axis: correlate 'rows' or 'columns'.
+        tile_size: Number of profiles per block, also the hdf5 chunk size.
+        dtype: Storage type of the result, ie. np.float32 to halve the size.
+        fmt: Override the storage format guessed from the extension.
+        dataset: Name of the hdf5 dataset.
+        compression: hdf5 compression filter.
+        n_jobs: number of threads used by the C kernel, -1 uses all CPUs.
+        backend: one of CROSS_BACKENDS, see correlation().
+        resume: Keep tiles finished by an earlier, interrupted call with the
+            same data and tile size. Finished tiles are listed in a
+            path + '.tiles' checkpoint file, each one after it is flushed
+            to disk. The file is removed once all tiles are done.
+
+    Returns:
+        LazyMatrix with the result, opened for reading and writing.
+    """
+    from .storage import LazyMatrix, create_matrix
+    
+    n_jobs = _resolve_jobs(n_jobs)
+    backend = _resolve_backend(backend)
+    square, cross = BACKENDS[backend], CROSS_BACKENDS[backend]
+    
+    labels, values = _profiles(data, axis)
+    size = len(labels)
+    tile_size = max(int(tile_size), 1)
+    
+    progress = path + '.tiles' if resume else None
+    done = set()
+    if resume:
+        digest = _tile_digest(labels, values, axis, tile_size, dtype)
+        if os.path.exists(path):
+            done = _read_tile_progress(progress, digest)
+    if done:
+        logger.info('Resuming correlation in %s, %d tiles are done.', path, len(done))
+        result = LazyMatrix.open(path, dataset, mode='r+')
+    else:
+        result = create_matrix(path, (size, size), labels, dtype=dtype, fmt=fmt, dataset=dataset,
+                               chunks=(tile_size, tile_size), compression=compression)
+        if progress:
+            with open(progress, 'w') as out:
+                out.write(digest + '\n')
+    
+    # memmap tiles are written by the kernels in place
+    direct = isinstance(result.values, np.ndarray)
+    
+    tiles = _tiles(size, tile_size)
+    logger.debug('Correlating %d profiles in %d tiles into %s.', size, len(tiles) * (len(tiles) + 1) // 2, path)
+    checkpoint = open(progress, 'a') if progress else None
+    try:
+        for n, (i0, i1) in enumerate(tiles):
+            for j0, j1 in tiles[n:]:
+                if (i0, j0) in done:
+                    continue
+                out = result.values[i0:i1, j0:j1] if direct else None
+                if i0 == j0:
+                    block = square(values[i0:i1], n_jobs, out=out)
+                else:
+                    block = cross(values[i0:i1], values[j0:j1], n_jobs, out=out)
+                    result[j0:j1, i0:i1] = block.T
+                if not direct:
+                    result[i0:i1, j0:j1] = block
+                if checkpoint is not None:
+                    result.flush()
+                    checkpoint.write('%d %d\n' % (i0, j0))
+                    checkpoint.flush()
+                    os.fsync(checkpoint.fileno())
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    
+    result.flush()
+    if progress:
+        os.remove(progress)
+    return result
+
+def _stats_correlation(data, axis, path):
+    if os.path.exists(path):
+        stats = CorrelationStats.load(path)
+        if stats.axis != axis:
+            raise ValueError('Statistics in "%s" were computed on %s, not %s.' % (path, stats.axis, axis))
+        stats.update(data)
     else:
-        if axis == 'rows':
-            return data.T.corr(min_periods=3) - np.identity(data.shape[0])
-        return data.corr(min_periods=3) - np.identity(data.shape[1])
-    
\ No newline at end of file
+        logger.debug('No statistics in %s, computing them from scratch.', path)
+        stats = CorrelationStats.from_data(data, axis)
+    stats.save(path)
+    
+    return stats.correlation(_profiles(data, axis)[0])
+
+class CorrelationStats(object):
+    '''
+    Cached per-pair sufficient statistics of Pearson correlations.
+
+    For every ordered pair of profiles (i, j) it keeps the number of values
+    present in both, the sum and the sum of squares of profile i over those
+    values and the sum of cross products. New features (ie. new arrays when
+    correlating queries) are added to the existing sums and new profiles only
+    need their own pairs computed, so appending a screen batch costs a
+    fraction of a full recompute.
+
+    A hash of the values of every seen profile is kept as well. Profiles
+    whose values changed since (ie. in a revised data release) have all
+    their pairs recomputed on update.
+    '''
+
+    def __init__(self, labels, features, axis, n, sum_x, sum_x2, sum_xy, digests=None):
+        self.labels = p.Index(labels)
+        self.features = p.Index(features)
+        self.axis = axis
+        self.n = n
+        self.sum_x = sum_x
+        self.sum_x2 = sum_x2
+        self.sum_xy = sum_xy
+        self.digests = digests
+    
+    @classmethod
+    def from_data(cls, data, axis='rows'):
+        """Compute statistics of all profile pairs of a DataFrame."""
+        labels, values = _profiles(data, axis)
+        n, sum_x, _, sum_x2, _, sum_xy = _pearson_stats(np.asarray(values, dtype=np.float64))
+        return cls(labels, _features(data, axis), axis, n, sum_x, sum_x2, sum_xy, _profile_digests(values))
+    
+    def _drop(self, labels):
+        keep = ~self.labels.isin(labels)
+        cells = np.ix_(keep, keep)
+        self.n = self.n[cells]
+        self.sum_x = self.sum_x[cells]
+        self.sum_x2 = self.sum_x2[cells]
+        self.sum_xy = self.sum_xy[cells]
+        self.labels = self.labels[keep]
+        self.digests = self.digests[keep]
+    
+    def update(self, data):
+        """Add profiles and features of data that are not in the statistics yet.
+
+        Profiles whose values on the seen features changed are recomputed
+        as if they were new.
+
+        Args:
+            data: DataFrame oriented the same way as the one the statistics
+                were computed from, usually the previous table with rows
+                and/or columns appended.
+        """
+        labels = _profiles(data, self.axis)[0]
+        if self.digests is None:
+            # can not be verified, recompute all profiles
+            self.digests = np.zeros(len(self.labels), dtype='S40')
+        seen = self.labels.intersection(labels, sort=False)
+        current = _profile_digests(_aligned(data, self.axis, seen, self.features))
+        changed = seen[current != self.digests[self.labels.get_indexer(seen)]]
+        if len(changed):
+            logger.warning('%d profiles changed since the correlation statistics were computed, '
+                           'recomputing their pairs.', len(changed))
+            self._drop(changed)
+        
+        new_features = _features(data, self.axis).difference(self.features, sort=False)
+        new_labels = labels.difference(self.labels, sort=False)
+        logger.debug('Updating correlation statistics with %d new profiles and %d new features.',
+                     len(new_labels), len(new_features))
+        
+        if len(new_features):
+            # existing pairs just accumulate the new values
+            n, sum_x, _, sum_x2, _, sum_xy = _pearson_stats(_aligned(data, self.axis, self.labels, new_features))
+            self.n += n
+            self.sum_x += sum_x
+            self.sum_x2 += sum_x2
+            self.sum_xy += sum_xy
+            self.features = self.features.append(new_features)
+        
+        if len(new_labels):
+            old = _aligned(data, self.axis, self.labels, self.features)
+            new = _aligned(data, self.axis, new_labels, self.features)
+            n, sum_x, sum_y, sum_x2, sum_y2, sum_xy = _pearson_stats(old, new)
+            new_n, new_sum_x, _, new_sum_x2, _, new_sum_xy = _pearson_stats(new)
+            
+            # sum_x[i, j] is the sum of profile i, so pairs (new, old) take the y sums
+            self.n = np.block([[self.n, n], [n.T, new_n]])
+            self.sum_x = np.block([[self.sum_x, sum_x], [sum_y.T, new_sum_x]])
+            self.sum_x2 = np.block([[self.sum_x2, sum_x2], [sum_y2.T, new_sum_x2]])
+            self.sum_xy = np.block([[self.sum_xy, sum_xy], [sum_xy.T, new_sum_xy]])
+            self.labels = self.labels.append(new_labels)
+        
+        self.digests = _profile_digests(_aligned(data, self.axis, self.labels, self.features))
+    
+    def correlation(self, labels=None):
+        """Correlation matrix of the profiles seen so far.
+
+        Args:
+            labels: Optional subset (and order) of profiles to return.
+
+        Returns:
+            A square DataFrame with the same values as correlation().
+        """
+        result = _pearson_from_stats(self.n, self.sum_x, self.sum_x.T, self.sum_x2, self.sum_x2.T, self.sum_xy)
+        np.fill_diagonal(result, 0)
+        result = p.DataFrame(result, index=self.labels, columns=self.labels)
+        if labels is not None and not self.labels.equals(p.Index(labels)):
+            result = result.loc[labels, labels]
+        return result
+    
+    def save(self, path):
+        """Write statistics to an hdf5 file, replacing it atomically."""
+        from .storage import write_hdf5_labels
+        
+        tmp_path = path + '.tmp'
+        with h5py.File(tmp_path, 'w') as h5:
+            h5.attrs['axis'] = self.axis
+            write_hdf5_labels(h5, 'labels', self.labels)
+            write_hdf5_labels(h5, 'features', self.features)
+            h5.create_dataset('n', data=self.n.astype(np.int32))
+            h5.create_dataset('sum_x', data=self.sum_x)
+            h5.create_dataset('sum_x2', data=self.sum_x2)
+            h5.create_dataset('sum_xy', data=self.sum_xy)
+            h5.create_dataset('digests', data=self.digests)
+        os.rename(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        """Read statistics written by save()."""
+        from .storage import decode_labels
+        
+        with h5py.File(path, 'r') as h5:
+            axis = h5.attrs['axis']
+            return cls(
+                decode_labels(h5['labels'][:]),
+                decode_labels(h5['features'][:]),
+                axis.decode('utf-8') if isinstance(axis, bytes) else axis,
+                h5['n'][:].astype(np.float64),
+                h5['sum_x'][:],
+                h5['sum_x2'][:],
+                h5['sum_xy'][:],
+                h5['digests'][:] if 'digests' in h5 else None)
@@ -0,0 +1,139 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+import logging
+
+import numpy as np
+import pandas as p
+
+
+logger = logging.getLogger(__name__)
+
+class LabelCatalog(object):
+    '''
+    Parsed strain labels of the loaded datasets.
+
+    Labels have the ORF_strain form, ie. "YAL001C_tsq123", where the strain
+    id starts with its type (tsa, tsq, dma, sn, damp, y). Every label is
+    parsed once into ORF, strain, strain type and allele (through the
+    strain map) categorical arrays, so filtering and relabeling any layer axis is
+    a vectorized lookup.
+
+    Args:
+        strain_map: Optional dict of strain id -> allele name.
+    '''
+
+    def __init__(self, strain_map=None):
+        self.strain_map = strain_map
+        self.labels = p.Index([], dtype=object)
+        empty = p.Categorical.from_codes([], categories=p.Index([], dtype=object))
+        self.orf = self.strain = self.strain_type = empty
+        self.allele = empty if strain_map is not None else None
+
+    @staticmethod
+    def _extend(categorical, values):
+        """Categorical with values appended, codes of existing values are kept."""
+        values = np.asarray(values, dtype=object)
+        categories = categorical.categories
+        new = p.Index(values, dtype=object).dropna().unique()
+        categories = p.Index(np.concatenate([categories.values, new[~new.isin(categories)].values]), dtype=object)
+        codes = np.concatenate([categorical.codes, categories.get_indexer(values)])
+        return p.Categorical.from_codes(codes, categories=categories)
+
+    def _parse(self, labels):
+        parts = p.Series(labels, dtype=object).str.split('_')
+        orfs, strains = parts.str[0], parts.str[1]
+        strain_types = strains.str.extract(r'^(\D+)', expand=False)
+        alleles = strains.map(self.strain_map) if self.strain_map is not None else None
+        return orfs, strains, strain_types, alleles
+
+    def add(self, labels):
+        """Parse labels that are not in the catalog yet."""
+        labels = p.Index(labels, dtype=object).unique()
+        labels = labels[~labels.isin(self.labels)]
+        if len(labels):
+            parsed = self._parse(labels)
+            self.labels = self.labels.append(labels)
+            self.orf, self.strain, self.strain_type, self.allele = [
+                None if values is None else self._extend(old, values)
+                for old, values in zip((self.orf, self.strain, self.strain_type, self.allele), parsed)]
+            logger.debug("Label catalog has %d labels.", len(self.labels))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _rows(self, labels):
+        rows = self.labels.get_indexer(labels)
+        if len(rows) and rows.min() < 0:
+            raise KeyError('Labels missing from the catalog: %s' % (
+                ', '.join(map(str, np.asarray(labels, dtype=object)[rows < 0][:5])),))
+        return rows
+
+    def _type_mask(self, prefixes):
+        """Labels whose strain type starts with any of the prefixes."""
+        categories = self.strain_type.categories
+        hits = np.zeros(len(categories) + 1, dtype=bool)
+        for prefix in prefixes:
+            hits[:-1] |= np.asarray(categories.str.startswith(prefix), dtype=bool)
+        # code -1 (no strain type) maps to the last, always False entry
+        return hits[self.strain_type.codes]
+
+    def select(self, labels, include=None, exclude=None):
+        """Labels with a strain type of include and none of exclude.
+
+        Args:
+            labels: Labels to filter, keeps their order.
+            include: Strain type prefixes to keep, ie. ('tsa',). All labels if None.
+            exclude: Strain type prefixes to drop, ie. ('y', 'damp').
+
+        Returns:
+            List of selected labels.
+        """
+        labels = np.asarray(labels, dtype=object)
+        rows = self._rows(labels)
+        keep = np.ones(len(rows), dtype=bool)
+        if include:
+            keep &= self._type_mask(include)[rows]
+        if exclude:
+            keep &= ~self._type_mask(exclude)[rows]
+        return list(labels[keep])
+
+    def orfs(self, labels):
+        """ORFs of labels as an array."""
+        return np.asarray(self.orf, dtype=object)[self._rows(labels)]
+
+    def alleles(self, labels):
+        """Allele names of labels as an array."""
+        if self.allele is None:
+            raise ValueError('Label catalog has no strain map')
+        rows = self._rows(labels)
+        codes = self.allele.codes[rows]
+        if len(codes) and codes.min() < 0:
+            missing = np.asarray(self.strain)[rows[codes < 0]]
+            raise KeyError('Strains missing from the strain map: %s' % (', '.join(map(str, missing[:5])),))
+        return np.asarray(self.allele.categories, dtype=object)[codes]
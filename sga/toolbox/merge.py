@@ -0,0 +1,196 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+import logging
+
+import numpy as np
+import pandas as p
+
+
+logger = logging.getLogger(__name__)
+
+def _positions(axis, labels):
+    if not p.Index(labels).is_unique:
+        raise ValueError('Layer labels are not unique')
+    return axis.get_indexer(labels)
+
+def merge_layers(layers, labels=None, out=None, tile_size=256):
+    """Average square similarity layers over the union of their labels.
+
+    Every cell of the result is the mean of the layers that have a value
+    for that pair of labels, NaN if none does, same as nanmean of the
+    layers reindexed to the union of labels. Values are summed straight
+    into the output a tile of rows at a time, next to a per cell count, so
+    besides the output only one byte per cell and one tile of a layer are
+    held in memory. Layers can be on-disk matrices, ie. LazyMatrix values.
+
+    Args:
+        layers: Sequence of (values, labels) pairs. Values is a square array
+            like object (ndarray, memmap, hdf5 dataset), labels name its rows
+            and columns.
+        labels: Labels of the result. Defaults to the sorted union of layer
+            labels, layer labels missing from it are dropped.
+        out: Optional preallocated float array (ie. a memmap) of shape
+            (len(labels), len(labels)) receiving the result.
+        tile_size: Number of layer rows merged at a time.
+
+    Returns:
+        DataFrame with the merged similarities, backed by out if given.
+    """
+    layers = [(values, np.asarray(layer_labels, dtype=object)) for values, layer_labels in layers]
+    if labels is None:
+        labels = np.unique(np.concatenate([np.asarray(l, dtype=object) for _, l in layers]))
+    axis = p.Index(labels)
+    size = len(axis)
+    logger.debug("Merging %d layers on a %d labels axis.", len(layers), size)
+
+    if out is None:
+        out = np.zeros((size, size), dtype=np.float64)
+    else:
+        out[:] = 0
+    counts = np.zeros((size, size), dtype=np.uint8 if len(layers) < 256 else np.uint32)
+
+    for values, layer_labels in layers:
+        positions = _positions(axis, layer_labels)
+        keep = np.nonzero(positions >= 0)[0]
+        columns = positions[keep]
+        for start in range(0, len(layer_labels), tile_size):
+            tile_rows = np.nonzero(positions[start:start + tile_size] >= 0)[0]
+            if not len(tile_rows):
+                continue
+            tile = np.asarray(values[start:start + tile_size])[np.ix_(tile_rows, keep)]
+            rows = positions[start + tile_rows]
+
+            valid = ~np.isnan(tile)
+            tile[~valid] = 0
+            cells = np.ix_(rows, columns)
+            out[cells] += tile
+            counts[cells] += valid
+
+    for start in range(0, size, tile_size):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[start:start + tile_size] /= counts[start:start + tile_size]
+
+    return p.DataFrame(out, index=axis, columns=axis, copy=False)
+
+def _merged_tiles(layers, size, tile_size):
+    """Merged rows of layers positioned on an axis, a tile of rows at a time.
+
+    Yields:
+        Tuples of (start, stop, tile) where tile holds merged rows
+        start:stop over the whole axis.
+    """
+    for start in range(0, size, tile_size):
+        stop = min(start + tile_size, size)
+        tile = np.zeros((stop - start, size), dtype=np.float64)
+        counts = np.zeros(tile.shape, dtype=np.uint8 if len(layers) < 256 else np.uint32)
+        for values, positions in layers:
+            # layer rows in this tile, in increasing order for hdf5 reads
+            layer_rows = np.nonzero((positions >= start) & (positions < stop))[0]
+            if not len(layer_rows):
+                continue
+            keep = np.nonzero(positions >= 0)[0]
+            block = np.asarray(values[layer_rows])[:, keep]
+
+            valid = ~np.isnan(block)
+            block[~valid] = 0
+            cells = np.ix_(positions[layer_rows] - start, positions[keep])
+            tile[cells] += block
+            counts[cells] += valid
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tile /= counts
+        yield start, stop, tile
+
+def _positioned(layers, labels):
+    layers = [(values, np.asarray(layer_labels, dtype=object)) for values, layer_labels in layers]
+    if labels is None:
+        labels = np.unique(np.concatenate([np.asarray(l, dtype=object) for _, l in layers]))
+    axis = p.Index(labels)
+    return [(values, _positions(axis, layer_labels)) for values, layer_labels in layers], axis
+
+def merge_layers_top_k(layers, k, labels=None, tile_size=256):
+    """Top k partners of every label in the merged similarity layers.
+
+    Same as EdgeList.from_frame(merge_layers(layers, labels), k), without
+    the merged matrix. Merged rows are built a tile at a time from the rows
+    of every layer that fall into the tile and reduced to their top k
+    partners right away, so memory use is O(tile_size * labels) besides the
+    O(labels * k) result. Layers are only read by rows, so they can be
+    correlation.CorrelationRows that compute them on demand.
+
+    Args:
+        layers: Sequence of (values, labels) pairs, see merge_layers().
+        k: Number of partners kept for every label.
+        labels: Labels of the result, see merge_layers().
+        tile_size: Number of merged rows built at a time.
+
+    Returns:
+        EdgeList with the top partners.
+    """
+    from .correlation import _TopK
+    from .storage import EdgeList
+
+    layers, axis = _positioned(layers, labels)
+    size = len(axis)
+    logger.debug("Merging %d layers on a %d labels axis keeping top %d partners.", len(layers), size, k)
+
+    best = _TopK(size, int(k))
+    for start, stop, tile in _merged_tiles(layers, size, tile_size):
+        # no self pairs
+        tile[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        best.push(slice(start, stop), np.arange(size), tile)
+
+    return EdgeList.from_top_k(best.indices, best.values, axis)
+
+def merge_layers_condensed(layers, labels=None, dtype=np.float64, tile_size=256):
+    """Merged similarity layers in condensed (upper triangle) form.
+
+    Same as CondensedMatrix.from_frame(merge_layers(layers, labels), dtype),
+    without the merged matrix. Merged rows are built a tile at a time like
+    in merge_layers_top_k() and stored right away, so besides the condensed
+    result only O(tile_size * labels) values are held in memory.
+
+    Args:
+        layers: Sequence of (values, labels) pairs, see merge_layers_top_k().
+        labels: Labels of the result, see merge_layers().
+        dtype: Value type of the result, ie. np.float32.
+        tile_size: Number of merged rows built at a time.
+
+    Returns:
+        CondensedMatrix with the merged similarities.
+    """
+    from .storage import CondensedMatrix
+
+    layers, axis = _positioned(layers, labels)
+    logger.debug("Merging %d layers on a %d labels axis in condensed form.", len(layers), len(axis))
+
+    result = CondensedMatrix.empty(axis, dtype)
+    for start, stop, tile in _merged_tiles(layers, len(axis), tile_size):
+        result.set_row_band(start, stop, tile[:, start:])
+    return result
@@ -0,0 +1,142 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+class _Group(object):
+    '''
+    One correlation computation shared by one or more layers.
+    '''
+
+    def __init__(self, name, dataset, axis, profiles, features):
+        self.name = name
+        self.dataset = dataset
+        self.axis = axis
+        self.profiles = list(profiles)
+        self.features = list(features)
+        self.feature_set = frozenset(self.features)
+        self.layers = set()
+        self.result = None
+        self.lock = threading.Lock()
+    
+    def covers(self, dataset, axis, features):
+        return self.dataset == dataset and self.axis == axis and self.feature_set == frozenset(features)
+
+class CorrelationPlanner(object):
+    '''
+    Plans the correlation layers needed for a set of outputs.
+
+    A layer is the correlation of a subset of profiles of a dataset over a
+    subset of its features. Pairwise-complete Pearson of two profiles only
+    depends on the profiles and the features, so layers of the same
+    dataset, axis and feature set are computed once over the union of their
+    profiles whenever that is cheaper than computing them apart, and each
+    layer is sliced out of the shared result.
+
+    Args:
+        compute: Callable (name, dataset, axis, profiles, features) returning
+            the correlation DataFrame of a planned computation.
+    '''
+
+    def __init__(self, compute):
+        self._compute = compute
+        self._groups = []
+        self._layers = {}
+    
+    def add(self, name, dataset, axis, profiles, features):
+        """Register a layer. Adding a layer name again is a no-op."""
+        if name in self._layers:
+            return self._layers[name][0]
+        
+        profiles = list(profiles)
+        group = None
+        for candidate in self._groups:
+            if not candidate.covers(dataset, axis, features):
+                continue
+            known = set(candidate.profiles)
+            extra = [l for l in profiles if l not in known]
+            if not extra:
+                group = candidate
+                break
+            union = len(candidate.profiles) + len(extra)
+            if candidate.result is None and union ** 2 <= len(candidate.profiles) ** 2 + len(profiles) ** 2:
+                candidate.profiles += extra
+                group = candidate
+                break
+        
+        if group is None:
+            group = _Group(name, dataset, axis, profiles, features)
+            self._groups.append(group)
+        else:
+            logger.debug("Layer %s shares correlations of %s.", name, group.name)
+        
+        group.layers.add(name)
+        self._layers[name] = (group, profiles)
+        return group
+    
+    def __contains__(self, name):
+        return name in self._layers
+    
+    def get(self, name):
+        """Correlation DataFrame of a registered layer."""
+        group, profiles = self._layers[name]
+        with group.lock:
+            if group.result is None:
+                logger.debug("Computing %s %s correlation of %d profiles for layers %s.", group.dataset, group.axis,
+                             len(group.profiles), ', '.join(sorted(group.layers)))
+                group.result = self._compute(group.name, group.dataset, group.axis, group.profiles, group.features)
+        if profiles == group.profiles:
+            return group.result
+        return group.result.loc[profiles, profiles]
+    
+    def computation(self, name):
+        """Name of the planned computation a layer is sliced from."""
+        return self._layers[name][0].name
+    
+    def inputs(self, name):
+        """Planned computation as a (dataset, axis, profiles, features) tuple."""
+        group = self._layers[name][0]
+        return group.dataset, group.axis, group.profiles, group.features
+    
+    def layer(self, name):
+        """Registered layer as a (dataset, axis, profiles, features) tuple."""
+        group, profiles = self._layers[name]
+        return group.dataset, group.axis, profiles, group.features
+    
+    def computations(self):
+        """Planned computations as (name, dataset, axis, profiles, layers) tuples."""
+        return [(g.name, g.dataset, g.axis, len(g.profiles), sorted(g.layers)) for g in self._groups]
+    
+    def clear(self):
+        """Drop all cached results and plans."""
+        self._groups = []
+        self._layers = {}
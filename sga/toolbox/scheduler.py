@@ -0,0 +1,134 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+from collections import OrderedDict
+import logging
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+class TaskGraph(object):
+    '''
+    Named tasks with dependencies, run in dependency order.
+
+    Tasks run in a thread pool, so every task sees the same in-memory
+    inputs without copying them. The correlation kernels and numpy release
+    the GIL in their heavy loops, so independent layers do run concurrently.
+    '''
+
+    def __init__(self):
+        self._tasks = OrderedDict()
+
+    def add(self, name, func, deps=()):
+        """Add a task.
+
+        Args:
+            name: Unique task name.
+            func: Callable without arguments, its return value is the task result.
+            deps: Names of tasks that have to finish first. They must already
+                be added, so the graph can not have cycles.
+        """
+        if name in self._tasks:
+            raise ValueError('Task "%s" already exists' % (name,))
+        deps = tuple(deps)
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError('Task "%s" depends on unknown task "%s"' % (name, dep))
+        self._tasks[name] = (func, deps)
+
+    def __contains__(self, name):
+        return name in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def run(self, n_workers=1):
+        """Run all tasks, at most n_workers at a time.
+
+        The first failure stops scheduling new tasks and is raised once the
+        running ones finish.
+
+        Returns:
+            Dict of task results.
+        """
+        if n_workers <= 1 or len(self._tasks) <= 1:
+            results = {}
+            for name, (func, _) in self._tasks.items():
+                logger.debug("Running task %s.", name)
+                results[name] = func()
+            return results
+
+        results = {}
+        errors = []
+        running = set()
+        pending = OrderedDict(self._tasks)
+        done = threading.Condition()
+
+        def execute(name, func):
+            try:
+                result, error = func(), None
+            except Exception:
+                result, error = None, sys.exc_info()
+            with done:
+                running.discard(name)
+                if error is None:
+                    results[name] = result
+                else:
+                    errors.append((name, error))
+                done.notify()
+
+        pool = ThreadPool(n_workers)
+        try:
+            with done:
+                while (pending and not errors) or running:
+                    for name, (func, deps) in list(pending.items()):
+                        if errors or len(running) >= n_workers:
+                            break
+                        if all(d in results for d in deps):
+                            logger.debug("Starting task %s.", name)
+                            del pending[name]
+                            running.add(name)
+                            pool.apply_async(execute, (name, func))
+                    if running:
+                        done.wait()
+                    elif pending and not errors:
+                        raise RuntimeError('Tasks %s can not be scheduled' % (', '.join(pending),))
+        finally:
+            pool.close()
+            pool.join()
+
+        if errors:
+            name, (_, error, tb) = errors[0]
+            logger.error("Task %s failed.", name)
+            if hasattr(error, 'with_traceback'):
+                raise error.with_traceback(tb)
+            raise error
+        return results
@@ -0,0 +1,118 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+class QuantileSketch(object):
+    '''
+    Mergeable streaming quantile sketch.
+
+    A stack of compactors as in the KLL sketch: values land in level 0 and
+    whenever a level holds more than `capacity` items, they are sorted and
+    every other one (random offset) is promoted to the next level with
+    twice the weight. Memory use is O(capacity * log(n / capacity)), the
+    sketch can be updated chunk by chunk and sketches of different chunks
+    can be merged.
+
+    Args:
+        eps: Target rank error as a fraction of the number of values.
+        seed: Seed of the compaction offsets, for reproducible results.
+    '''
+
+    def __init__(self, eps=.001, seed=None):
+        if not 0 < eps < 1:
+            raise ValueError('Sketch error must be between 0 and 1, got %s' % (eps,))
+        self.eps = eps
+        self.capacity = int(np.ceil(4. / eps))
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self._random = np.random.RandomState(seed)
+    
+    def update(self, values):
+        """Add values, NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+    
+    def merge(self, other):
+        """Add everything summarized by another sketch."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+        return self
+    
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity:
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                even = len(items) - len(items) % 2
+                offset = self._random.randint(2)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[offset:even:2]])
+                self.levels[level] = items[even:]
+            level += 1
+    
+    def _weighted(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(l), 2. ** n) for n, l in enumerate(self.levels)])
+        order = np.argsort(items, kind='mergesort')
+        items, weights = items[order], weights[order]
+        # rank of every item as the middle of its weight
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return items, ranks
+    
+    def quantiles(self, q):
+        """Values at normalized ranks q (0-1)."""
+        if not self.count:
+            return np.full(np.shape(q), np.nan)
+        items, ranks = self._weighted()
+        return np.interp(q, ranks, items)
+    
+    def ranks(self, values):
+        """Normalized ranks (0-1) of values."""
+        if not self.count:
+            return np.full(np.shape(values), np.nan)
+        items, ranks = self._weighted()
+        return np.interp(values, items, ranks, left=0., right=1.)
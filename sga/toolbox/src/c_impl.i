@@ -27,6 +27,9 @@ SOFTWARE.
 // Numpy Related Includes:
 %{
 #define SWIG_FILE_WITH_INIT
+// shared with kernels that use the numpy C API directly
+#define PY_ARRAY_UNIQUE_SYMBOL SGA_ARRAY_API
+#include "correlation.h"
 %}
 // numpy arrays
 %include "numpy.i"
@@ -34,17 +37,22 @@ SOFTWARE.
 import_array(); // This is essential. We will get a crash in Python without it.
 %}
 
-// These names must exactly match the function declaration.
-%apply (double* IN_ARRAY2, int DIM1, int DIM2) \
-      {(double* npyArray2D, int npyLength1D, int npyLength2D)}
-%apply (double* INPLACE_ARRAY2, int DIM1, int DIM2) \
-      {(double* resultArray2D, int resLen1D, int resLen2D)}
+// Kernels report errors through PyErr_*, propagate them to the caller.
+%exception {
+    $action
+    if (PyErr_Occurred()) SWIG_fail;
+}
 
-%include "correlation.h"
+// correlation checks its arguments with the GIL held and releases it itself
+// for the duration of the computation.
+%nothreadallow correlation;
+%nothreadallow cross_correlation;
 
-%clear (double* npyArray2D, int npyLength1D, int npyLength2D);
-%clear (double* resultArray2D, int resLen1D, int resLen2D);
+// Correlation kernels take numpy arrays as they are (any strides, float32 or
+// float64) and write into the caller's output array, nothing is copied.
+%include "correlation.h"
 
+// These names must exactly match the function declaration.
 %apply (double* IN_ARRAY1, int DIM1) \
       {(double* data3_nn, int data3_len)}
 %apply (double* IN_ARRAY1, int DIM1) \
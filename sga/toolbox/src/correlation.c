@@ -24,63 +24,329 @@ SOFTWARE.
 
 #include "correlation.h"
 
+#define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
+#define PY_ARRAY_UNIQUE_SYMBOL SGA_ARRAY_API
+#define NO_IMPORT_ARRAY
+
 #include "math.h"
+#include "pthread.h"
 #include "Python.h"
+#include "numpy/arrayobject.h"
 #include "stdio.h"
+#include "stdlib.h"
+#include "unistd.h"
+
+/* Strided 2D float32/float64 matrix, the numpy array buffer is used as is. */
+typedef struct {
+    char* data;
+    int rows;
+    int cols;
+    npy_intp row_stride;
+    npy_intp col_stride;
+    int is_float;
+} matrix;
+
+typedef double (*pearson_func)(const char* x, npy_intp sx, const char* y, npy_intp sy, int len);
+
+typedef struct {
+    matrix* data;
+    matrix* result;
+    pearson_func pearson;
+    long start;  // first pair index (inclusive)
+    long end;    // last pair index (exclusive)
+} corr_task;
+
+typedef struct {
+    matrix* a;
+    matrix* b;
+    matrix* result;
+    pearson_func pearson;
+    int start;  // first row of a (inclusive)
+    int end;    // last row of a (exclusive)
+} cross_task;
+
+#define PEARSON_IMPL(NAME, TYPE_X, TYPE_Y) \
+static double NAME(const char* x, npy_intp sx, const char* y, npy_intp sy, int len) { \
+    int totNaN = 0, totLength, k; \
+    double sumX, sumY, sumXY, sumX2, sumY2, den; \
+    double val1, val2; \
+    \
+    sumX = sumY = sumXY = sumX2 = sumY2 = 0; \
+    \
+    for (k = 0; k < len; k++) { \
+        val1 = *(const TYPE_X*) (x + k * sx); \
+        val2 = *(const TYPE_Y*) (y + k * sy); \
+        \
+        if (isnan(val1) || isnan(val2)) { \
+            totNaN++; \
+        } else { \
+            sumX += val1; \
+            sumY += val2; \
+            sumXY += val1 * val2; \
+            sumX2 += val1 * val1; \
+            sumY2 += val2 * val2; \
+        } \
+    } \
+    \
+    totLength = len - totNaN; \
+    if (totLength < 3) { \
+        return NAN; \
+    } \
+    \
+    den = sqrt(totLength * sumX2 - sumX * sumX) \
+            * sqrt(totLength * sumY2 - sumY * sumY); \
+    \
+    if (den < .00001) { \
+        return NAN; \
+    } \
+    return (totLength * sumXY - sumX * sumY) / den; \
+}
+
+PEARSON_IMPL(pearson_dd, double, double)
+PEARSON_IMPL(pearson_df, double, float)
+PEARSON_IMPL(pearson_fd, float, double)
+PEARSON_IMPL(pearson_ff, float, float)
+
+static pearson_func select_pearson(matrix* x, matrix* y) {
+    if (x->is_float) {
+        return y->is_float ? pearson_ff : pearson_fd;
+    }
+    return y->is_float ? pearson_df : pearson_dd;
+}
+
+static inline char* row_ptr(matrix* m, long i) {
+    return m->data + i * m->row_stride;
+}
+
+static inline void store(matrix* m, long i, long j, double val) {
+    char* ptr = m->data + i * m->row_stride + j * m->col_stride;
+    if (m->is_float) {
+        *(float*) ptr = (float) val;
+    } else {
+        *(double*) ptr = val;
+    }
+}
+
+/* Wraps a 2D float32/float64 numpy array without copying it. */
+static int get_matrix(PyObject* obj, const char* name, int writable, matrix* m) {
+    PyArrayObject* arr;
+    int type;
+
+    if (!PyArray_Check(obj)) {
+        PyErr_Format(PyExc_TypeError, "%s must be a numpy array", name);
+        return 0;
+    }
+    arr = (PyArrayObject*) obj;
+
+    if (PyArray_NDIM(arr) != 2) {
+        PyErr_Format(PyExc_ValueError, "%s must be 2 dimensional, got %d dimensions",
+                name, PyArray_NDIM(arr));
+        return 0;
+    }
+    type = PyArray_TYPE(arr);
+    if (type != NPY_DOUBLE && type != NPY_FLOAT) {
+        PyErr_Format(PyExc_TypeError, "%s must be float32 or float64", name);
+        return 0;
+    }
+    if (!PyArray_ISALIGNED(arr) || !PyArray_ISNOTSWAPPED(arr)) {
+        PyErr_Format(PyExc_ValueError, "%s must be aligned and in native byte order", name);
+        return 0;
+    }
+    if (writable && !PyArray_ISWRITEABLE(arr)) {
+        PyErr_Format(PyExc_ValueError, "%s must be writeable", name);
+        return 0;
+    }
+
+    m->data = PyArray_BYTES(arr);
+    m->rows = (int) PyArray_DIM(arr, 0);
+    m->cols = (int) PyArray_DIM(arr, 1);
+    m->row_stride = PyArray_STRIDE(arr, 0);
+    m->col_stride = PyArray_STRIDE(arr, 1);
+    m->is_float = type == NPY_FLOAT;
+    return 1;
+}
+
+static int resolve_jobs(int n_jobs, long work) {
+    if (n_jobs <= 0) {
+        n_jobs = (int) sysconf(_SC_NPROCESSORS_ONLN);
+    }
+    if (n_jobs < 1) {
+        n_jobs = 1;
+    }
+    if (n_jobs > work) {
+        n_jobs = work > 0 ? (int) work : 1;
+    }
+    return n_jobs;
+}
+
+/* Runs worker on every task, the first one in the calling thread. Tasks of
+ * threads that fail to start are run in the calling thread as well. */
+static void run_tasks(void* (*worker)(void*), void* tasks, size_t task_size, int n_tasks,
+        pthread_t* threads) {
+    int t, started = 1;
+
+    for (t = 1; t < n_tasks; t++, started++) {
+        if (pthread_create(&threads[t], NULL, worker, (char*) tasks + t * task_size) != 0) {
+            break;
+        }
+    }
+    worker(tasks);
+    for (t = started; t < n_tasks; t++) {
+        worker((char*) tasks + t * task_size);
+    }
+    for (t = 1; t < started; t++) {
+        pthread_join(threads[t], NULL);
+    }
+}
+
+/* Pairs (i, j) with i < j are numbered row by row, so every thread gets an
+ * equally sized slice of the upper triangle instead of an equal number of
+ * rows (first rows have many more pairs than the last ones). */
+static void* correlation_worker(void* arg) {
+    corr_task* task = (corr_task*) arg;
+    matrix* data = task->data;
+    long pair = 0, row_pairs;
+    int i = 0, j;
+    double val;
 
-void correlation(double* npyArray2D, int npyLength1D, int npyLength2D,
-        double* resultArray2D, int resLen1D, int resLen2D) {
-    if (npyLength1D != resLen1D || npyLength1D != resLen2D) {
+    // locate the first pair of this slice
+    row_pairs = data->rows - 1;
+    while (row_pairs > 0 && pair + row_pairs <= task->start) {
+        pair += row_pairs;
+        i++;
+        row_pairs--;
+    }
+    j = i + 1 + (int) (task->start - pair);
+
+    for (pair = task->start; pair < task->end; pair++) {
+        val = task->pearson(row_ptr(data, i), data->col_stride,
+                            row_ptr(data, j), data->col_stride, data->cols);
+
+        store(task->result, i, j, val);
+        store(task->result, j, i, val);
+
+        if (++j == data->rows) {
+            i++;
+            j = i + 1;
+        }
+    }
+
+    return NULL;
+}
+
+void correlation(PyObject* data, PyObject* result, int n_jobs) {
+    matrix dat, res;
+    long total, chunk;
+    int t;
+
+    if (!get_matrix(data, "data", 0, &dat) || !get_matrix(result, "result", 1, &res)) {
+        return;
+    }
+    if (dat.rows != res.rows || dat.rows != res.cols) {
         PyErr_Format(PyExc_ValueError,
                 "Output expected (%d,%d) but got (%d,%d)",
-                npyLength1D, npyLength1D, resLen1D, resLen2D);
+                dat.rows, dat.rows, res.rows, res.cols);
+        return;
+    }
+
+    total = (long) dat.rows * (dat.rows - 1) / 2;
+    n_jobs = resolve_jobs(n_jobs, total);
+
+    corr_task* tasks = malloc(n_jobs * sizeof(corr_task));
+    pthread_t* threads = malloc(n_jobs * sizeof(pthread_t));
+    if (tasks == NULL || threads == NULL) {
+        free(tasks);
+        free(threads);
+        PyErr_NoMemory();
         return;
     }
 
-    int use_flags[npyLength2D];
-    int totNaN, totLength, i, j, k;
-    double sumX, sumY, sumXY, sumX2, sumY2, den;
-    double val1, val2, val;
-
-    for (i = 0; i < npyLength1D; i++) {
-        for (j = i + 1; j < npyLength1D; j++) {
-
-            totNaN = sumX = sumY = 0;
-            sumXY = sumX2 = sumY2 = 0;
-
-            for (k = 0; k < npyLength2D; k++) {
-                val1 = npyArray2D[i * npyLength2D + k];
-                val2 = npyArray2D[j * npyLength2D + k];
-
-                if (isnan(val1) || isnan(val2)) {
-                    use_flags[k] = 0;
-                    totNaN++;
-                } else {
-                    use_flags[k] = 1;
-                    sumX += val1;
-                    sumY += val2;
-                    sumXY += val1 * val2;
-                    sumX2 += val1 * val1;
-                    sumY2 += val2 * val2;
-                }
-            }
-
-            totLength = npyLength2D - totNaN;
-            if (totLength < 3) {
-                val = NAN;
-            } else {  // compute correlation
-                den = sqrt(totLength * sumX2 - sumX * sumX)
-                        * sqrt(totLength * sumY2 - sumY * sumY);
-
-                if (den < .00001) {
-                    val = NAN;
-                } else {
-                    val = (totLength * sumXY - sumX * sumY) / den;
-                }
-            }
-
-            resultArray2D[i * resLen1D + j] = val;
-            resultArray2D[j * resLen1D + i] = val;
+    chunk = (total + n_jobs - 1) / n_jobs;
+    for (t = 0; t < n_jobs; t++) {
+        tasks[t].data = &dat;
+        tasks[t].result = &res;
+        tasks[t].pearson = select_pearson(&dat, &dat);
+        tasks[t].start = t * chunk < total ? t * chunk : total;
+        tasks[t].end = (t + 1) * chunk < total ? (t + 1) * chunk : total;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+
+    for (t = 0; t < dat.rows; t++) {
+        store(&res, t, t, 0.);
+    }
+    run_tasks(correlation_worker, tasks, sizeof(corr_task), n_jobs, threads);
+
+    Py_END_ALLOW_THREADS
+
+    free(tasks);
+    free(threads);
+}
+
+static void* cross_correlation_worker(void* arg) {
+    cross_task* task = (cross_task*) arg;
+    int i, j;
+
+    for (i = task->start; i < task->end; i++) {
+        for (j = 0; j < task->b->rows; j++) {
+            store(task->result, i, j, task->pearson(
+                    row_ptr(task->a, i), task->a->col_stride,
+                    row_ptr(task->b, j), task->b->col_stride, task->a->cols));
         }
     }
+
+    return NULL;
+}
+
+void cross_correlation(PyObject* a, PyObject* b, PyObject* result, int n_jobs) {
+    matrix mat_a, mat_b, res;
+    int chunk, t;
+
+    if (!get_matrix(a, "a", 0, &mat_a) || !get_matrix(b, "b", 0, &mat_b)
+            || !get_matrix(result, "result", 1, &res)) {
+        return;
+    }
+    if (mat_a.cols != mat_b.cols) {
+        PyErr_Format(PyExc_ValueError,
+                "Profiles must have the same length but got %d and %d",
+                mat_a.cols, mat_b.cols);
+        return;
+    }
+    if (mat_a.rows != res.rows || mat_b.rows != res.cols) {
+        PyErr_Format(PyExc_ValueError,
+                "Output expected (%d,%d) but got (%d,%d)",
+                mat_a.rows, mat_b.rows, res.rows, res.cols);
+        return;
+    }
+
+    n_jobs = resolve_jobs(n_jobs, mat_a.rows);
+
+    cross_task* tasks = malloc(n_jobs * sizeof(cross_task));
+    pthread_t* threads = malloc(n_jobs * sizeof(pthread_t));
+    if (tasks == NULL || threads == NULL) {
+        free(tasks);
+        free(threads);
+        PyErr_NoMemory();
+        return;
+    }
+
+    // every row of a has the same number of pairs, plain row blocks are balanced
+    chunk = (mat_a.rows + n_jobs - 1) / n_jobs;
+    for (t = 0; t < n_jobs; t++) {
+        tasks[t].a = &mat_a;
+        tasks[t].b = &mat_b;
+        tasks[t].result = &res;
+        tasks[t].pearson = select_pearson(&mat_a, &mat_b);
+        tasks[t].start = t * chunk < mat_a.rows ? t * chunk : mat_a.rows;
+        tasks[t].end = (t + 1) * chunk < mat_a.rows ? (t + 1) * chunk : mat_a.rows;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+
+    run_tasks(cross_correlation_worker, tasks, sizeof(cross_task), n_jobs, threads);
+
+    Py_END_ALLOW_THREADS
+
+    free(tasks);
+    free(threads);
 }
@@ -22,4 +22,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 */
 
-void correlation(double* npyArray2D, int npyLength1D, int npyLength2D, double* resultArray2D, int resLen1D, int resLen2D);
\ No newline at end of file
+#include "Python.h"
+
+void correlation(PyObject* data, PyObject* result, int n_jobs);
+
+void cross_correlation(PyObject* a, PyObject* b, PyObject* result, int n_jobs);
\ No newline at end of file
@@ -24,20 +24,99 @@ SOFTWARE.
 
 #include "table_norm.h"
 
-void table_norm(double* data3_nn, int data3_len, 
-                double* data2_nn, int data2_len, 
-                long* result, int result_len) {
-    int i, j;
-    for (i = 0; i < data2_len; i++) {
-        for (j = 0; j < data3_len; j++) {
-            if (data3_nn[j] > data2_nn[i])
-                result[j]++;
+#include <pthread.h>
+#include <stdlib.h>
+#include <unistd.h>
+
+typedef struct {
+    double* data3_nn;
+    double* data2_nn;
+    int data2_len;
+    long* result;
+    int start;  // first cell (inclusive)
+    int end;    // last cell (exclusive)
+} norm_task;
+
+/* Number of thresholds strictly below value, data2_nn must be sorted. */
+static long count_below(double value, double* data2_nn, int data2_len) {
+    int lo = 0, hi = data2_len, mid;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (data2_nn[mid] < value) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
         }
     }
-    
-    for (i = 0; i < result_len; i++) {
-        if (result[i] == 0) {
-            result[i] = 1;
+    return lo;
+}
+
+static void* table_norm_worker(void* arg) {
+    norm_task* task = (norm_task*) arg;
+    int j;
+
+    for (j = task->start; j < task->end; j++) {
+        task->result[j] += count_below(task->data3_nn[j], task->data2_nn, task->data2_len);
+        if (task->result[j] == 0) {
+            task->result[j] = 1;
         }
     }
-}
\ No newline at end of file
+
+    return NULL;
+}
+
+void table_norm(double* data3_nn, int data3_len,
+                double* data2_nn, int data2_len,
+                long* result, int result_len, int n_jobs) {
+    norm_task* tasks;
+    pthread_t* threads;
+    int chunk, t, started = 1;
+
+    if (n_jobs <= 0) {
+        n_jobs = (int) sysconf(_SC_NPROCESSORS_ONLN);
+    }
+    if (n_jobs < 1) {
+        n_jobs = 1;
+    }
+    if (n_jobs > data3_len) {
+        n_jobs = data3_len > 0 ? data3_len : 1;
+    }
+
+    tasks = malloc(n_jobs * sizeof(norm_task));
+    threads = malloc(n_jobs * sizeof(pthread_t));
+    if (tasks == NULL || threads == NULL) {
+        // run in a single thread rather than fail
+        free(tasks);
+        free(threads);
+        norm_task task = {data3_nn, data2_nn, data2_len, result, 0, data3_len};
+        table_norm_worker(&task);
+        return;
+    }
+
+    chunk = (data3_len + n_jobs - 1) / n_jobs;
+    for (t = 0; t < n_jobs; t++) {
+        tasks[t].data3_nn = data3_nn;
+        tasks[t].data2_nn = data2_nn;
+        tasks[t].data2_len = data2_len;
+        tasks[t].result = result;
+        tasks[t].start = t * chunk < data3_len ? t * chunk : data3_len;
+        tasks[t].end = (t + 1) * chunk < data3_len ? (t + 1) * chunk : data3_len;
+    }
+
+    for (t = 1; t < n_jobs; t++, started++) {
+        if (pthread_create(&threads[t], NULL, table_norm_worker, &tasks[t]) != 0) {
+            break;
+        }
+    }
+    table_norm_worker(&tasks[0]);
+    for (t = started; t < n_jobs; t++) {
+        table_norm_worker(&tasks[t]);
+    }
+    for (t = 1; t < started; t++) {
+        pthread_join(threads[t], NULL);
+    }
+
+    free(tasks);
+    free(threads);
+}
@@ -22,4 +22,4 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 */
 
-void table_norm(double* data3_nn, int data3_len, double* data2_nn, int data2_len, long* result, int result_len);
\ No newline at end of file
+void table_norm(double* data3_nn, int data3_len, double* data2_nn, int data2_len, long* result, int result_len, int n_jobs);
\ No newline at end of file
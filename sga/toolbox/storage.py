@@ -0,0 +1,498 @@
+'''
+MIT License
+
+Copyright (c) 2026 agent
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Created on Oct 18, 2026
+
+@author: agent
+'''
+
+import logging
+import os
+
+import h5py
+
+import numpy as np
+import pandas as p
+
+
+logger = logging.getLogger(__name__)
+
+FORMAT_HDF5 = 'hdf5'
+FORMAT_MEMMAP = 'memmap'
+
+HDF5_EXTENSIONS = ('.h5', '.hdf5', '.hdf')
+
+def guess_format(path):
+    """Pick the on-disk matrix format from the file extension.
+
+    Args:
+        path: Path to the matrix file.
+
+    Returns:
+        FORMAT_HDF5 for .h5/.hdf5/.hdf files and FORMAT_MEMMAP otherwise.
+    """
+    if os.path.splitext(path)[1].lower() in HDF5_EXTENSIONS:
+        return FORMAT_HDF5
+    return FORMAT_MEMMAP
+
+def labels_path(path):
+    """Sidecar file holding the axis labels of a memmapped matrix."""
+    return path + '.labels'
+
+def decode_labels(labels):
+    """Convert labels read from hdf5 (bytes in recent h5py) to str."""
+    return [l.decode('utf-8') if isinstance(l, bytes) else l for l in labels]
+
+def write_hdf5_labels(group, name, labels):
+    group.create_dataset(name, data=[str(l) for l in labels], dtype=h5py.special_dtype(vlen=str))
+
+def write_text_labels(path, labels):
+    with open(path, 'w') as out:
+        for l in labels:
+            out.write('%s\n' % (l,))
+
+def read_text_labels(path):
+    with open(path) as inp:
+        return [l.rstrip('\n') for l in inp]
+
+def create_matrix(path, shape, labels, dtype=np.float64, fmt=None, dataset='matrix', chunks=None,
+                  compression=None):
+    """Create an empty on-disk matrix to be filled block by block.
+
+    Args:
+        path: Output file. Extension decides the format unless fmt is given.
+        shape: Matrix shape.
+        labels: Axis labels. A pair of (row labels, column labels) for
+            rectangular matrices or a single list for square ones.
+        dtype: Value type.
+        fmt: FORMAT_HDF5 or FORMAT_MEMMAP.
+        dataset: Name of the hdf5 dataset.
+        chunks: hdf5 chunk shape.
+        compression: hdf5 compression filter, ie. 'gzip'.
+
+    Returns:
+        LazyMatrix opened for writing.
+    """
+    fmt = fmt or guess_format(path)
+    index, columns = _split_labels(labels)
+    
+    if fmt == FORMAT_HDF5:
+        h5 = h5py.File(path, 'a')
+        for name in (dataset, '%s_index' % (dataset,), '%s_columns' % (dataset,)):
+            if name in h5:
+                del h5[name]
+        if chunks is not None:
+            chunks = tuple(max(min(c, s), 1) for c, s in zip(chunks, shape))
+        values = h5.create_dataset(dataset, shape=shape, dtype=dtype, chunks=chunks,
+                                   compression=compression, fillvalue=np.nan)
+        write_hdf5_labels(h5, '%s_index' % (dataset,), index)
+        if columns is not index:
+            write_hdf5_labels(h5, '%s_columns' % (dataset,), columns)
+        return LazyMatrix(values, index, columns, h5)
+    elif fmt == FORMAT_MEMMAP:
+        values = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        write_text_labels(labels_path(path), index)
+        if columns is not index:
+            write_text_labels(labels_path(path) + '.columns', columns)
+        return LazyMatrix(values, index, columns)
+    raise ValueError('Unknown matrix format "%s"' % (fmt,))
+
+def _split_labels(labels):
+    if isinstance(labels, tuple) and len(labels) == 2:
+        return list(labels[0]), list(labels[1])
+    labels = list(labels)
+    return labels, labels
+
+def write_matrix(df, path, fmt=None, dataset='matrix', chunks=None, compression=None, chunk_size=1024):
+    """Save a DataFrame as an on-disk matrix that LazyMatrix.open can read.
+
+    Args:
+        df: Matrix to save.
+        path: Output file. Extension decides the format unless fmt is given.
+        fmt: FORMAT_HDF5 or FORMAT_MEMMAP.
+        dataset: Name of the hdf5 dataset.
+        chunks: hdf5 chunk shape. Defaults to blocks of whole rows of about
+            64k values, so reading a row decompresses a single chunk.
+        compression: hdf5 compression filter, ie. 'gzip'.
+        chunk_size: Number of rows copied at a time.
+    """
+    values = np.asarray(df.values)
+    if chunks is None and values.ndim == 2:
+        chunks = (max(65536 // max(values.shape[1], 1), 1), values.shape[1])
+    labels = (df.index, df.columns)
+    if df.index.equals(df.columns):
+        labels = df.index
+    with create_matrix(path, values.shape, labels, values.dtype, fmt, dataset, chunks, compression) as out:
+        for start in range(0, values.shape[0], chunk_size):
+            out[start:start + chunk_size] = values[start:start + chunk_size]
+
+def write_tsv(df, path, chunk_size=1024):
+    """Save a DataFrame as tab separated text, same as df.to_csv(path, sep='\\t').
+
+    Rows are formatted a block at a time with a single string formatting
+    operation, which is about twice as fast as DataFrame.to_csv for
+    large float matrices. Missing values are written as empty fields and
+    float32 matrices get the shortest float32 representation of their
+    values, as with to_csv.
+
+    Args:
+        df: Float matrix to save.
+        path: Output file.
+        chunk_size: Number of rows formatted at a time.
+    """
+    values = np.asarray(df.values)
+    single = values.dtype == np.float32
+    if not single:
+        values = values.astype(np.float64, copy=False)
+    index = [str(l) for l in df.index]
+    row_format = '%s' + ('\t%s' if single else '\t%r') * values.shape[1] + '\n'
+
+    with open(path, 'w') as out:
+        out.write('\t'.join([''] + [str(c) for c in df.columns]) + '\n')
+        for start in range(0, values.shape[0], chunk_size):
+            rows = values[start:start + chunk_size]
+            # repr of a float32 converted to a python float has float64 digits
+            rows = rows.astype(str).tolist() if single else rows.tolist()
+            args = []
+            for label, row in zip(index[start:start + chunk_size], rows):
+                args.append(label)
+                args.extend(row)
+            # a float field can only start with nan if the value is missing
+            out.write(((row_format * len(rows)) % tuple(args)).replace('\tnan', '\t'))
+
+class LazyMatrix(object):
+    '''
+    Labeled matrix backed by an hdf5 dataset or a numpy memmap.
+
+    Values are only read when indexed, so arbitrarily large results can be
+    inspected without loading them into memory.
+    '''
+
+    def __init__(self, values, index, columns=None, owner=None):
+        self.values = values
+        self.index = list(index)
+        self.columns = self.index if columns is None else list(columns)
+        self._owner = owner
+        self._positions = None
+    
+    @classmethod
+    def open(cls, path, dataset='matrix', mode='r'):
+        """Open a matrix previously written by create_matrix."""
+        if guess_format(path) == FORMAT_HDF5:
+            h5 = h5py.File(path, mode)
+            values = h5[dataset]
+            index = decode_labels(h5['%s_index' % (dataset,)][:])
+            columns = decode_labels(h5['%s_columns' % (dataset,)][:]) if '%s_columns' % (dataset,) in h5 else None
+            return cls(values, index, columns, h5)
+        
+        values = np.load(path, mmap_mode=mode)
+        index = read_text_labels(labels_path(path))
+        columns = None
+        if os.path.exists(labels_path(path) + '.columns'):
+            columns = read_text_labels(labels_path(path) + '.columns')
+        return cls(values, index, columns)
+    
+    @property
+    def shape(self):
+        return self.values.shape
+    
+    @property
+    def dtype(self):
+        return self.values.dtype
+    
+    def __getitem__(self, key):
+        return self.values[key]
+    
+    def __setitem__(self, key, value):
+        self.values[key] = value
+    
+    def position(self, label):
+        if self._positions is None:
+            self._positions = dict(zip(self.index, range(len(self.index))))
+        return self._positions[label]
+    
+    def row(self, label):
+        """Values of a single row as a Series labeled with columns."""
+        return p.Series(self.values[self.position(label), :], index=self.columns, name=label)
+    
+    def to_frame(self):
+        """Load the whole matrix into a DataFrame."""
+        return p.DataFrame(self.values[:], index=self.index, columns=self.columns)
+    
+    def flush(self):
+        if self._owner is not None:
+            self._owner.flush()
+        elif hasattr(self.values, 'flush'):
+            self.values.flush()
+    
+    def close(self):
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+        elif hasattr(self.values, 'flush'):
+            self.values.flush()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+def condensed_offset(i, j, size):
+    """Position of pair (i, j), i < j, in a scipy squareform vector."""
+    return size * i - i * (i + 1) // 2 + (j - i - 1)
+
+class CondensedMatrix(object):
+    '''
+    Symmetric matrix with a zero diagonal stored as its upper triangle.
+
+    Values are kept in the condensed layout of scipy.spatial.distance
+    squareform, which takes about half the space of the square matrix, and
+    the vector can be an in-memory array, a memmap or an hdf5 dataset.
+    '''
+
+    def __init__(self, values, labels, owner=None):
+        self.values = values
+        self.labels = list(labels)
+        self._owner = owner
+        self._positions = None
+        
+        expected = len(self.labels) * (len(self.labels) - 1) // 2
+        if values.shape[0] != expected:
+            raise ValueError('Condensed matrix of %d labels needs %d values, got %d' % (
+                len(self.labels), expected, values.shape[0]))
+    
+    @classmethod
+    def empty(cls, labels, dtype=np.float64):
+        size = len(labels)
+        return cls(np.zeros(size * (size - 1) // 2, dtype=dtype), labels)
+    
+    @classmethod
+    def from_frame(cls, df, dtype=np.float64):
+        """Condense a symmetric DataFrame, only its upper triangle is used."""
+        size = df.shape[0]
+        values = np.asarray(df.values)[np.triu_indices(size, 1)].astype(dtype, copy=False)
+        return cls(values, df.index)
+    
+    @property
+    def size(self):
+        return len(self.labels)
+    
+    @property
+    def shape(self):
+        return (self.size, self.size)
+    
+    @property
+    def dtype(self):
+        return self.values.dtype
+    
+    def position(self, label):
+        if self._positions is None:
+            self._positions = dict(zip(self.labels, range(len(self.labels))))
+        return self._positions[label]
+    
+    def set_row_band(self, start, stop, block):
+        """Store rows start:stop of the upper triangle.
+
+        Args:
+            start: First row.
+            stop: Row after the last one.
+            block: Array of shape (stop - start, size - start) with the values
+                of these rows from column start onwards.
+        """
+        size = self.size
+        for i in range(start, stop):
+            if i + 1 < size:
+                offset = condensed_offset(i, i + 1, size)
+                self.values[offset:offset + size - i - 1] = block[i - start, i - start + 1:]
+    
+    def pair(self, a, b):
+        """Value for a pair of labels."""
+        i, j = self.position(a), self.position(b)
+        if i == j:
+            return 0.
+        if i > j:
+            i, j = j, i
+        return self.values[condensed_offset(i, j, self.size)]
+    
+    def row_values(self, i):
+        """Full row i as an array."""
+        size = self.size
+        result = np.zeros(size, dtype=self.dtype)
+        if i > 0:
+            above = np.arange(i)
+            result[:i] = self.values[condensed_offset(above, i, size)]
+        if i + 1 < size:
+            offset = condensed_offset(i, i + 1, size)
+            result[i + 1:] = self.values[offset:offset + size - i - 1]
+        return result
+    
+    def row(self, label):
+        """Full row of a label as a Series."""
+        return p.Series(self.row_values(self.position(label)), index=self.labels, name=label)
+    
+    def to_square(self):
+        """Expand to a square array."""
+        from scipy.spatial.distance import squareform
+        return squareform(np.asarray(self.values[:]), checks=False)
+    
+    def to_frame(self):
+        """Expand to a square DataFrame."""
+        return p.DataFrame(self.to_square(), index=self.labels, columns=self.labels)
+    
+    def save(self, path, fmt=None, dataset='condensed', compression=None):
+        """Write values and labels, see create_matrix for formats."""
+        fmt = fmt or guess_format(path)
+        if fmt == FORMAT_HDF5:
+            with h5py.File(path, 'a') as h5:
+                for name in (dataset, '%s_index' % (dataset,)):
+                    if name in h5:
+                        del h5[name]
+                h5.create_dataset(dataset, data=np.asarray(self.values[:]), compression=compression)
+                write_hdf5_labels(h5, '%s_index' % (dataset,), self.labels)
+        elif fmt == FORMAT_MEMMAP:
+            np.save(path, np.asarray(self.values[:]))
+            write_text_labels(labels_path(path), self.labels)
+        else:
+            raise ValueError('Unknown matrix format "%s"' % (fmt,))
+    
+    @classmethod
+    def open(cls, path, dataset='condensed', mode='r'):
+        """Open a saved condensed matrix without reading the values."""
+        if guess_format(path) == FORMAT_HDF5:
+            h5 = h5py.File(path, mode)
+            return cls(h5[dataset], decode_labels(h5['%s_index' % (dataset,)][:]), h5)
+        return cls(np.load(path, mmap_mode=mode), read_text_labels(labels_path(path)))
+    
+    def close(self):
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+class EdgeList(object):
+    '''
+    Sparse similarity network as (source, target, r) records.
+
+    Sources and targets are positions in labels, so the records are a plain
+    fixed size binary table that can be memory mapped.
+    '''
+
+    DTYPE = np.dtype([('source', np.int32), ('target', np.int32), ('r', np.float32)])
+
+    def __init__(self, edges, labels, owner=None):
+        self.edges = edges
+        self.labels = list(labels)
+        self._owner = owner
+        self._positions = None
+    
+    @classmethod
+    def from_top_k(cls, indices, values, labels):
+        """Build from per profile partner positions and values.
+
+        Args:
+            indices: Array (profiles x k) with partner positions.
+            values: Array (profiles x k) with correlations, partners with
+                NaN or -inf values are skipped.
+            labels: Profile labels.
+        """
+        keep = np.isfinite(values)
+        edges = np.zeros(keep.sum(), dtype=cls.DTYPE)
+        edges['source'] = np.nonzero(keep)[0]
+        edges['target'] = indices[keep]
+        edges['r'] = values[keep]
+        return cls(edges, labels)
+    
+    @classmethod
+    def from_frame(cls, df, k):
+        """Top k partners of every row of a square similarity DataFrame."""
+        values = np.array(df.values, dtype=np.float64)
+        np.fill_diagonal(values, -np.inf)
+        values[np.isnan(values)] = -np.inf
+        k = min(k, max(values.shape[1] - 1, 0))
+        indices = np.argpartition(-values, k - 1, axis=1)[:, :k] if k else np.zeros((values.shape[0], 0), dtype=int)
+        return cls.from_top_k(indices, np.take_along_axis(values, indices, axis=1), df.index)
+    
+    def __len__(self):
+        return len(self.edges)
+    
+    def position(self, label):
+        if self._positions is None:
+            self._positions = dict(zip(self.labels, range(len(self.labels))))
+        return self._positions[label]
+    
+    def to_frame(self):
+        """Edges as a DataFrame with source and target labels."""
+        edges = np.asarray(self.edges[:])
+        labels = np.array(self.labels, dtype=object)
+        return p.DataFrame({
+            'source': labels[edges['source']],
+            'target': labels[edges['target']],
+            'r': edges['r']}, columns=['source', 'target', 'r'])
+    
+    def neighbors(self, label):
+        """Partners of a label sorted by decreasing similarity."""
+        edges = np.asarray(self.edges[:])
+        edges = edges[edges['source'] == self.position(label)]
+        edges = edges[np.argsort(-edges['r'], kind='mergesort')]
+        return p.Series(edges['r'], index=[self.labels[t] for t in edges['target']], name=label)
+    
+    def save(self, path, fmt=None, dataset='edges'):
+        """Write edges and labels, see create_matrix for formats."""
+        fmt = fmt or guess_format(path)
+        if fmt == FORMAT_HDF5:
+            with h5py.File(path, 'a') as h5:
+                for name in (dataset, '%s_index' % (dataset,)):
+                    if name in h5:
+                        del h5[name]
+                h5.create_dataset(dataset, data=np.asarray(self.edges[:]))
+                write_hdf5_labels(h5, '%s_index' % (dataset,), self.labels)
+        elif fmt == FORMAT_MEMMAP:
+            np.save(path, np.asarray(self.edges[:]))
+            write_text_labels(labels_path(path), self.labels)
+        else:
+            raise ValueError('Unknown matrix format "%s"' % (fmt,))
+    
+    @classmethod
+    def open(cls, path, dataset='edges', mode='r'):
+        """Open a saved edge list without reading the records."""
+        if guess_format(path) == FORMAT_HDF5:
+            h5 = h5py.File(path, mode)
+            return cls(h5[dataset], decode_labels(h5['%s_index' % (dataset,)][:]), h5)
+        return cls(np.load(path, mmap_mode=mode), read_text_labels(labels_path(path)))
+    
+    def close(self):
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
@@ -28,35 +28,48 @@ Created on Apr 10, 2017
 
 import logging
 
+import h5py
+
 import numpy as np
 import pandas as p
 
 from . import USE_C_OPT
+from .sketch import QuantileSketch
 
 
 logger = logging.getLogger(__name__)
 
 def _c_normalize(data3_tableix, t1, data3_nn, cpu=1):
     from . import c_impl
-    c_impl.table_norm(data3_nn, t1, data3_tableix)
+    c_impl.table_norm(data3_nn, t1, data3_tableix, cpu)
 
 def _normalize(index, t1, data3_nn):
-    for x in t1:
-        index += data3_nn > x
+    # number of thresholds below every value, same as counting data3_nn > x over all of t1
+    index += np.searchsorted(t1, data3_nn, side='left')
     
     index[index == 0] = 1
 
-def normalize(table, t1, t2):
-    data = table.values.flatten()
-    
-    result = np.full_like(data, np.nan)
+def _normalize_values(data, t1, t2, n_jobs=1):
+    """Map values through the t1 -> t2 table, NaNs stay NaN.
+
+    Args:
+        data: flat array of values.
+        t1: sorted thresholds.
+        t2: mapped value of every threshold.
+        n_jobs: threads used by the C implementation.
+
+    Returns:
+        Array of mapped values.
+    """
+    result = np.full_like(data, np.nan, dtype=np.float64)
     data_values = ~np.isnan(data)
     
-    data = data[data_values]
+    data = np.ascontiguousarray(data[data_values], dtype=np.float64)
     data_index = np.zeros_like(data, dtype=np.int64)
     
     if USE_C_OPT:
-        _c_normalize(data_index, t1, data)
+        from .correlation import _resolve_jobs
+        _c_normalize(data_index, t1, data, _resolve_jobs(n_jobs))
     else:
         _normalize(data_index, t1, data)
     
@@ -64,26 +77,194 @@ def normalize(table, t1, t2):
     
     result[data_values] = t2[data_index]
     
+    return result
+
+def _sorted_table(t1, t2):
+    # bins are found by binary search, thresholds have to be sorted
+    t1 = np.asarray(t1, dtype=np.float64)
+    t2 = np.asarray(t2, dtype=np.float64)
+    if np.any(t1[1:] < t1[:-1]):
+        # keep every threshold with its mapped value
+        order = np.argsort(t1, kind='mergesort')
+        t1, t2 = t1[order], t2[order]
+    return t1, t2
+
+def normalize(table, t1, t2, n_jobs=1):
+    t1, t2 = _sorted_table(t1, t2)
+    result = _normalize_values(table.values.flatten(), t1, t2, n_jobs)
     return p.DataFrame(result.reshape(table.shape), index=table.index, columns=table.columns)
 
 def _quantile_normalize(data, refdist):
     percentiles = np.linspace(100. / data.shape[0], 100, num=data.shape[0])
-    ref_quantiles = np.percentile(refdist, percentiles, interpolation='midpoint') # interpolation used in matlab
+    try:
+        ref_quantiles = np.percentile(refdist, percentiles, method='midpoint') # interpolation used in matlab
+    except TypeError: # numpy < 1.22
+        ref_quantiles = np.percentile(refdist, percentiles, interpolation='midpoint')
     sort_ind = np.argsort(data, kind='mergesort') # sorting alg used in matlab
     result = np.zeros_like(data)
     result[sort_ind] = ref_quantiles
     return result
 
-def table_normalize(data1, data2, data3):
-    data1 = data1.values.flatten()
-    data2 = data2.values.flatten()
+class QuantileMapper(object):
+    '''
+    Quantile mapping of one similarity distribution onto another.
+
+    Fitted from a pair of reference tables (ie. FG and TS correlations of
+    the same array strains): every distinct value of the second table is
+    mapped to the median of its quantile-normalized values in the first
+    one. The mapping can be saved and applied to any number of tables.
+    '''
+
+    def __init__(self, thresholds, values):
+        self.thresholds, self.values = _sorted_table(thresholds, values)
     
-    nn = ~np.isnan(data1) & ~np.isnan(data2) # extract cells with values in both arrays
-    data2_norm = np.full_like(data2, np.nan)
-    data2_norm[nn] = _quantile_normalize(data2[nn], data1[nn]);
+    @classmethod
+    def fit(cls, data1, data2, eps=None):
+        """Fit the mapping of data2 values onto the data1 distribution.
+
+        Args:
+            data1: Reference table (DataFrame or array).
+            data2: Table of the same shape to be mapped.
+            eps: If set, fit an approximate mapping from quantile sketches
+                with this rank error instead of sorting all values.
+
+        Returns:
+            Fitted QuantileMapper.
+        """
+        data1 = np.asarray(data1, dtype=np.float64).flatten()
+        data2 = np.asarray(data2, dtype=np.float64).flatten()
+        
+        nn = ~np.isnan(data1) & ~np.isnan(data2) # extract cells with values in both arrays
+        
+        if eps:
+            return cls.fit_sketches(
+                QuantileSketch(eps, seed=0).update(data1[nn]),
+                QuantileSketch(eps, seed=0).update(data2[nn]))
+        
+        data2_norm = np.full_like(data2, np.nan)
+        data2_norm[nn] = _quantile_normalize(data2[nn], data1[nn]);
+        
+        table = p.DataFrame({'data2': data2[nn], 'data2_norm': data2_norm[nn]})
+        table = table.sort_values('data2', kind='mergesort')
+        table = table.groupby('data2').median().reset_index()
+        
+        return cls(table.data2.values, table.data2_norm.values)
     
-    table = p.DataFrame({'data2': data2[nn], 'data2_norm': data2_norm[nn]})
-    table = table.sort_values('data2', kind='mergesort')
-    table = table.groupby('data2').median().reset_index()
+    @classmethod
+    def fit_sketches(cls, sketch1, sketch2):
+        """Approximate mapping from sketches of the reference and mapped values.
+
+        Both distributions are sampled on a grid of ranks as fine as the
+        sketch error, so every value is mapped to within eps (in rank) of
+        where the exact mapping would put it.
+
+        Args:
+            sketch1: QuantileSketch of reference (data1) values.
+            sketch2: QuantileSketch of data2 values from the same cells.
+
+        Returns:
+            Fitted QuantileMapper.
+        """
+        size = int(np.ceil(1. / max(sketch1.eps, sketch2.eps)))
+        # both ends included so the extremes map onto each other
+        ranks = np.linspace(0, 1, size + 1)
+        
+        table = p.DataFrame({'data2': sketch2.quantiles(ranks), 'data2_norm': sketch1.quantiles(ranks)})
+        table = table.groupby('data2').median().reset_index()
+        
+        return cls(table.data2.values, table.data2_norm.values)
+    
+    @classmethod
+    def fit_matrices(cls, matrix1, matrix2, eps=.001, chunk_size=1024):
+        """Approximate mapping fitted block by block from on-disk matrices.
+
+        Args:
+            matrix1: Reference LazyMatrix (or array).
+            matrix2: LazyMatrix (or array) of the same shape to be mapped.
+            eps: Rank error of the quantile sketches.
+            chunk_size: Rows read at a time.
+
+        Returns:
+            Fitted QuantileMapper.
+        """
+        if matrix1.shape != matrix2.shape:
+            raise ValueError('Reference shape %s does not match %s' % (matrix1.shape, matrix2.shape))
+        
+        sketch1, sketch2 = QuantileSketch(eps, seed=0), QuantileSketch(eps, seed=0)
+        for start in range(0, matrix1.shape[0], chunk_size):
+            data1 = np.asarray(matrix1[start:start + chunk_size], dtype=np.float64)
+            data2 = np.asarray(matrix2[start:start + chunk_size], dtype=np.float64)
+            nn = ~np.isnan(data1) & ~np.isnan(data2)
+            sketch1.update(data1[nn])
+            sketch2.update(data2[nn])
+        
+        return cls.fit_sketches(sketch1, sketch2)
+    
+    def transform(self, table, n_jobs=1):
+        """Normalize a DataFrame."""
+        result = _normalize_values(table.values.flatten(), self.thresholds, self.values, n_jobs)
+        return p.DataFrame(result.reshape(table.shape), index=table.index, columns=table.columns)
+    
+    def transform_values(self, values, n_jobs=1):
+        """Normalize an array of any shape, ie. a chunk of a bigger table."""
+        values = np.asarray(values)
+        return _normalize_values(values.ravel(), self.thresholds, self.values, n_jobs).reshape(values.shape)
     
-    return normalize(data3, table.data2, table.data2_norm)
+    def transform_matrix(self, matrix, path=None, chunk_size=None, n_jobs=1, dtype=None, fmt=None,
+                         dataset='matrix'):
+        """Normalize an on-disk matrix block by block.
+
+        Row blocks are read, normalized and written one at a time, so peak
+        memory is a few blocks no matter how large the matrix is.
+
+        Args:
+            matrix: LazyMatrix (ie. from tiled_correlation) to normalize.
+            path: Output file, see storage.create_matrix. If omitted, the
+                matrix is normalized in place.
+            chunk_size: Rows per block. Defaults to the hdf5 chunk height
+                or 1024 rows.
+            n_jobs: threads used by the C implementation.
+            dtype: Value type of the output, same as input by default.
+            fmt: Override the output format guessed from the extension.
+            dataset: Name of the output hdf5 dataset.
+
+        Returns:
+            LazyMatrix with normalized values.
+        """
+        from .storage import create_matrix
+        
+        rows, cols = matrix.shape
+        if chunk_size is None:
+            chunks = getattr(matrix.values, 'chunks', None)
+            chunk_size = chunks[0] if chunks else 1024
+        chunk_size = max(int(chunk_size), 1)
+        
+        if path is None:
+            result = matrix
+        else:
+            result = create_matrix(path, (rows, cols), (matrix.index, matrix.columns),
+                                   dtype=dtype or matrix.dtype, fmt=fmt, dataset=dataset,
+                                   chunks=getattr(matrix.values, 'chunks', None))
+        
+        logger.debug('Normalizing %s matrix in blocks of %d rows.', matrix.shape, chunk_size)
+        for start in range(0, rows, chunk_size):
+            stop = min(start + chunk_size, rows)
+            result[start:stop] = self.transform_values(matrix[start:stop], n_jobs)
+        result.flush()
+        
+        return result
+    
+    def save(self, path):
+        """Write the mapping table to an hdf5 file."""
+        with h5py.File(path, 'w') as h5:
+            h5.create_dataset('thresholds', data=self.thresholds)
+            h5.create_dataset('values', data=self.values)
+    
+    @classmethod
+    def load(cls, path):
+        """Read a mapping written by save()."""
+        with h5py.File(path, 'r') as h5:
+            return cls(h5['thresholds'][:], h5['values'][:])
+
+def table_normalize(data1, data2, data3, n_jobs=1, eps=None):
+    return QuantileMapper.fit(data1, data2, eps).transform(data3, n_jobs)
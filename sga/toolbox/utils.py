@@ -25,20 +25,116 @@ Created on Mar 22, 2017
 
 @author: Matej Usaj
 '''
+import glob
+import logging
+import os
 
-def hdf5_read_str_list(hdf5file, listref):
+import h5py
+
+import numpy as np
+import pandas as p
+
+
+logger = logging.getLogger(__name__)
+
+def hdf5_read_str_list(hdf5file, listref, cache=None):
     """Reads a list of strings from hdf5 file
 
-    Read a list of strings
+    Read a list of MATLAB strings (a cell array of char arrays). Each string
+    is dereferenced with the low level h5py API and its uint16 buffer is
+    decoded at once instead of character by character.
 
     Args:
         hdf5file: h5py dataset file.
-        listref: reference to string list in the hdf5 file.
+        listref: reference to string list in the hdf5 file. Either an array
+            of references or the hdf5 dataset holding them.
+        cache: Optional dict of decoded strings by object address. Pass the
+            same dict when reading several lists from one file and strings
+            they share are only read once. Only used if listref is a dataset.
+
+    Returns:
+        Numpy array of strings converted from the hdf5 format
+    """
+    addresses = None
+    if isinstance(listref, h5py.Dataset):
+        if cache is not None:
+            # raw object references are file addresses, usable as cache keys
+            addresses = np.empty(listref.shape, dtype=np.uint64)
+            listref.id.read(h5py.h5s.ALL, h5py.h5s.ALL, addresses, mtype=h5py.h5t.STD_REF_OBJ)
+            addresses = addresses.ravel()
+        listref = listref[()]
+    refs = np.asarray(listref, dtype=object).ravel()
+    
+    labels = []
+    for i, ref in enumerate(refs):
+        if addresses is None:
+            labels.append(_read_matlab_str(hdf5file.id, ref))
+            continue
+        address = int(addresses[i])
+        if address not in cache:
+            cache[address] = _read_matlab_str(hdf5file.id, ref)
+        labels.append(cache[address])
+    return np.array(labels, dtype=str)
+
+def _read_matlab_str(fid, ref):
+    dataset = h5py.h5r.dereference(ref, fid)
+    if h5py.h5a.exists(dataset, b'MATLAB_empty'):
+        return ''
+    values = np.empty(dataset.shape, dtype='<u2')
+    if values.size:
+        dataset.read(h5py.h5s.ALL, h5py.h5s.ALL, values)
+    return values.tobytes().decode('utf-16-le')
+
+def hdf5_read_selection(dataset, rows, columns, dtype=None, block_size=None):
+    """Read a submatrix of a 2D hdf5 dataset.
+
+    Selecting rows with a list of positions makes h5py read every column of
+    those rows and is slow for long lists. Instead, the bounding box of the
+    selected columns is read in blocks of rows aligned to the dataset chunks
+    and the selection is taken in memory, so each chunk is decompressed
+    only once. Contiguous uncompressed datasets are memory mapped.
+
+    Args:
+        dataset: 2D h5py dataset.
+        rows: Sorted row positions.
+        columns: Sorted column positions.
+        dtype: Type of the result. Defaults to the type of the dataset.
+        block_size: Number of rows read at a time, rounded to whole chunks.
+            Defaults to blocks of about 64MB.
 
     Returns:
-        List of strings converted from the hdf5 format
+        Array of shape (len(rows), len(columns)).
     """
-    return [''.join([chr(z) for z in hdf5file[y][:]]) for y in listref]
+    rows = np.asarray(rows, dtype=np.intp)
+    columns = np.asarray(columns, dtype=np.intp)
+    result = np.empty((len(rows), len(columns)), dtype=dtype or dataset.dtype)
+    if not len(rows) or not len(columns):
+        return result
+    
+    col_start, col_stop = columns[0], columns[-1] + 1
+    if block_size is None:
+        block_size = max((64 << 20) // (dataset.dtype.itemsize * (col_stop - col_start)), 1)
+    
+    offset = dataset.id.get_offset()
+    if dataset.chunks is None and offset is not None:
+        values = np.memmap(dataset.file.filename, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+        for start in range(0, len(rows), block_size):
+            result[start:start + block_size] = values[np.ix_(rows[start:start + block_size], columns)]
+        return result
+    
+    chunk_rows = dataset.chunks[0] if dataset.chunks else 1
+    block_size = max(block_size // chunk_rows, 1) * chunk_rows
+    local_columns = columns - col_start
+    
+    start = 0
+    while start < len(rows):
+        first = rows[start]
+        block_stop = min((first // chunk_rows) * chunk_rows + block_size, dataset.shape[0])
+        stop = np.searchsorted(rows, block_stop)
+        block = dataset[first:rows[stop - 1] + 1, col_start:col_stop]
+        result[start:stop] = block[rows[start:stop] - first][:, local_columns]
+        start = stop
+    return result
 
 def read_strain_map(path):
     """Read a standard format of strain map.
@@ -56,3 +152,100 @@ def read_strain_map(path):
     """
     with open(path) as sm:
         return dict(tuple(l.strip().split('\t')) for l in sm)
+
+def _count_lines(path, block_size=1 << 20):
+    lines, last = 0, b'\n'
+    with open(path, 'rb') as inp:
+        for block in iter(lambda: inp.read(block_size), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return lines + (last != b'\n')
+
+def read_score_matrix(path, dtype=np.float64, chunk_size=4096, exact=True):
+    """Read a tab separated matrix of SGA scores.
+
+    The first row holds the column (query) labels and the first column the
+    row (array) labels, ie. a matrix saved with DataFrame.to_csv(sep='\\t').
+    Rows are parsed in chunks straight into a preallocated array, so memory
+    use stays close to the size of the result.
+
+    Args:
+        path: Path to the text file.
+        dtype: Type of the values.
+        chunk_size: Number of rows parsed at a time.
+        exact: Parse the exact values written by to_csv. With False the
+            default pandas parser is used, it is about 3x faster but can be
+            off by an ulp.
+
+    Returns:
+        A tuple of (values, row labels, column labels), labels are numpy
+        string arrays.
+    """
+    columns = p.read_csv(path, sep='\t', index_col=0, nrows=0).columns
+    values = np.empty((max(_count_lines(path) - 1, 0), len(columns)), dtype=dtype)
+    
+    index, rows = [], 0
+    float_precision = 'round_trip' if exact else None
+    for chunk in p.read_csv(path, sep='\t', index_col=0, chunksize=chunk_size, float_precision=float_precision):
+        values[rows:rows + chunk.shape[0]] = chunk.values
+        index.extend(chunk.index)
+        rows += chunk.shape[0]
+    
+    return values[:rows], np.array(index, dtype=str), np.array(columns, dtype=str)
+
+def load_score_matrix(path, dtype=np.float64, sidecar=True, exact=True):
+    """Load a text score matrix, through a binary copy if possible.
+
+    The first read saves the parsed matrix in an .npy sidecar file next to
+    the text file. The sidecar name includes the size and modification
+    time of the text file, the value type and the parsing mode, so later
+    reads of an unchanged file memory map the sidecar instead of parsing
+    the text.
+
+    Args:
+        path: Path to the text file, see read_score_matrix.
+        dtype: Type of the values.
+        sidecar: Use and create the sidecar file.
+        exact: Parse exact values, see read_score_matrix. The text is only
+            parsed once per sidecar, so the slower exact parser is the
+            default.
+
+    Returns:
+        DataFrame with the scores.
+    """
+    from .storage import FORMAT_MEMMAP, LazyMatrix, labels_path, write_matrix
+    
+    dtype = np.dtype(dtype)
+    if not sidecar:
+        values, index, columns = read_score_matrix(path, dtype, exact=exact)
+        return p.DataFrame(values, index=index, columns=columns, copy=False)
+    
+    st = os.stat(path)
+    kind = dtype.name + ('' if exact else '-fast')
+    cached = '%s.%d-%.6f.%s.npy' % (path, st.st_size, st.st_mtime, kind)
+    if os.path.exists(cached):
+        logger.debug("Reading parsed scores from %s", cached)
+        matrix = LazyMatrix.open(cached)
+        return p.DataFrame(matrix.values, index=matrix.index, columns=matrix.columns, copy=False)
+    
+    logger.debug("Parsing scores in %s", path)
+    values, index, columns = read_score_matrix(path, dtype, exact=exact)
+    df = p.DataFrame(values, index=index, columns=columns, copy=False)
+    
+    try:
+        # sidecars of older versions of the file, other value types are kept
+        for stale in glob.glob('%s.*.%s.npy' % (glob.escape(path), kind)):
+            for name in (stale, labels_path(stale), labels_path(stale) + '.columns'):
+                if os.path.exists(name):
+                    os.remove(name)
+        
+        # labels go first and the matrix is renamed last, it marks a complete sidecar
+        tmp_path = cached + '.tmp'
+        write_matrix(df, tmp_path, FORMAT_MEMMAP)
+        for name in (labels_path(tmp_path), labels_path(tmp_path) + '.columns'):
+            if os.path.exists(name):
+                os.rename(name, name.replace(tmp_path, cached, 1))
+        os.rename(tmp_path, cached)
+    except (IOError, OSError) as e:
+        logger.warning("Could not save parsed scores in %s: %s", cached, e)
+    return df
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as p
+
+from sga.toolbox.cache import LayerCache, cache_key
+
+
+def layer(seed, size=20):
+    labels = ['s%d' % i for i in range(size)]
+    return p.DataFrame(np.random.default_rng(seed).normal(size=(size, size)), index=labels, columns=labels)
+
+
+class LayerCacheTestSuite(unittest.TestCase):
+    """Cached layers are reused and the least recently used ones evicted."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_key(self):
+        df = layer(0)
+        self.assertEqual(cache_key('layer', df, 'rows'), cache_key('layer', df.copy(), 'rows'))
+        self.assertNotEqual(cache_key('layer', df, 'rows'), cache_key('layer', df, 'columns'))
+        relabeled = df.rename(index={'s0': 'x'})
+        self.assertNotEqual(cache_key(df), cache_key(relabeled))
+        changed = df.copy()
+        changed.iloc[3, 4] += 1e-12
+        self.assertNotEqual(cache_key(df), cache_key(changed))
+
+    def test_hit(self):
+        cache = LayerCache(self.folder)
+        df = layer(0)
+        calls = []
+        compute = lambda: calls.append(1) or df
+        first = cache.cached('a', compute)
+        second = cache.cached('a', compute)
+        self.assertEqual(len(calls), 1)
+        p.testing.assert_frame_equal(first, df)
+        p.testing.assert_frame_equal(second, df)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_lru_eviction(self):
+        cache = LayerCache(self.folder)
+        for i, key in enumerate('abc'):
+            cache.put(key, layer(i))
+            os.utime(cache.entry_path(key), (1000 + i, 1000 + i))
+        entry_size = os.path.getsize(cache.entry_path('a'))
+
+        # a hit makes the oldest entry the most recently used one
+        cache.get('a')
+        cache = LayerCache(self.folder, max_size=3 * entry_size)
+        self.assertEqual(len(cache.entries()), 3)
+        cache.put('d', layer(3))
+        self.assertEqual(sorted(k for k in 'abcd' if k in cache), ['a', 'c', 'd'])
+
+        # the new entry is kept even if it alone is over the limit
+        cache = LayerCache(self.folder, max_size=1)
+        self.assertEqual(cache.entries(), [])
+        cache.put('e', layer(4))
+        self.assertEqual([k for k in 'abcde' if k in cache], ['e'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import unittest
+
+import numpy as np
+import pandas as p
+
+from sga.toolbox import USE_C_OPT
+from sga.toolbox import correlation as corr
+from sga.toolbox.storage import EdgeList
+
+
+def random_scores(rows=60, columns=25, missing=.2, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(rows, columns))
+    values[rng.random(values.shape) < missing] = np.nan
+    return p.DataFrame(values,
+                       index=['p%d' % i for i in range(rows)],
+                       columns=['f%d' % i for i in range(columns)])
+
+
+class CorrelationBackendsTestSuite(unittest.TestCase):
+    """Correlation backends give the same results."""
+
+    def setUp(self):
+        self.data = random_scores()
+        self.backends = [corr.BACKEND_BLAS, corr.BACKEND_PANDAS]
+        if USE_C_OPT:
+            self.backends.append(corr.BACKEND_C)
+
+    def assertFramesClose(self, a, b):
+        self.assertTrue(a.index.equals(b.index))
+        self.assertTrue(a.columns.equals(b.columns))
+        np.testing.assert_allclose(a.values, b.values, rtol=0, atol=1e-12)
+
+    def test_square(self):
+        for axis in ('rows', 'columns'):
+            reference = corr.correlation(self.data, axis, backend=corr.BACKEND_PANDAS)
+            for backend in self.backends:
+                self.assertFramesClose(corr.correlation(self.data, axis, backend=backend, n_jobs=2), reference)
+
+    def test_cross(self):
+        a, b = self.data.iloc[:20], self.data.iloc[15:]
+        reference = corr.cross_correlation(a, b, backend=corr.BACKEND_PANDAS)
+        for backend in self.backends:
+            self.assertFramesClose(corr.cross_correlation(a, b, backend=backend), reference)
+
+    def test_condensed_and_top_k(self):
+        full = corr.correlation(self.data)
+        for backend in self.backends:
+            condensed = corr.correlation(self.data, backend=backend, condensed=True, tile_size=7)
+            self.assertFramesClose(condensed.to_frame(), full)
+
+            top = corr.correlation(self.data, backend=backend, top_k=5, tile_size=7)
+            expected = EdgeList.from_frame(full, 5)
+            self.assertEqual(sorted(zip(top.edges['source'], top.edges['target'])),
+                             sorted(zip(expected.edges['source'], expected.edges['target'])))
+
+    def test_n_jobs(self):
+        self.assertEqual(corr._resolve_jobs(None), 1)
+        self.assertEqual(corr._resolve_jobs(3), 3)
+        self.assertGreaterEqual(corr._resolve_jobs(-1), 1)
+        with self.assertRaises(ValueError):
+            corr._resolve_jobs(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+
+from sga.toolbox import correlation as corr
+
+from .test_correlation import random_scores
+
+
+class CorrelationStatsTestSuite(unittest.TestCase):
+    """Incremental correlation statistics match a full recompute."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'stats.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_appended_and_changed(self):
+        data = random_scores()
+        for axis in ('rows', 'columns'):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            corr.correlation(data.iloc[:40, :20], axis, stats=self.path)
+
+            # appended profiles and features
+            result = corr.correlation(data, axis, stats=self.path)
+            np.testing.assert_allclose(result.values, corr.correlation(data, axis).values, atol=1e-12)
+
+            # revised values of seen cells
+            revised = data.copy()
+            revised.iloc[3, 5] = 2.5
+            result = corr.correlation(revised, axis, stats=self.path)
+            np.testing.assert_allclose(result.values, corr.correlation(revised, axis).values, atol=1e-12)
+
+    def test_dtype(self):
+        data = random_scores()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            corr.correlation(data, stats=self.path)
+            result = corr.correlation(data, stats=self.path, dtype=np.float32)
+        self.assertTrue((result.dtypes == np.float32).all())
+        np.testing.assert_allclose(result.values, corr.correlation(data).values, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import unittest
+
+from sga.toolbox.labels import LabelCatalog
+
+
+class LabelCatalogTestSuite(unittest.TestCase):
+    """Labels are parsed once and looked up by strain type."""
+
+    def setUp(self):
+        self.catalog = LabelCatalog({'tsq1': 'abc1-1', 'tsa2': 'abc2-2', 'dma3': 'def3', 'sn4': 'ghi4'})
+        self.catalog.add(['YAL001C_tsq1', 'YAL002W_tsa2', 'YAL003W_dma3'])
+        # seen labels are skipped
+        self.catalog.add(['YAL003W_dma3', 'YAL004W_sn4', 'YAL005C_damp5', 'YAL006C_y6'])
+
+    def test_parsed(self):
+        self.assertEqual(len(self.catalog), 6)
+        self.assertEqual(list(self.catalog.orfs(['YAL004W_sn4', 'YAL001C_tsq1'])), ['YAL004W', 'YAL001C'])
+        self.assertEqual(list(self.catalog.strain[:3]), ['tsq1', 'tsa2', 'dma3'])
+        self.assertEqual(list(self.catalog.strain_type), ['tsq', 'tsa', 'dma', 'sn', 'damp', 'y'])
+
+    def test_select(self):
+        labels = ['YAL006C_y6', 'YAL004W_sn4', 'YAL001C_tsq1', 'YAL005C_damp5', 'YAL002W_tsa2']
+        self.assertEqual(self.catalog.select(labels, include=('ts',)), ['YAL001C_tsq1', 'YAL002W_tsa2'])
+        self.assertEqual(self.catalog.select(labels, exclude=('y', 'damp')),
+                         ['YAL004W_sn4', 'YAL001C_tsq1', 'YAL002W_tsa2'])
+        self.assertEqual(self.catalog.select(labels), labels)
+        with self.assertRaises(KeyError):
+            self.catalog.select(['YAL007C_sn7'])
+
+    def test_alleles(self):
+        self.assertEqual(list(self.catalog.alleles(['YAL003W_dma3', 'YAL001C_tsq1'])), ['def3', 'abc1-1'])
+        with self.assertRaises(KeyError):
+            self.catalog.alleles(['YAL005C_damp5'])
+        with self.assertRaises(ValueError):
+            LabelCatalog().alleles([])
+
+
+if __name__ == '__main__':
+    unittest.main()
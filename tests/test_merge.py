@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import unittest
+import warnings
+
+import numpy as np
+import pandas as p
+
+from sga.toolbox.correlation import CorrelationRows, correlation
+from sga.toolbox.merge import merge_layers, merge_layers_condensed, merge_layers_top_k
+from sga.toolbox.storage import CondensedMatrix, EdgeList
+
+
+class MergeTestSuite(unittest.TestCase):
+    """Merged layers are the nanmean of the layers over the union of labels."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        names = np.array(['g%03d' % i for i in range(80)], dtype=object)
+        self.layers = []
+        for size in (70, 50, 30):
+            values = rng.normal(size=(size, size))
+            values = (values + values.T) / 2
+            values[rng.random(values.shape) < .1] = np.nan
+            self.layers.append((values, rng.choice(names, size, replace=False)))
+
+    def expected(self):
+        frames = [p.DataFrame(values, index=labels, columns=labels) for values, labels in self.layers]
+        axis = sorted(set().union(*[labels for _, labels in self.layers]))
+        stacked = np.stack([f.reindex(index=axis, columns=axis).values for f in frames])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # mean of empty slice
+            return p.DataFrame(np.nanmean(stacked, axis=0), index=axis, columns=axis)
+
+    def test_merge(self):
+        expected = self.expected()
+        for tile_size in (1, 16, 256):
+            result = merge_layers(self.layers, tile_size=tile_size)
+            self.assertEqual(list(result.index), list(expected.index))
+            np.testing.assert_allclose(result.values, expected.values, atol=1e-12)
+
+    def test_labels_and_out(self):
+        labels = ['g001', 'g050', 'zzz']
+        out = np.empty((3, 3))
+        result = merge_layers(self.layers, labels=labels, out=out)
+        expected = self.expected().reindex(index=labels, columns=labels)
+        np.testing.assert_allclose(out, expected.values, atol=1e-12)
+        self.assertEqual(list(result.columns), labels)
+
+    def test_duplicate_labels(self):
+        values, labels = self.layers[0]
+        labels = labels.copy()
+        labels[1] = labels[0]
+        with self.assertRaises(ValueError):
+            merge_layers([(values, labels)])
+
+    def test_top_k(self):
+        def edges(e):
+            return sorted(zip(e.edges['source'], e.edges['target'], e.edges['r']))
+
+        expected = edges(EdgeList.from_frame(merge_layers(self.layers), 5))
+        for tile_size in (1, 16, 256):
+            self.assertEqual(edges(merge_layers_top_k(self.layers, 5, tile_size=tile_size)), expected)
+
+    def test_condensed(self):
+        expected = CondensedMatrix.from_frame(merge_layers(self.layers), np.float32)
+        for tile_size in (1, 16, 256):
+            result = merge_layers_condensed(self.layers, dtype=np.float32, tile_size=tile_size)
+            self.assertEqual(result.labels, expected.labels)
+            np.testing.assert_array_equal(result.values, expected.values)
+
+    def test_lazy_rows(self):
+        rng = np.random.default_rng(1)
+        data = p.DataFrame(rng.normal(size=(40, 12)), index=['g%03d' % i for i in range(40)])
+        square = correlation(data)
+        rows = CorrelationRows(data)
+        layers = [(rows, rows.labels), (self.layers[0][0], self.layers[0][1])]
+        dense = [(square.values, square.index), self.layers[0]]
+        np.testing.assert_allclose(merge_layers_condensed(layers, tile_size=7).values,
+                                   merge_layers_condensed(dense).values, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
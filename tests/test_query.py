@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as p
+import six
+
+try:
+    from unittest import mock
+except ImportError: # python 2
+    import mock
+
+from sga import query
+from sga.query import SimilarityStore
+from sga.toolbox.storage import CondensedMatrix, EdgeList, write_matrix
+
+from .test_storage import similarities
+
+
+class SimilarityStoreTestSuite(unittest.TestCase):
+    """Stored similarities answer queries like the matrix they were saved from."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.df = similarities()
+        self.paths = {}
+        for name in ('matrix.h5', 'matrix.npy'):
+            self.paths[name] = os.path.join(self.folder, name)
+            write_matrix(self.df, self.paths[name])
+        for name in ('condensed.h5', 'condensed.npy'):
+            self.paths[name] = os.path.join(self.folder, name)
+            CondensedMatrix.from_frame(self.df).save(self.paths[name])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_dense(self):
+        expected = self.df.loc['allele-7'].drop('allele-7').dropna().sort_values(ascending=False, kind='mergesort')
+        for name, path in sorted(self.paths.items()):
+            with SimilarityStore.open(path) as store:
+                self.assertEqual(list(store.labels), list(self.df.index), name)
+                self.assertIn('allele-3', store)
+                self.assertNotIn('allele-99', store)
+                np.testing.assert_array_equal(store.row('allele-7').values, self.df.loc['allele-7'].values)
+                self.assertEqual(store.pair('allele-2', 'allele-9'), self.df.loc['allele-2', 'allele-9'])
+                top = store.top('allele-7', 5)
+                self.assertEqual(list(top.index), list(expected.index[:5]), name)
+
+    def test_edges(self):
+        path = os.path.join(self.folder, 'edges.h5')
+        edges = EdgeList.from_frame(self.df, 4)
+        # sources in any order
+        edges.edges = edges.edges[np.random.default_rng(0).permutation(len(edges))]
+        edges.save(path)
+        with SimilarityStore.open(path) as store:
+            top = store.top('allele-7', 10)
+            expected = self.df.loc['allele-7'].drop('allele-7').nlargest(4)
+            self.assertEqual(list(top.index), list(expected.index))
+            np.testing.assert_allclose(top.values, expected.values, rtol=1e-6)
+            self.assertTrue(np.isnan(store.pair('allele-7', expected.index[0] + 'x')))
+
+    def test_text(self):
+        with self.assertRaises(ValueError):
+            SimilarityStore.open(os.path.join(self.folder, 'cc_ExE.txt'))
+
+    def test_main(self):
+        path = self.paths['condensed.h5']
+        out = six.StringIO()
+        with mock.patch.object(sys, 'argv', ['sga-similarity-query', path, 'allele-1', 'allele-2', '-k', '3']), \
+                mock.patch.object(sys, 'stdout', out):
+            query.main()
+        lines = [l.split('\t') for l in out.getvalue().splitlines()]
+        self.assertEqual([l[0] for l in lines], ['allele-1'] * 3 + ['allele-2'] * 3)
+        expected = self.df.loc['allele-2'].drop('allele-2').dropna().sort_values(ascending=False, kind='mergesort')
+        self.assertEqual([l[1] for l in lines[3:]], list(expected.index[:3]))
+
+        out = six.StringIO()
+        with mock.patch.object(sys, 'argv', ['sga-similarity-query', path, 'allele-1', 'allele-2', '--pair']), \
+                mock.patch.object(sys, 'stdout', out):
+            query.main()
+        self.assertEqual(out.getvalue(), 'allele-1\tallele-2\t%r\n' % (float(self.df.loc['allele-1', 'allele-2']),))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as p
+import scipy.spatial as space
+
+try:
+    from unittest import mock
+except ImportError: # python 2
+    import mock
+
+from sga import safe
+
+
+class SafeNeighborsTestSuite(unittest.TestCase):
+    """KD-tree neighbourhoods in CSR storage match the pair-wise distance definition."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        names = ['n%03d' % i for i in range(150)]
+        self.network = p.DataFrame(rng.random((150, 2)), index=names, columns=['x', 'y'])
+        self.attributes = p.DataFrame((rng.random((150, 3)) < .2).astype(int), index=names,
+                                      columns=['a1', 'a2', 'a3'])
+
+    def test_distance_percentile(self):
+        coords = self.network.values
+        distances = space.distance.pdist(coords)
+        for q in (0, .5, 5, 50, 100):
+            expected = np.percentile(distances, q)
+            self.assertAlmostEqual(safe.distance_percentile(coords, q), expected, places=12)
+            # streamed in blocks, as for networks over the limit
+            with mock.patch.object(safe, 'EXACT_PAIRS_LIMIT', 0):
+                for block_size in (1, 7, 256):
+                    self.assertAlmostEqual(safe.distance_percentile(coords, q, block_size=block_size, bins=64),
+                                           expected, places=12)
+
+    def test_neighbors(self):
+        s = safe.Safe(self.network, self.attributes, distance_threshold=5)
+        d = np.percentile(space.distance.pdist(self.network.values), 5)
+        within = space.distance.squareform(space.distance.pdist(self.network.values)) <= d
+        np.fill_diagonal(within, True)
+
+        self.assertEqual(s.neighbors.format, 'csr')
+        np.testing.assert_array_equal(s.neighbors.toarray(), within)
+        for row in (0, 42, 149):
+            node = self.network.index[row]
+            self.assertEqual(s.neighborhood(node), list(self.network.index[within[row]]))
+
+    def test_save_read_neighbors(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        neighbors_path = os.path.join(path, 'neighbors.csv')
+
+        s = safe.Safe(self.network, self.attributes, distance_threshold=5)
+        s.save_neighbors(neighbors_path)
+        loaded = safe.Safe(self.network, self.attributes, neighbors=neighbors_path)
+        self.assertEqual((loaded.neighbors != s.neighbors).nnz, 0)
+
+        s.prepare_attributes()
+        loaded.prepare_attributes()
+        p.testing.assert_frame_equal(loaded.calculate(), s.calculate())
+
+    def test_unknown_neighbors(self):
+        neighbors = p.DataFrame({'neighborhood': [['n000', 'missing']]}, index=['n001'])
+        with self.assertRaises(ValueError):
+            safe.Safe(self.network, self.attributes, neighbors=neighbors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import threading
+import unittest
+
+from sga.toolbox.scheduler import TaskGraph
+
+
+class TaskGraphTestSuite(unittest.TestCase):
+    """Tasks run in dependency order, independent ones at the same time."""
+
+    def graph(self, barrier=None):
+        order = []
+        lock = threading.Lock()
+
+        def task(name, value):
+            def run():
+                if barrier is not None and name in ('a', 'b'):
+                    # both independent tasks have to be running at once to pass
+                    barrier.wait(timeout=10)
+                with lock:
+                    order.append(name)
+                return value
+            return run
+
+        graph = TaskGraph()
+        graph.add('a', task('a', 1))
+        graph.add('b', task('b', 2))
+        graph.add('c', task('c', 3), ['a', 'b'])
+        graph.add('d', task('d', 4), ['c'])
+        return graph, order
+
+    def test_serial(self):
+        graph, order = self.graph()
+        self.assertEqual(graph.run(), {'a': 1, 'b': 2, 'c': 3, 'd': 4})
+        self.assertEqual(order, ['a', 'b', 'c', 'd'])
+
+    def test_workers(self):
+        graph, order = self.graph(threading.Barrier(2))
+        self.assertEqual(graph.run(n_workers=2), {'a': 1, 'b': 2, 'c': 3, 'd': 4})
+        self.assertEqual(sorted(order[:2]), ['a', 'b'])
+        self.assertEqual(order[2:], ['c', 'd'])
+
+    def test_failure(self):
+        ran = []
+        graph = TaskGraph()
+        graph.add('a', lambda: 1 / 0)
+        graph.add('b', lambda: 2)
+        graph.add('c', lambda: ran.append('c'), ['a'])
+        with self.assertRaises(ZeroDivisionError):
+            graph.run(n_workers=2)
+        self.assertEqual(ran, [])
+
+    def test_unknown_dependency(self):
+        graph = TaskGraph()
+        graph.add('a', lambda: 1)
+        with self.assertRaises(ValueError):
+            graph.add('b', lambda: 2, ['c'])
+        with self.assertRaises(ValueError):
+            graph.add('a', lambda: 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
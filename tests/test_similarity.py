@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+import pandas as p
+
+try:
+    from unittest import mock
+except ImportError: # python 2
+    import mock
+
+from sga import similarity
+from sga.similarity import Similarity
+from sga.toolbox import correlation
+from sga.toolbox.storage import CondensedMatrix, EdgeList
+from sga.toolbox.table_norm import QuantileMapper
+
+from .test_utils import write_matlab_strings
+
+
+def scores(rng, arrays, queries):
+    values = rng.normal(scale=.2, size=(len(arrays), len(queries)))
+    values[rng.random(values.shape) < .2] = np.nan
+    return p.DataFrame(values, index=arrays, columns=queries)
+
+def strains(kind, n):
+    return ['Y%03d_%s%d' % (i, kind, i) for i in range(n)]
+
+
+class SimilarityTestSuite(unittest.TestCase):
+    """Sharded and resumed runs give the same results as a single run."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+
+        # both screens share a few arrays and queries
+        ts = scores(rng, strains('tsa', 20) + strains('dma', 5), strains('tsq', 15) + strains('sn', 4) + ['Y900_y1'])
+        fg = scores(rng, strains('dma', 20) + strains('tsa', 5), strains('sn', 15) + strains('tsq', 4) + ['Y901_damp2'])
+        self.ts_path = os.path.join(self.folder, 'ts.txt')
+        self.fg_path = os.path.join(self.folder, 'fg.txt')
+        ts.to_csv(self.ts_path, sep='\t')
+        fg.to_csv(self.fg_path, sep='\t')
+
+        labels = set(ts.index) | set(ts.columns) | set(fg.index) | set(fg.columns)
+        self.strain_map = {l.split('_')[1]: 'allele-' + l.split('_')[1] for l in labels}
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def similarity(self, output, **kwargs):
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        return Similarity(self.ts_path, output, self.fg_path, Similarity.INPUT_FORMAT_TXT, self.strain_map, **kwargs)
+
+    def results(self, sim):
+        results = {'ExE': sim.ts_sim, 'NxN': sim.fg_sim}
+        results.update(sim.all_sim)
+        return results
+
+    def test_shards(self):
+        single = self.similarity(os.path.join(self.folder, 'single'))
+        single.run(save=False)
+        expected = self.results(single)
+
+        shard_dir = os.path.join(self.folder, 'shards')
+        for shard in range(3):
+            self.similarity(shard_dir).compute_shard(shard, 3)
+
+        merged = self.similarity(os.path.join(self.folder, 'merged'), shard_dir=shard_dir)
+        merged.run(save=False)
+        # only the shards are left
+        self.assertEqual(sorted(os.listdir(shard_dir)), ['shard-%d-of-3.h5' % (i,) for i in (1, 2, 3)])
+        for name, result in self.results(merged).items():
+            self.assertTrue(result.index.equals(expected[name].index), name)
+            # blocks sum in a different order, values may differ in the last bit
+            np.testing.assert_allclose(result.values, expected[name].values, rtol=1e-12, atol=1e-14, err_msg=name)
+
+    def test_missing_shard(self):
+        shard_dir = os.path.join(self.folder, 'shards')
+        self.similarity(shard_dir).compute_shard(0, 2)
+        with self.assertRaises(Exception):
+            self.similarity(os.path.join(self.folder, 'merged'), shard_dir=shard_dir).run(save=False)
+
+    def test_top_k(self):
+        full = self.similarity(os.path.join(self.folder, 'full'))
+        full.run(save=False)
+        expected = self.results(full)
+
+        top = self.similarity(os.path.join(self.folder, 'top'), top_k=4)
+        top.run(save=False)
+        for name in ('exe_aa', 'exe_qq', 'nxn_aa', 'nxn_qq', 'fg_qq', 'fg_aa', 'ts_qq', 'ts_aa'):
+            self.assertIsNone(top.planner._layers[name][0].result, '%s layer was computed' % (name,))
+
+        for name, result in self.results(top).items():
+            self.assertIsInstance(result, EdgeList)
+            edges = result.to_frame()
+            reference = EdgeList.from_frame(expected[name], 4).to_frame()
+            self.assertEqual(sorted(edges['source']), sorted(reference['source']), name)
+            # mapped ALL values tie, compare the partner values of every strain
+            for source, partners in edges.groupby('source'):
+                np.testing.assert_allclose(
+                    np.sort(partners['r'].values), np.sort(reference['r'][reference['source'] == source].values),
+                    rtol=1e-6, err_msg=name)
+
+    def test_condensed(self):
+        full = self.similarity(os.path.join(self.folder, 'full'))
+        full.run(save=False)
+        expected = self.results(full)
+
+        condensed = self.similarity(os.path.join(self.folder, 'condensed'), condensed=True)
+        condensed.run(save=False)
+        for name in ('exe_aa', 'exe_qq', 'nxn_aa', 'nxn_qq', 'fg_qq', 'fg_aa', 'ts_qq', 'ts_aa'):
+            self.assertIsNone(condensed.planner._layers[name][0].result, '%s layer was computed' % (name,))
+
+        for name, result in self.results(condensed).items():
+            self.assertIsInstance(result, CondensedMatrix)
+            self.assertEqual(result.labels, list(expected[name].index), name)
+            # the diagonal is not stored, normalized layers map it away from 0
+            values = np.array(expected[name].values)
+            np.fill_diagonal(values, 0)
+            np.testing.assert_allclose(result.to_square(), values, atol=1e-12, err_msg=name)
+
+    def test_parallel_layers(self):
+        single = self.similarity(os.path.join(self.folder, 'single'))
+        single.run(save=False)
+        expected = self.results(single)
+
+        parallel = self.similarity(os.path.join(self.folder, 'parallel'))
+        parallel.run(n_workers=4, save=False)
+        for name, result in self.results(parallel).items():
+            p.testing.assert_frame_equal(result, expected[name], obj=name)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.folder, 'cache')
+        first = self.similarity(os.path.join(self.folder, 'first'), cache_dir=cache_dir)
+        first.run(save=False)
+        expected = self.results(first)
+
+        # a rerun on the same data reads everything from the cache
+        with mock.patch.object(correlation, 'correlation', side_effect=AssertionError('recomputed')), \
+                mock.patch.object(QuantileMapper, 'fit', side_effect=AssertionError('refitted')):
+            second = self.similarity(os.path.join(self.folder, 'second'), cache_dir=cache_dir)
+            second.run(save=False)
+        for name, result in self.results(second).items():
+            p.testing.assert_frame_equal(result, expected[name], check_names=False, obj=name)
+
+    def test_resume(self):
+        output = os.path.join(self.folder, 'out')
+        checkpoint = os.path.join(self.folder, 'checkpoint')
+        self.similarity(output, checkpoint_dir=checkpoint).run()
+        outputs = sorted(os.listdir(output))
+        expected = {}
+        for name in outputs:
+            with open(os.path.join(output, name), 'rb') as inp:
+                expected[name] = inp.read()
+
+        # a run killed while merging the ALL layers
+        manifest = os.path.join(checkpoint, 'manifest.json')
+        with open(manifest) as inp:
+            state = json.load(inp)
+        for task in ('ALL', 'save ALL', 'normalize ts_aa'):
+            del state['done'][task]
+        with open(manifest, 'w') as out:
+            json.dump(state, out)
+        for name in outputs:
+            if name.startswith('cc_ALL'):
+                os.remove(os.path.join(output, name))
+
+        # finished correlations and the normalization model are not recomputed
+        with mock.patch.object(correlation, 'correlation', side_effect=AssertionError('recomputed')), \
+                mock.patch.object(QuantileMapper, 'fit', side_effect=AssertionError('refitted')):
+            self.similarity(output, checkpoint_dir=checkpoint, resume=True).run()
+
+        self.assertEqual(sorted(os.listdir(output)), outputs)
+        for name in outputs:
+            with open(os.path.join(output, name), 'rb') as inp:
+                self.assertEqual(inp.read(), expected[name], name)
+
+    def test_resume_changed_input(self):
+        output = os.path.join(self.folder, 'out')
+        checkpoint = os.path.join(self.folder, 'checkpoint')
+        self.similarity(output, checkpoint_dir=checkpoint).run(all=False)
+
+        with open(self.ts_path, 'a') as out:
+            out.write('\n')
+        with self.assertRaises(ValueError):
+            self.similarity(output, checkpoint_dir=checkpoint, resume=True).run(all=False)
+
+
+class BjvTestSuite(unittest.TestCase):
+    """Screens in Ben's hdf5 format are read when a layer first needs them."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'data.mat')
+        rng = np.random.default_rng(0)
+        self.expected = {}
+        with h5py.File(self.path, 'w') as h5:
+            for name, arrays, queries in (('ts', strains('tsa', 8), strains('tsq', 5)),
+                                          ('fg', strains('dma', 9), strains('sn', 4))):
+                # strains are both arrays and queries in the stored matrix
+                orfs = arrays + queries + ['Y999_unused']
+                eps = rng.normal(size=(len(orfs), len(orfs)))
+                group = '%s_merge' % (name,)
+                write_matlab_strings(h5, group + '/Cannon/Orf', orfs)
+                is_array = np.array([[o in arrays] for o in orfs], dtype=np.uint8)
+                h5.create_dataset(group + '/Cannon/isArray', data=is_array)
+                h5.create_dataset(group + '/Cannon/isQuery', data=np.array([[o in queries for o in orfs]], dtype=np.uint8))
+                h5.create_dataset(group + '/eps', data=eps, chunks=(4, 4))
+                self.expected[name] = p.DataFrame(eps[:len(arrays), len(arrays):-1], index=arrays, columns=queries)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lazy_loading(self):
+        sim = Similarity(self.path, self.folder, input_format=Similarity.INPUT_FORMAT_BJV, strain_map={'x': 'y'})
+        self.assertEqual(sim._data, {})
+
+        p.testing.assert_frame_equal(sim.ts_data, self.expected['ts'])
+        self.assertEqual(list(sim._data), ['ts'])
+        p.testing.assert_frame_equal(sim.fg_data, self.expected['fg'])
+
+        single = Similarity(self.path, self.folder, input_format=Similarity.INPUT_FORMAT_BJV, strain_map={'x': 'y'},
+                            scores_dtype=np.float32)
+        self.assertEqual(single.ts_data.values.dtype, np.float32)
+        np.testing.assert_array_equal(single.ts_data.values, self.expected['ts'].values.astype(np.float32))
+
+
+class ArgumentsTestSuite(unittest.TestCase):
+    """Command line arguments are checked when they are parsed."""
+
+    def test_jobs(self):
+        self.assertEqual(similarity._jobs('4'), 4)
+        self.assertEqual(similarity._jobs('-1'), -1)
+        for value in ('0', 'all'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                similarity._jobs(value)
+
+    def test_positive_int(self):
+        self.assertEqual(similarity._positive_int('2'), 2)
+        for value in ('0', '-1', 'two'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                similarity._positive_int(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as p
+
+from sga.toolbox.storage import CondensedMatrix, EdgeList, LazyMatrix, write_matrix, write_tsv
+
+
+def similarities(size=30, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(size, size))
+    values[rng.random(values.shape) < .1] = np.nan
+    values = (values + values.T) / 2
+    np.fill_diagonal(values, 0)
+    labels = ['allele-%d' % i for i in range(size)]
+    return p.DataFrame(values, index=labels, columns=labels)
+
+
+class StorageTestSuite(unittest.TestCase):
+    """Saved similarity matrices read back the same in every format."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read(self, path):
+        with open(path, 'rb') as inp:
+            return inp.read()
+
+    def test_tsv(self):
+        df = similarities()
+        df.iloc[0, 1:6] = [np.inf, -np.inf, -0., 1e-300, 123456789.123]
+        for dtype in (np.float64, np.float32):
+            frame = df.astype(dtype)
+            expected = os.path.join(self.folder, 'expected.txt')
+            frame.to_csv(expected, sep='\t')
+            for chunk_size in (1, 7, 1024):
+                path = os.path.join(self.folder, 'result.txt')
+                write_tsv(frame, path, chunk_size=chunk_size)
+                self.assertEqual(self.read(path), self.read(expected), (dtype, chunk_size))
+
+    def test_matrix(self):
+        df = similarities()
+        for name in ('matrix.h5', 'matrix.npy'):
+            path = os.path.join(self.folder, name)
+            write_matrix(df, path, chunk_size=7)
+            with LazyMatrix.open(path) as matrix:
+                p.testing.assert_frame_equal(matrix.to_frame(), df)
+                np.testing.assert_array_equal(matrix.row('allele-3').values, df.loc['allele-3'].values)
+
+    def test_condensed(self):
+        df = similarities()
+        for name in ('condensed.h5', 'condensed.npy'):
+            path = os.path.join(self.folder, name)
+            CondensedMatrix.from_frame(df, np.float32).save(path)
+            with CondensedMatrix.open(path) as matrix:
+                self.assertEqual(matrix.labels, list(df.index))
+                np.testing.assert_allclose(matrix.to_square(), df.values, atol=1e-6)
+                pairs = [(5, 2), (2, 5), (3, 3), (0, 29)]
+                np.testing.assert_allclose([matrix.pair(df.index[i], df.index[j]) for i, j in pairs],
+                                           [df.iloc[i, j] for i, j in pairs], atol=1e-6)
+
+    def test_edges(self):
+        df = similarities()
+        path = os.path.join(self.folder, 'edges.h5')
+        EdgeList.from_frame(df, 3).save(path)
+        with EdgeList.open(path) as edges:
+            self.assertEqual(len(edges), 3 * len(df))
+            neighbors = edges.neighbors('allele-4')
+            expected = df.loc['allele-4'].drop('allele-4').nlargest(3)
+            self.assertEqual(sorted(neighbors.index), sorted(expected.index))
+
+
+if __name__ == '__main__':
+    unittest.main()
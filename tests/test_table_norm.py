@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import unittest
+
+import numpy as np
+import pandas as p
+
+from sga.toolbox.table_norm import QuantileMapper, normalize, table_normalize
+
+
+def baseline_table_normalize(data1, data2, data3):
+    """Table normalization as originally ported from matlab."""
+    data1 = data1.values.flatten()
+    data2 = data2.values.flatten()
+
+    nn = ~np.isnan(data1) & ~np.isnan(data2)
+    percentiles = np.linspace(100. / nn.sum(), 100, num=nn.sum())
+    ref_quantiles = np.percentile(data1[nn], percentiles, method='midpoint')
+    data2_norm = np.zeros(nn.sum())
+    data2_norm[np.argsort(data2[nn], kind='mergesort')] = ref_quantiles
+
+    table = p.DataFrame({'data2': data2[nn], 'data2_norm': data2_norm})
+    table = table.sort_values('data2', kind='mergesort').groupby('data2').median().reset_index()
+    t1, t2 = table.data2.values, table.data2_norm.values
+
+    data = data3.values.flatten()
+    result = np.full_like(data, np.nan)
+    present = ~np.isnan(data)
+    index = np.zeros(present.sum(), dtype=np.int64)
+    for x in t1:
+        index += data[present] > x
+    index[index == 0] = 1
+    result[present] = t2[index - 1]
+    return p.DataFrame(result.reshape(data3.shape), index=data3.index, columns=data3.columns)
+
+
+class TableNormTestSuite(unittest.TestCase):
+    """Quantile mapping matches the original table normalization."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+
+        def table(scale, shift):
+            values = rng.normal(shift, scale, size=(40, 30)).round(3) # ties between values
+            values[rng.random(values.shape) < .15] = np.nan
+            return p.DataFrame(values)
+
+        self.data1, self.data2, self.data3 = table(1, 0), table(.3, .2), table(.3, .2)
+
+    def test_baseline(self):
+        expected = baseline_table_normalize(self.data1, self.data2, self.data3)
+        result = table_normalize(self.data1, self.data2, self.data3)
+        np.testing.assert_array_equal(result.values, expected.values)
+
+        mapper = QuantileMapper.fit(self.data1, self.data2)
+        np.testing.assert_array_equal(mapper.transform(self.data3).values, expected.values)
+
+    def test_sketch(self):
+        expected = table_normalize(self.data1, self.data2, self.data3).values
+        result = table_normalize(self.data1, self.data2, self.data3, eps=.001).values
+        self.assertTrue(np.array_equal(np.isnan(result), np.isnan(expected)))
+        # values are off by a small rank error, only the sparse tails move more
+        error = np.abs(result - expected)[~np.isnan(expected)]
+        self.assertLess(np.percentile(error, 90), .02)
+
+    def test_unsorted_table(self):
+        table = p.DataFrame([[.05, .5, 1., np.nan]])
+        expected = normalize(table, [0, .1, .6], [10, 11, 12]).values
+        np.testing.assert_array_equal(normalize(table, [.6, 0, .1], [12, 10, 11]).values, expected)
+        np.testing.assert_array_equal(QuantileMapper([.1, .6, 0], [11, 12, 10]).transform(table).values, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from sga.toolbox import correlation as corr
+from sga.toolbox.storage import LazyMatrix
+
+from .test_correlation import random_scores
+
+
+class TiledCorrelationTestSuite(unittest.TestCase):
+    """Tiled correlation on disk and its resume."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_tiled(self):
+        data = random_scores(rows=45)
+        for axis in ('rows', 'columns'):
+            expected = corr.correlation(data, axis).values
+            for name, tile_size in (('tiled.npy', 7), ('tiled.h5', 16), ('single.h5', 100)):
+                path = os.path.join(self.folder, name)
+                with corr.tiled_correlation(data, path, axis, tile_size=tile_size, dtype=np.float32) as result:
+                    self.assertEqual(result.values.dtype, np.float32)
+                    np.testing.assert_allclose(result.to_frame().values, expected, atol=1e-6)
+                os.remove(path)
+
+    def test_resume(self):
+        data = random_scores(rows=50)
+        expected = corr.correlation(data).values
+        for name in ('tiled.npy', 'tiled.h5'):
+            path = os.path.join(self.folder, name)
+            with corr.tiled_correlation(data, path, tile_size=16, resume=True) as result:
+                np.testing.assert_allclose(result.to_frame().values, expected, atol=1e-12)
+            self.assertFalse(os.path.exists(path + '.tiles'))
+
+            # an interrupted run, only the first tiles are done
+            with LazyMatrix.open(path, mode='r+') as result:
+                result[:] = np.nan
+            with open(path + '.tiles', 'w') as out:
+                out.write(corr._tile_digest(data.index, data.values, 'rows', 16, np.float64) + '\n0 0\n0 16\n0')
+            with corr.tiled_correlation(data, path, tile_size=16, resume=True) as result:
+                values = result.to_frame().values
+            np.testing.assert_allclose(values[16:, 16:], expected[16:, 16:], atol=1e-12)
+            self.assertTrue(np.isnan(values[:16, :32]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
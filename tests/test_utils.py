@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+from .context import sga
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+import pandas as p
+
+try:
+    from unittest import mock
+except ImportError: # python 2
+    import mock
+
+from sga.toolbox import utils
+
+
+def write_matlab_strings(h5, name, strings):
+    """Save strings like MATLAB saves a cell array of char arrays."""
+    refs = []
+    for i, string in enumerate(strings):
+        chars = np.frombuffer(string.encode('utf-16-le'), dtype='<u2').reshape(-1, 1)
+        if not len(chars):
+            item = h5.create_dataset('#refs#/%s_%d' % (name.replace('/', '_'), i), data=np.zeros(2, dtype=np.uint64))
+            item.attrs['MATLAB_empty'] = 1
+        else:
+            item = h5.create_dataset('#refs#/%s_%d' % (name.replace('/', '_'), i), data=chars)
+        refs.append(item.ref)
+    dataset = h5.create_dataset(name, (1, len(refs)), dtype=h5py.ref_dtype)
+    dataset[0] = refs
+    return dataset
+
+
+class ScoreMatrixTestSuite(unittest.TestCase):
+    """Text score matrices are parsed once and read back from the sidecar."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'scores.txt')
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=(30, 8))
+        values[rng.random(values.shape) < .2] = np.nan
+        self.scores = p.DataFrame(values, index=['Y%03d_tsa%d' % (i, i) for i in range(30)],
+                                  columns=['Y%03d_tsq%d' % (i, i) for i in range(8)])
+        self.scores.to_csv(self.path, sep='\t')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def sidecars(self):
+        return sorted(glob.glob(self.path + '.*.npy'))
+
+    def test_exact(self):
+        df = utils.load_score_matrix(self.path, sidecar=False)
+        np.testing.assert_array_equal(df.values, self.scores.values)
+        self.assertEqual(list(df.index), list(self.scores.index))
+        self.assertEqual(list(df.columns), list(self.scores.columns))
+
+    def test_sidecar(self):
+        parsed = utils.load_score_matrix(self.path)
+        self.assertEqual(len(self.sidecars()), 1)
+
+        with mock.patch.object(utils, 'read_score_matrix', side_effect=AssertionError('parsed again')):
+            cached = utils.load_score_matrix(self.path)
+        np.testing.assert_array_equal(cached.values, parsed.values)
+        self.assertEqual(list(cached.index), list(self.scores.index))
+        self.assertEqual(list(cached.columns), list(self.scores.columns))
+
+        # other value types get their own sidecar
+        single = utils.load_score_matrix(self.path, np.float32)
+        self.assertEqual(single.values.dtype, np.float32)
+        self.assertEqual(len(self.sidecars()), 2)
+
+        # a changed file replaces the stale sidecar of the same type
+        self.scores.iloc[0, 0] = 5.
+        self.scores.to_csv(self.path, sep='\t')
+        os.utime(self.path, (1, 1))
+        changed = utils.load_score_matrix(self.path)
+        self.assertEqual(changed.iloc[0, 0], 5.)
+        self.assertEqual(len(self.sidecars()), 2)
+
+
+class Hdf5ReadTestSuite(unittest.TestCase):
+    """Selections read from hdf5 datasets match fancy indexing in memory."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'data.h5')
+        self.values = np.random.default_rng(0).normal(size=(120, 90))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_selection(self):
+        rng = np.random.default_rng(1)
+        rows = np.sort(rng.choice(120, 50, replace=False))
+        columns = np.sort(rng.choice(90, 30, replace=False))
+        expected = self.values[np.ix_(rows, columns)]
+        with h5py.File(self.path, 'w') as h5:
+            h5.create_dataset('contiguous', data=self.values)
+            h5.create_dataset('chunked', data=self.values, chunks=(16, 16), compression='gzip')
+            for name in ('contiguous', 'chunked'):
+                for block_size in (None, 1, 20):
+                    result = utils.hdf5_read_selection(h5[name], rows, columns, block_size=block_size)
+                    np.testing.assert_array_equal(result, expected)
+                single = utils.hdf5_read_selection(h5[name], rows, columns, np.float32)
+                self.assertEqual(single.dtype, np.float32)
+                np.testing.assert_array_equal(single, expected.astype(np.float32))
+                self.assertEqual(utils.hdf5_read_selection(h5[name], [], columns).shape, (0, 30))
+
+    def test_str_list(self):
+        strings = ['YAL001C_tsq1', '', u'Y002_\u00e9\u4e2d', 'YAL001C_tsq1']
+        with h5py.File(self.path, 'w') as h5:
+            listref = write_matlab_strings(h5, 'orfs', strings)
+            # the last string points to the same object as the first
+            listref[0, 3] = listref[0, 0]
+            other = write_matlab_strings(h5, 'other', ['Y003_dma3'])
+
+        with h5py.File(self.path, 'r') as h5:
+            expected = np.array(strings, dtype=str)
+            np.testing.assert_array_equal(utils.hdf5_read_str_list(h5, h5['orfs']), expected)
+            np.testing.assert_array_equal(utils.hdf5_read_str_list(h5, h5['orfs'][0]), expected)
+
+            cache = {}
+            np.testing.assert_array_equal(utils.hdf5_read_str_list(h5, h5['orfs'], cache), expected)
+            self.assertEqual(sorted(cache.values()), sorted(set(strings)))
+            with mock.patch.object(utils, '_read_matlab_str', side_effect=AssertionError('read again')):
+                np.testing.assert_array_equal(utils.hdf5_read_str_list(h5, h5['orfs'], cache), expected)
+            np.testing.assert_array_equal(utils.hdf5_read_str_list(h5, h5['other'], cache), ['Y003_dma3'])
+            self.assertEqual(len(cache), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()